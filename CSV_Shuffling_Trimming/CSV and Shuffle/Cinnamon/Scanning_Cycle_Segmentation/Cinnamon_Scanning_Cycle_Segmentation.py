@@ -1,12 +1,20 @@
 import pandas as pd
+import sys
+from pathlib import Path
 from collections import defaultdict, deque
 
+# Intermediate CSVs are compressed when ENOSE_COMPRESSION is set (Pipeline_Tools/csv_codec.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
+from csv_codec import csv_name, find_csv, write_csv
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+from dtype_schema import read_csv
+
 # === Configuration ===
-INPUT_CSV  = "Cinnamon_Sem_Two_Recorded.csv"              # original file (won't be overwritten)
-OUTPUT_CSV = "Cinnamon_Sem_Two_Recorded_reordered.csv"    # new file with corrected ordering
+INPUT_CSV  = find_csv("Cinnamon_Sem_Two_Recorded.csv")            # original file (won't be overwritten)
+OUTPUT_CSV = csv_name("Cinnamon_Sem_Two_Recorded_reordered.csv")  # new file with corrected ordering
 
 # === Load data ===
-df = pd.read_csv(INPUT_CSV)
+df = read_csv(INPUT_CSV)
 
 # Basic sanity checks
 required_cols = {"sensor_index", "heater_profile_step_index", "scanning_cycle_index", "timestamp_since_poweron"}
@@ -87,7 +95,7 @@ reordered = pd.concat([df.iloc[good_indices], df.iloc[outlier_indices]], axis=0)
 reordered = reordered.drop(columns=["_orig_row"]).reset_index(drop=True)
 
 # === Write new file (non-destructive) ===
-reordered.to_csv(OUTPUT_CSV, index=False)
+write_csv(reordered, OUTPUT_CSV)
 
 # === Console report ===
 print("=== Loop Reconstruction Report (Cinnamon) ===")
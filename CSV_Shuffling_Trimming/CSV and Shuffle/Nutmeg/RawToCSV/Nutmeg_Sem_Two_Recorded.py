@@ -1,9 +1,15 @@
 import json
 import pandas as pd
+import sys
+from pathlib import Path
+
+# Intermediate CSVs are compressed when ENOSE_COMPRESSION is set (Pipeline_Tools/csv_codec.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
+from csv_codec import csv_name, write_csv
 
 # Update these filenames if your paths differ
 input_file = 'Nutmeg_Sem_Two_Recorded.txt'
-output_file = 'Nutmeg_Sem_Two_Recorded.csv'
+output_file = csv_name('Nutmeg_Sem_Two_Recorded.csv')
 
 # 1. Load the raw JSON-formatted text file
 with open(input_file, 'r') as f:
@@ -17,7 +23,7 @@ data_rows = payload['rawDataBody']['dataBlock']
 
 # 4. Build a DataFrame and export to CSV
 df = pd.DataFrame(data_rows, columns=columns)
-df.to_csv(output_file, index=False)
+write_csv(df, output_file)
 
 # 5. Print a quick summary
 print(f"Wrote {df.shape[0]} rows and {df.shape[1]} columns to '{output_file}'")
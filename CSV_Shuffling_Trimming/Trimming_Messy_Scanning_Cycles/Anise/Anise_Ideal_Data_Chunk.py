@@ -1,10 +1,17 @@
 import pandas as pd
+import sys
 from pathlib import Path
 
+# Intermediate CSVs are compressed when ENOSE_COMPRESSION is set (Pipeline_Tools/csv_codec.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "Pipeline_Tools"))
+from csv_codec import csv_name, csv_stem, find_csv, write_csv
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+from dtype_schema import read_csv
+
 # === Configuration ===
 # Change this path if needed:
-INPUT_PATH = Path("Anise_Raw_Data_Semester2_reordered.csv")
-OUTPUT_PATH = INPUT_PATH.with_name(INPUT_PATH.stem + "_perfect_only.csv")
+INPUT_PATH = find_csv("Anise_Raw_Data_Semester2_reordered.csv")
+OUTPUT_PATH = INPUT_PATH.with_name(csv_name(csv_stem(INPUT_PATH) + "_perfect_only.csv"))
 
 CHUNK_SIZE = 400
 EXPECTED_SENSOR = set(range(0, 8))   # 0..7
@@ -49,7 +56,7 @@ def is_perfect_chunk(chunk: pd.DataFrame) -> bool:
     return True
 
 def main():
-    df = pd.read_csv(INPUT_PATH)
+    df = read_csv(INPUT_PATH)
 
     perfect_rows = 0
     n = len(df)
@@ -70,7 +77,7 @@ def main():
     imperfect_rows = n - perfect_rows
 
     # Write out only the perfect prefix
-    df.iloc[:perfect_rows].to_csv(OUTPUT_PATH, index=False)
+    write_csv(df.iloc[:perfect_rows], OUTPUT_PATH)
 
     # Report (CSV row numbers: header is row 1, first data row is row 2)
     if imperfect_rows > 0:
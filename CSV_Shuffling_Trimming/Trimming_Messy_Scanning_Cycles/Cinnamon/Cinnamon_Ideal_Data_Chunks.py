@@ -1,11 +1,18 @@
 import pandas as pd
+import sys
 from pathlib import Path
 
+# Intermediate CSVs are compressed when ENOSE_COMPRESSION is set (Pipeline_Tools/csv_codec.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[3] / "Pipeline_Tools"))
+from csv_codec import csv_name, csv_stem, find_csv, write_csv
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+from dtype_schema import read_csv
+
 # === Change ONLY this path per spice ===
-INPUT_PATH = Path("Cinnamon_Sem_Two_Recorded_reordered.csv")
+INPUT_PATH = find_csv("Cinnamon_Sem_Two_Recorded_reordered.csv")
 # ======================================
 
-OUTPUT_PATH = INPUT_PATH.with_name(INPUT_PATH.stem + "_perfect_only.csv")
+OUTPUT_PATH = INPUT_PATH.with_name(csv_name(csv_stem(INPUT_PATH) + "_perfect_only.csv"))
 
 CHUNK_SIZE = 400
 EXPECTED_SENSOR = set(range(0, 8))   # 0..7
@@ -41,7 +48,7 @@ def is_perfect_chunk(chunk: pd.DataFrame) -> bool:
     return True
 
 def main():
-    df = pd.read_csv(INPUT_PATH)
+    df = read_csv(INPUT_PATH)
 
     perfect_rows = 0
     n = len(df)
@@ -58,7 +65,7 @@ def main():
     imperfect_start_idx = perfect_rows
     imperfect_rows = n - perfect_rows
 
-    df.iloc[:perfect_rows].to_csv(OUTPUT_PATH, index=False)
+    write_csv(df.iloc[:perfect_rows], OUTPUT_PATH)
 
     if imperfect_rows > 0:
         csv_row_number_start = imperfect_start_idx + 2  # header is row 1
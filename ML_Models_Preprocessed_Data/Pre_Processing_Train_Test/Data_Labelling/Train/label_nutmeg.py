@@ -1,25 +1,33 @@
 from pathlib import Path
-import pandas as pd
 import json
 import argparse
+import sys
+
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
 
 SPICE = "Nutmeg"
 LABEL_MAP = {"Anise": 0, "Chilli": 1, "Cinnamon": 2, "Nutmeg": 3}
 DEFAULT_OUT_DIR = Path("../labeled")
 
 def safe_outpath(base: Path) -> Path:
+    from csv_codec import csv_stem
     if not base.exists():
         return base
+    stem = csv_stem(base)   # keep .csv plus any codec suffix last
     i = 1
     while True:
-        cand = base.with_name(f"{base.stem}_{i}{base.suffix}")
+        cand = base.with_name(f"{stem}_{i}{base.name[len(stem):]}")
         if not cand.exists():
             return cand
         i += 1
 
 def main(src: Path, out_dir: Path = DEFAULT_OUT_DIR):
+    import pandas as pd
+    from dtype_schema import read_csv
+    from csv_codec import csv_name, csv_stem, write_csv
     out_dir.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(src)
+    df = read_csv(src)
 
     df["spice"]  = SPICE
     df["target"] = LABEL_MAP[SPICE]
@@ -28,8 +36,8 @@ def main(src: Path, out_dir: Path = DEFAULT_OUT_DIR):
     else:
         df["group_id"] = f"{SPICE}_file"
 
-    out_path = safe_outpath(out_dir / f"{src.stem}_labeled.csv")
-    df.to_csv(out_path, index=False)
+    out_path = safe_outpath(out_dir / csv_name(f"{csv_stem(src)}_labeled.csv"))
+    write_csv(df, out_path)
 
     (out_dir / "label_mapping.json").write_text(json.dumps(LABEL_MAP, indent=2))
     print(f"[OK] Labeled file: {out_path}")
@@ -1,9 +1,15 @@
 from pathlib import Path
+import sys
 import pandas as pd
 
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
+from dtype_schema import read_csv
+from csv_codec import csv_name, csv_stem, write_csv
+
 def merge_labeled_files(src_dir: Path, out_path: Path):
     # Find all labeled CSVs in the source directory
-    files = list(src_dir.glob("*_labeled.csv"))
+    files = list(src_dir.glob("*_labeled.csv*"))
     if not files:
         raise FileNotFoundError(f"No labeled CSV files found in {src_dir}")
 
@@ -12,12 +18,12 @@ def merge_labeled_files(src_dir: Path, out_path: Path):
         print(" -", f.name)
 
     # Load and concatenate
-    dfs = [pd.read_csv(f) for f in files]
+    dfs = [read_csv(f) for f in files]
     master = pd.concat(dfs, ignore_index=True)
 
     # Save merged file
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    master.to_csv(out_path, index=False)
+    write_csv(master, out_path)
 
     print(f"\n[OK] Merged dataset written to: {out_path}")
     print(f"[INFO] Shape: {master.shape[0]} rows × {master.shape[1]} columns")
@@ -25,6 +31,6 @@ def merge_labeled_files(src_dir: Path, out_path: Path):
 if __name__ == "__main__":
     # Adjust paths as needed
     src_dir = Path("../labeled")          # where your 4 labeled CSVs are
-    out_path = Path("../labeled/master_training_labeled.csv")
+    out_path = csv_name(Path("../labeled/master_training_labeled.csv"))
 
     merge_labeled_files(src_dir, out_path)
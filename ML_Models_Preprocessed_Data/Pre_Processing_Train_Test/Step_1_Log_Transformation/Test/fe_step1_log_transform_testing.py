@@ -1,8 +1,10 @@
 # fe_step1_log_transform.py
 from pathlib import Path
 import argparse
-import pandas as pd
-import numpy as np
+import sys
+
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
 
 REQ_COLS = [
     "group_id","spice","target",
@@ -11,16 +13,22 @@ REQ_COLS = [
 ]
 
 def safe_outpath(base: Path) -> Path:
+    from csv_codec import csv_stem
     if not base.exists(): return base
+    stem = csv_stem(base)   # keep .csv plus any codec suffix last
     i = 1
     while True:
-        cand = base.with_name(f"{base.stem}_{i}{base.suffix}")
+        cand = base.with_name(f"{stem}_{i}{base.name[len(stem):]}")
         if not cand.exists(): return cand
         i += 1
 
 def main(src: Path, out_dir: Path):
+    import pandas as pd
+    from dtype_schema import read_csv
+    from csv_codec import csv_name, csv_stem, write_csv
+    import numpy as np
     out_dir.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(src)
+    df = read_csv(src)
 
     missing = [c for c in REQ_COLS if c not in df.columns]
     if missing:
@@ -32,8 +40,8 @@ def main(src: Path, out_dir: Path):
     # Sort for deterministic per-step slope calculation later
     df = df.sort_values(["group_id","sensor_index","heater_profile_step_index","timestamp_since_poweron"])
 
-    out_path = safe_outpath(out_dir / f"{src.stem}_step1_log.csv")
-    df.to_csv(out_path, index=False)
+    out_path = safe_outpath(out_dir / csv_name(f"{csv_stem(src)}_step1_log.csv"))
+    write_csv(df, out_path)
     print(f"[OK] Wrote: {out_path}  (rows={len(df)})")
 
 if __name__ == "__main__":
@@ -1,8 +1,11 @@
 # fe_step2_stepwise_summaries.py
+from __future__ import annotations
 from pathlib import Path
 import argparse
-import pandas as pd
-import numpy as np
+import sys
+
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
 
 REQ_COLS = [
     "group_id","spice","target",
@@ -11,14 +14,18 @@ REQ_COLS = [
 ]
 
 def safe_outpath(base: Path) -> Path:
+    from csv_codec import csv_stem
     if not base.exists(): return base
+    stem = csv_stem(base)   # keep .csv plus any codec suffix last
     i = 1
     while True:
-        cand = base.with_name(f"{base.stem}_{i}{base.suffix}")
+        cand = base.with_name(f"{stem}_{i}{base.name[len(stem):]}")
         if not cand.exists(): return cand
         i += 1
 
 def per_group_stats(g: pd.DataFrame) -> pd.Series:
+    import pandas as pd
+    import numpy as np
     # NEW: enforce sort by timestamp inside the group for safety
     g = g.sort_values("timestamp_since_poweron", kind="mergesort")
 
@@ -48,18 +55,21 @@ def per_group_stats(g: pd.DataFrame) -> pd.Series:
     })
 
 def main(src: Path, out_dir: Path):
+    import pandas as pd
+    from dtype_schema import read_csv
+    from csv_codec import csv_name, csv_stem, write_csv
     out_dir.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(src)
+    df = read_csv(src)
 
     missing = [c for c in REQ_COLS if c not in df.columns]
     if missing:
         raise ValueError(f"Missing required columns: {missing}")
 
     keys = ["group_id","spice","target","sensor_index","heater_profile_step_index"]
-    agg = df.groupby(keys, sort=False).apply(per_group_stats).reset_index()
+    agg = df.groupby(keys, sort=False, observed=True).apply(per_group_stats).reset_index()
 
-    out_path = safe_outpath(out_dir / f"{src.stem}_step2_stepwise.csv")
-    agg.to_csv(out_path, index=False)
+    out_path = safe_outpath(out_dir / csv_name(f"{csv_stem(src)}_step2_stepwise.csv"))
+    write_csv(agg, out_path)
     print(f"[OK] Wrote: {out_path}  (rows={len(agg)})")
 
 if __name__ == "__main__":
@@ -1,10 +1,11 @@
 # fe_step3_within_cycle_norm.py
 from pathlib import Path
 import argparse
-import pandas as pd
-import numpy as np
 import sys
 
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
+
 # Columns expected from Step 2
 REQ_COLS = [
     "group_id","spice","target",
@@ -18,19 +19,24 @@ REQ_COLS = [
 REL_BASE_COLS = ["log_mean","log_median","log_p10","log_p90"]
 
 def safe_outpath(base: Path) -> Path:
+    from csv_codec import csv_stem
     if not base.exists():
         return base
+    stem = csv_stem(base)   # keep .csv plus any codec suffix last
     i = 1
     while True:
-        cand = base.with_name(f"{base.stem}_{i}{base.suffix}")
+        cand = base.with_name(f"{stem}_{i}{base.name[len(stem):]}")
         if not cand.exists():
             return cand
         i += 1
 
 def main(src: Path, out_dir: Path):
+    import pandas as pd
+    from dtype_schema import read_csv
+    from csv_codec import csv_name, csv_stem, write_csv
     # Make sure output directory exists
     out_dir.mkdir(parents=True, exist_ok=True)
-    df = pd.read_csv(src)
+    df = read_csv(src)
 
     # Check if required columns are present
     missing = [c for c in REQ_COLS if c not in df.columns]
@@ -50,8 +56,8 @@ def main(src: Path, out_dir: Path):
     )
 
     # Count how many pairs have missing step 0
-    expected_pairs = df.groupby(["group_id","sensor_index"]).size().shape[0]
-    have_base_pairs = base.groupby(["group_id","sensor_index"]).size().shape[0]
+    expected_pairs = df.groupby(["group_id","sensor_index"], observed=True).size().shape[0]
+    have_base_pairs = base.groupby(["group_id","sensor_index"], observed=True).size().shape[0]
     if have_base_pairs < expected_pairs:
         missing_pairs = expected_pairs - have_base_pairs
         print(f"[WARN] {missing_pairs} (group_id,sensor) pairs lack step-0 baseline. "
@@ -65,8 +71,8 @@ def main(src: Path, out_dir: Path):
         merged[f"{c}_rel"] = merged[c] - merged[f"base_{c}"]
 
     # Save the output
-    out_path = safe_outpath(out_dir / f"{Path(src).stem}_step3_norm.csv")
-    merged.to_csv(out_path, index=False)
+    out_path = safe_outpath(out_dir / csv_name(f"{csv_stem(src)}_step3_norm.csv"))
+    write_csv(merged, out_path)
 
     # Print a quick summary
     total_rows = len(merged)
@@ -5,7 +5,10 @@
 
 from pathlib import Path
 import argparse
-import pandas as pd
+import sys
+
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
 
 # Required columns in the master labeled file
 REQ_COLS = [
@@ -14,23 +17,28 @@ REQ_COLS = [
 ]
 
 def safe_outpath(base: Path) -> Path:
+    from csv_codec import csv_stem
     # If base does not exist, use it
     if not base.exists():
         return base
     # Otherwise, append a numeric suffix to avoid overwrite
+    stem = csv_stem(base)   # keep .csv plus any codec suffix last
     i = 1
     while True:
-        cand = base.with_name(f"{base.stem}_{i}{base.suffix}")
+        cand = base.with_name(f"{stem}_{i}{base.name[len(stem):]}")
         if not cand.exists():
             return cand
         i += 1
 
 def main(src: Path, out_dir: Path):
+    import pandas as pd
+    from dtype_schema import read_csv
+    from csv_codec import csv_name, csv_stem, write_csv
     # Create output directory if needed
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # Load the master labeled file (training or testing)
-    df = pd.read_csv(src)
+    df = read_csv(src)
 
     # Check for required columns
     missing = [c for c in REQ_COLS if c not in df.columns]
@@ -40,7 +48,7 @@ def main(src: Path, out_dir: Path):
     # Group by cycle using group_id, and keep spice and target for alignment
     # Compute per-cycle means of temperature, relative_humidity, and pressure
     ctx = (
-        df.groupby(["group_id", "spice", "target"], as_index=False)
+        df.groupby(["group_id", "spice", "target"], as_index=False, observed=True)
           .agg(
               temp_mean=("temperature", "mean"),
               rh_mean=("relative_humidity", "mean"),
@@ -49,8 +57,8 @@ def main(src: Path, out_dir: Path):
     )
 
     # Write the context features file next to the master input
-    out_path = safe_outpath(out_dir / f"{Path(src).stem}_step4_context.csv")
-    ctx.to_csv(out_path, index=False)
+    out_path = safe_outpath(out_dir / csv_name(f"{csv_stem(src)}_step4_context.csv"))
+    write_csv(ctx, out_path)
 
     # Print a small summary
     print(f"[OK] Wrote: {out_path}")
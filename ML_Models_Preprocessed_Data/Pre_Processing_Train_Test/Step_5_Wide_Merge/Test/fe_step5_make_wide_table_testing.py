@@ -4,10 +4,11 @@
 
 from pathlib import Path
 import argparse
-import pandas as pd
-import numpy as np
 import sys
 
+# Column dtypes come from the shared schema in Pipeline_Tools/dtype_schema.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[4] / "Pipeline_Tools"))
+
 # Stats to extract from Step-3 for each (sensor_index, heater_profile_step_index)
 STAT_COLS_ABS = [
     "log_mean","log_std","log_median","log_min","log_max","log_p10","log_p90",
@@ -22,11 +23,13 @@ ID_COLS = ["group_id","spice","target"]
 KEY_COLS = ID_COLS + ["sensor_index","heater_profile_step_index"]
 
 def safe_outpath(base: Path) -> Path:
+    from csv_codec import csv_stem
     if not base.exists():
         return base
+    stem = csv_stem(base)   # keep .csv plus any codec suffix last
     i = 1
     while True:
-        cand = base.with_name(f"{base.stem}_{i}{base.suffix}")
+        cand = base.with_name(f"{stem}_{i}{base.name[len(stem):]}")
         if not cand.exists():
             return cand
         i += 1
@@ -35,12 +38,15 @@ def make_colname(sensor_idx: int, step_idx: int, stat_name: str) -> str:
     return f"S{sensor_idx}_H{step_idx}_{stat_name}"
 
 def main(src_step3: Path, src_ctx: Path, out_dir: Path):
+    import pandas as pd
+    from dtype_schema import read_csv
+    from csv_codec import csv_name, csv_stem, write_csv
     # Create output directory if needed
     out_dir.mkdir(parents=True, exist_ok=True)
 
     # Load inputs
-    df = pd.read_csv(src_step3)
-    ctx = pd.read_csv(src_ctx)
+    df = read_csv(src_step3)
+    ctx = read_csv(src_ctx)
 
     # Basic checks
     needed_cols = set(KEY_COLS + STAT_COLS_ABS + STAT_COLS_REL + [COUNT_COL])
@@ -66,7 +72,7 @@ def main(src_step3: Path, src_ctx: Path, out_dir: Path):
     rows = []
     expected_cells_per_cycle = None  # will compute once we see max sensor/step coverage
 
-    for (gid, sp, tgt), g in df.groupby(ID_COLS, sort=False):
+    for (gid, sp, tgt), g in df.groupby(ID_COLS, sort=False, observed=True):
         entry = {"group_id": gid, "spice": sp, "target": tgt}
 
         # Fill absolute stats
@@ -115,11 +121,11 @@ def main(src_step3: Path, src_ctx: Path, out_dir: Path):
 
     # Build output path and write
     # If the Step-3 file ends with *_step3_norm.csv we can shorten the name; otherwise just append _features
-    stem = Path(src_step3).stem
+    stem = csv_stem(src_step3)
     if stem.endswith("_step3_norm"):
         stem = stem[:-len("_step3_norm")]
-    out_path = safe_outpath(out_dir / f"{stem}_features.csv")
-    final.to_csv(out_path, index=False)
+    out_path = safe_outpath(out_dir / csv_name(f"{stem}_features.csv"))
+    write_csv(final, out_path)
 
     print(f"[OK] Wrote features: {out_path}")
     print(f"[INFO] Columns total: {final.shape[1]}")
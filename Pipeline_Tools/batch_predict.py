@@ -0,0 +1,176 @@
+# batch_predict.py
+# Purpose: Score an arbitrarily large CSV (or Parquet) file with a trained model in bounded memory.
+# The file is read in chunks. Each chunk is predicted on a thread pool, and predictions plus
+# class probabilities are appended to the output CSV in input order as soon as the chunk is done.
+# When the input carries labels (target, or spice names), running accuracy and the confusion matrix
+# are updated per chunk. They are written to <out>_metrics.json at the end, with one progress line
+# every few chunks instead of one line per prediction.
+#
+# Example:
+#   python batch_predict.py --model outputs/RandomForest/rf_model.joblib --src Test_All.csv --out test_predictions.csv
+#   python batch_predict.py --model rp2/rf_model.mmodel --src test_features.csv --out rp2_predictions.csv \
+#       --keep group_id,spice --chunk_rows 20000 --workers 4
+
+from pathlib import Path
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from serve_model import LABEL_MAP, load_model, features_for
+
+KEEP_DEFAULT = ["group_id", "spice", "target", "sensor_index", "heater_profile_step_index", "scanning_cycle_index"]
+LABEL_COL = "target"
+
+def read_chunks(src: Path, columns: list, chunk_rows: int):
+    """Yield DataFrames of at most chunk_rows rows holding only `columns`."""
+    import pandas as pd
+
+    if src.suffix == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet needs pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(src).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    yield from pd.read_csv(src, usecols=columns, chunksize=chunk_rows)
+
+def source_columns(src: Path) -> list:
+    if src.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(src).schema_arrow.names
+    import pandas as pd
+    return list(pd.read_csv(src, nrows=0).columns)
+
+def true_labels(chunk, label_col: str):
+    """Integer labels for the chunk, or None when the file is unlabeled."""
+    if label_col in chunk.columns:
+        return chunk[label_col].to_numpy(dtype=np.int64)
+    if "spice" in chunk.columns:
+        return chunk["spice"].map(LABEL_MAP).to_numpy(dtype=np.int64)
+    return None
+
+def score(model, X: np.ndarray, has_proba: bool):
+    """(predictions, probabilities or None, classes or None) for one chunk."""
+    if has_proba:
+        proba = np.asarray(model.predict_proba(X))
+        classes = np.asarray(getattr(model, "classes_", np.arange(proba.shape[1])))
+        return classes[np.argmax(proba, axis=1)], proba, classes
+    return np.asarray(model.predict(X)), None, None
+
+class RunningMetrics:
+    """Accuracy and confusion matrix accumulated chunk by chunk."""
+
+    def __init__(self, n_classes: int):
+        self.confusion = np.zeros((n_classes, n_classes), dtype=np.int64)
+
+    def update(self, y_true: np.ndarray, y_pred: np.ndarray):
+        ok = (y_true >= 0) & (y_true < len(self.confusion)) & (y_pred >= 0) & (y_pred < len(self.confusion))
+        np.add.at(self.confusion, (y_true[ok], y_pred[ok].astype(np.int64)), 1)
+
+    @property
+    def accuracy(self) -> float:
+        total = self.confusion.sum()
+        return float(np.trace(self.confusion) / total) if total else float("nan")
+
+    def report(self, names: list) -> dict:
+        support = self.confusion.sum(axis=1)
+        recall = np.divide(np.diag(self.confusion), support, out=np.full(len(support), np.nan), where=support > 0)
+        return {"accuracy": self.accuracy, "rows_labeled": int(self.confusion.sum()), "labels": names,
+                "confusion_matrix": self.confusion.tolist(),
+                "per_class_recall": {n: (None if np.isnan(r) else round(float(r), 6)) for n, r in zip(names, recall)}}
+
+def main(model_path: Path, src: Path, out_path: Path, features: list = None, keep: list = None,
+         chunk_rows: int = 50000, workers: int = None, label_col: str = LABEL_COL, decimals: int = 6):
+    model = load_model(model_path)
+    features = features or getattr(model, "meta", {}).get("features") or features_for(model_path)
+    header = source_columns(src)
+    missing = [c for c in features if c not in header]
+    if missing:
+        raise ValueError(f"{src.name} is missing feature columns: {missing}")
+    keep = [c for c in (keep if keep is not None else KEEP_DEFAULT) if c in header and c not in features]
+    extra = [c for c in [label_col, "spice"] if c in header and c not in keep]
+    columns = list(dict.fromkeys(features + keep + extra))
+
+    names = {v: k for k, v in LABEL_MAP.items()}
+    metrics = RunningMetrics(len(LABEL_MAP))
+    has_proba = hasattr(model, "predict_proba")
+    workers = workers or os.cpu_count() or 1
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = out_path.with_name(out_path.name + ".partial")
+
+    def work(chunk):
+        X = chunk[features].to_numpy(dtype=np.float64)
+        pred, proba, classes = score(model, X, has_proba)
+        out = chunk[keep].reset_index(drop=True)
+        out["pred_target"] = pred
+        out["pred_spice"] = out["pred_target"].map(names)
+        if proba is not None:
+            for j, c in enumerate(classes):
+                out[f"p_{names.get(int(c), str(c))}"] = proba[:, j].round(decimals)
+        # Formatting the CSV text is the slow part of writing, so it happens on the pool too
+        return list(out.columns), out.to_csv(header=False, index=False), true_labels(chunk, label_col), pred
+
+    start = time.time()
+    n_rows, n_chunks, labeled = 0, 0, False
+    # At most 2 chunks per thread are in flight, so memory stays bounded whatever the file size
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool, open(tmp_path, "w", newline="") as f:
+        def drain(limit: int):
+            nonlocal n_rows, n_chunks, labeled
+            while len(pending) > limit:
+                cols, text, y_true, pred = pending.popleft().result()
+                if n_chunks == 0:
+                    f.write(",".join(cols) + "\n")
+                f.write(text)
+                if y_true is not None:
+                    labeled = True
+                    metrics.update(y_true, pred)
+                n_rows += len(pred)
+                n_chunks += 1
+                if n_chunks % 20 == 0:
+                    acc = f" | running accuracy {100 * metrics.accuracy:.2f}%" if labeled else ""
+                    print(f"[INFO] {n_rows} rows scored ({n_rows / (time.time() - start):,.0f} rows/s){acc}")
+
+        for chunk in read_chunks(src, columns, chunk_rows):
+            pending.append(pool.submit(work, chunk))
+            drain(2 * workers)
+        drain(0)
+    os.replace(tmp_path, out_path)
+    elapsed = time.time() - start
+
+    summary = {"model": str(model_path), "source": str(src), "features": features, "rows": n_rows,
+               "chunks": n_chunks, "chunk_rows": chunk_rows, "workers": workers,
+               "elapsed_sec": round(elapsed, 3), "rows_per_sec": round(n_rows / max(elapsed, 1e-9), 1)}
+    if labeled:
+        summary.update(metrics.report([names[i] for i in range(len(LABEL_MAP))]))
+    metrics_path = out_path.with_name(f"{out_path.stem}_metrics.json")
+    metrics_path.write_text(json.dumps(summary, indent=2))
+
+    acc = f" | accuracy {100 * metrics.accuracy:.2f}%" if labeled else " | unlabeled input"
+    print(f"[OK] Wrote: {out_path}  (rows={n_rows}, {summary['rows_per_sec']:,.0f} rows/s){acc}")
+    print(f"[OK] Metrics: {metrics_path}")
+    return summary
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Chunked, multi-threaded batch prediction with incremental output")
+    p.add_argument("--model", required=True, type=str,
+                   help="Persisted model (.joblib, .keras, tree_export .npz or model_artifact folder)")
+    p.add_argument("--src", required=True, type=str, help="CSV or Parquet file to score")
+    p.add_argument("--out", required=True, type=str, help="Output predictions CSV")
+    p.add_argument("--features", type=str, default=None,
+                   help="Comma list of feature columns (default: stored with the model, else <prefix>_metrics.json)")
+    p.add_argument("--keep", type=str, default=None,
+                   help=f"Comma list of input columns copied to the output (default: {','.join(KEEP_DEFAULT)})")
+    p.add_argument("--chunk_rows", type=int, default=50000, help="Rows read and scored per chunk")
+    p.add_argument("--workers", type=int, default=None, help="Prediction threads (default: #cpus)")
+    p.add_argument("--label_col", type=str, default=LABEL_COL, help="Label column for running metrics")
+    p.add_argument("--decimals", type=int, default=6, help="Rounding of written probabilities")
+    args = p.parse_args()
+    main(Path(args.model), Path(args.src), Path(args.out), args.features.split(",") if args.features else None,
+         args.keep.split(",") if args.keep is not None else None, args.chunk_rows, args.workers,
+         args.label_col, args.decimals)
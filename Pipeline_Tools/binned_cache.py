@@ -0,0 +1,150 @@
+# binned_cache.py
+# Purpose: Pre-binned (quantized) feature matrices for HistGradientBoosting and XGBoost.
+# Each column is binned once per dataset fingerprint into uint8 codes (<= 255 quantile bins,
+# thresholds computed like HistGradientBoosting's own bin mapper) and cached next to the
+# per-column cache of dataset_cache. Every fit then skips re-binning and re-parsing; the
+# all-feature and single-feature runs share the same per-column codes. CV folds and search
+# trials must not see bins shaped by their held-out rows, so they use fold_codes() instead:
+# edges from the fold's training rows only, applied to all rows once per fold.
+# What carries over: HistGradientBoosting bins a column with at most SUBSAMPLE rows exactly
+# like this, so on such data a fit on the codes gives the same trees as a fit on raw values.
+# Above SUBSAMPLE rows it draws its quantile sample with its own random_state, so its edges
+# (and trees) can differ slightly from these. XGBoost builds its own quantile sketch (max_bin
+# 256); on codes it can only split between these bins, so its results change. That is why
+# pre-binning is opt-in (--prebin) and the fitted model is kept behind its encoder.
+# NaN is cached as MISSING_CODE but handed to the models as NaN again (model_input), so
+# HistGradientBoosting and XGBoost learn where missing values go, as they do on raw values.
+# Models fitted on codes are saved behind a BinEncoder step so they still take raw inputs.
+
+from pathlib import Path
+import numpy as np
+
+from dataset_cache import ColumnStore, cache_root, fingerprint
+
+MAX_BINS = 255          # bins for non-missing values, as HistGradientBoostingClassifier(max_bins=255)
+MISSING_CODE = 255      # NaN in the cached codes; the models see NaN (model_input)
+SUBSAMPLE = 200_000     # rows used to find quantiles, as in HistGradientBoosting
+PREBIN_MODELS = {"gb", "xgb"}
+
+def bin_thresholds(col: np.ndarray, max_bins: int = MAX_BINS, subsample: int = SUBSAMPLE,
+                   seed: int = 0) -> np.ndarray:
+    """Increasing thresholds; value x goes to bin i iff thresholds[i-1] < x <= thresholds[i]."""
+    col = np.asarray(col, dtype=np.float64)
+    if subsample is not None and col.shape[0] > subsample:
+        col = col[np.random.default_rng(seed).choice(col.shape[0], subsample, replace=True)]
+    col = np.sort(col[~np.isnan(col)])
+    distinct = np.unique(col)
+    if len(distinct) <= 1:
+        return np.asarray([], dtype=np.float64)
+    if len(distinct) <= max_bins:
+        # Few distinct values: one bin per value, split at midpoints
+        return (distinct[:-1] + distinct[1:]) / 2.0
+    percentiles = np.linspace(0, 100, num=max_bins + 1)[1:-1]
+    return np.unique(np.percentile(col, percentiles, method="averaged_inverted_cdf"))
+
+def apply_bins(col: np.ndarray, thresholds: np.ndarray) -> np.ndarray:
+    col = np.asarray(col, dtype=np.float64)
+    codes = np.searchsorted(thresholds, col, side="left").astype(np.uint8)
+    codes[np.isnan(col)] = MISSING_CODE
+    return codes
+
+def model_input(codes: np.ndarray) -> np.ndarray:
+    """Codes as the models are fitted on them: float32 with MISSING_CODE turned back into NaN
+    (an ordinary top code would always send missing values to the high side of a split)."""
+    codes = np.asarray(codes)
+    X = codes.astype(np.float32)
+    X[codes == MISSING_CODE] = np.nan
+    return X
+
+class BinEncoder:
+    """Stateless raw -> model input (codes, NaN kept) placed in front of a model fitted on cached codes."""
+
+    def __init__(self, thresholds: list):
+        self.thresholds = [np.asarray(t) for t in thresholds]
+
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return model_input(np.column_stack([apply_bins(X[:, j], t) for j, t in enumerate(self.thresholds)]))
+
+class BinnedModel:
+    """A model fitted on codes plus the encoder that maps raw features to those codes."""
+
+    def __init__(self, encoder: BinEncoder, model):
+        self.encoder = encoder
+        self.model = model
+
+    @property
+    def classes_(self):
+        return self.model.classes_
+
+    def predict(self, X):
+        return self.model.predict(self.encoder.transform(X))
+
+    def predict_proba(self, X):
+        return self.model.predict_proba(self.encoder.transform(X))
+
+class BinnedStore:
+    """Per-column uint8 codes of one CSV, cached under its fingerprint.
+    With `reference`, thresholds come from the reference data (e.g. test coded with train bins)."""
+
+    def __init__(self, src: Path, max_bins: int = MAX_BINS, reference: "BinnedStore" = None,
+                 columns: ColumnStore = None, prefix: str = ""):
+        self.src = Path(src)
+        self.max_bins = max_bins
+        self.reference = reference
+        self.columns = columns or ColumnStore(self.src)
+        self.prefix = prefix
+        tag = f"b{max_bins}" + (f"_ref_{fingerprint(reference.src)}" if reference else "")
+        self.dir = cache_root(self.src) / "binned" / tag
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, name: str):
+        safe = (self.prefix + name).replace("/", "__")
+        return self.dir / f"{safe}.npy", self.dir / f"{safe}_thresholds.npy"
+
+    def thresholds(self, name: str) -> np.ndarray:
+        if self.reference is not None:
+            return self.reference.thresholds(name)
+        self.codes(name)
+        return np.load(self._paths(name)[1])
+
+    def codes(self, name: str) -> np.ndarray:
+        """uint8 codes for one column (memory-mapped), binned on first request."""
+        codes_path, thr_path = self._paths(name)
+        if not codes_path.exists():
+            if not self.prefix:
+                self.columns.ensure([name])
+            raw = np.asarray(self.columns.array(self.prefix + name), dtype=np.float64)
+            thr = self.reference.thresholds(name) if self.reference is not None \
+                else bin_thresholds(raw, self.max_bins)
+            tmp = codes_path.with_name(codes_path.stem + ".tmp.npy")
+            np.save(tmp, apply_bins(raw, thr))
+            if self.reference is None:
+                np.save(thr_path, thr)
+            tmp.replace(codes_path)
+        return np.load(codes_path, mmap_mode="r")
+
+    def matrix(self, names: list) -> np.ndarray:
+        """(rows, len(names)) uint8 code matrix."""
+        return np.column_stack([self.codes(n) for n in names])
+
+    def encoder(self, names: list) -> BinEncoder:
+        return BinEncoder([self.thresholds(n) for n in names])
+
+def fold_codes(X: np.ndarray, rows: np.ndarray, max_bins: int = MAX_BINS):
+    """(codes, BinEncoder) for all rows of X, with bin edges computed from X[rows] only."""
+    thr = [bin_thresholds(X[rows, j], max_bins) for j in range(X.shape[1])]
+    return np.column_stack([apply_bins(X[:, j], t) for j, t in enumerate(thr)]), BinEncoder(thr)
+
+def binned_matrix(src: Path, names: list, feature_set: str = None, reference: BinnedStore = None):
+    """Return (codes, BinnedStore) for columns of src; derived feature-set columns are read
+    from the feature_sets cache, so the set must have been materialised first."""
+    store = ColumnStore(src)
+    prefix = ""
+    if feature_set and feature_set in store.manifest.get("derived", {}):
+        prefix = f"__{feature_set}__/"
+    binned = BinnedStore(src, reference=reference, columns=store, prefix=prefix)
+    return binned.matrix(names), binned
@@ -0,0 +1,402 @@
+# conformance_harness.py
+# Purpose: Run the reference pipeline scripts and a candidate engine side by side on the
+# same inputs, compare their outputs column by column, and report the speed ratio.
+# A non-zero exit code means the candidate changed the features the models depend on.
+#
+# Example:
+#   python conformance_harness.py --stage step2 --generate \
+#       --candidate "python my_step2.py --src {src} --out_dir {out_dir}"
+#   python conformance_harness.py --stage step5 --src master_training_labeled.csv --src_stage merge \
+#       --candidate "python fast_step5.py --summary {summary} --context {context} --out_dir {out_dir}"
+#   python conformance_harness.py --stage step1 --generate --blocks 60 --master_order reverse \
+#       --candidate "python out_of_core.py --stage step1 --src {src} --out_dir {out_dir}"
+
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import fnmatch
+import json
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import synthetic_data
+from csv_codec import SUFFIXES, configure, csv_name, method_of, write_csv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+CSV_ROOT = REPO_ROOT / "CSV_Shuffling_Trimming"
+PRE_ROOT = REPO_ROOT / "ML_Models_Preprocessed_Data" / "Pre_Processing_Train_Test"
+
+# Per-spice file names hard-coded in the RawToCSV / segmentation / trimming scripts:
+# (RawToCSV script, raw .txt name, CSV stem, trimming script)
+SPICE_FILES = {
+    "Anise":    ("Anise_Raw_Data_Semester2.py", "Anise_Raw_Data.txt",
+                 "Anise_Raw_Data_Semester2", "Anise_Ideal_Data_Chunk.py"),
+    "Chilli":   ("Chilli_Raw_Data_Semester_2.py", "Chilli_Raw_Data_Semester_2.txt",
+                 "Chilli_Raw_Data_Semester_2", "Chilli_Ideal_Data_Chunks.py"),
+    "Cinnamon": ("Cinnamon_Sem_Two_Recorded.py", "Cinnamon_Sem_Two_Recorded.txt",
+                 "Cinnamon_Sem_Two_Recorded", "Cinnamon_Ideal_Data_Chunks.py"),
+    "Nutmeg":   ("Nutmeg_Sem_Two_Recorded.py", "Nutmeg_Sem_Two_Recorded.txt",
+                 "Nutmeg_Sem_Two_Recorded", "Nutmeg_Ideal_Data_Chunks.py"),
+}
+
+# Stage graph: stage -> upstream stages whose outputs it consumes.
+# "raw" is the recorded .txt session itself.
+DEPS = {
+    "raw_to_csv": ["raw"],
+    "segment":    ["raw_to_csv"],
+    "trim":       ["segment"],
+    "label":      ["trim"],
+    "merge":      ["label"],
+    "step1":      ["merge"],
+    "step2":      ["step1"],
+    "step3":      ["step2"],
+    "step4":      ["merge"],
+    "step5":      ["step3", "step4"],
+}
+PER_SPICE = {"raw", "raw_to_csv", "segment", "trim", "label"}
+
+# Placeholder names exposed to candidate command templates, per stage
+INPUT_NAMES = {
+    "step5": ["summary", "context"],
+    "merge": ["src_dir"],
+}
+
+# Columns used to align rows when --row_order sort is requested
+SORT_KEYS = {
+    "raw_to_csv": ["scanning_cycle_index", "heater_profile_step_index", "sensor_index", "timestamp_since_poweron"],
+    "segment":    ["scanning_cycle_index", "heater_profile_step_index", "sensor_index", "timestamp_since_poweron"],
+    "trim":       ["scanning_cycle_index", "heater_profile_step_index", "sensor_index", "timestamp_since_poweron"],
+    "label":      ["group_id", "heater_profile_step_index", "sensor_index", "timestamp_since_poweron"],
+    "merge":      ["group_id", "heater_profile_step_index", "sensor_index", "timestamp_since_poweron"],
+    "step1":      ["group_id", "sensor_index", "heater_profile_step_index", "timestamp_since_poweron"],
+    "step2":      ["group_id", "sensor_index", "heater_profile_step_index"],
+    "step3":      ["group_id", "sensor_index", "heater_profile_step_index"],
+    "step4":      ["group_id"],
+    "step5":      ["group_id"],
+}
+
+def _run(cmd, cwd: Path) -> float:
+    start = time.perf_counter()
+    res = subprocess.run(cmd, cwd=str(cwd), capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    if res.returncode != 0:
+        raise RuntimeError(f"Command failed ({res.returncode}): {' '.join(map(str, cmd))}\n{res.stderr}")
+    return elapsed
+
+def _single_csv(out_dir: Path, pattern: str = "*.csv*") -> Path:
+    found = sorted(out_dir.glob(pattern))
+    if len(found) != 1:
+        raise RuntimeError(f"Expected exactly one output matching {pattern} in {out_dir}, found {len(found)}")
+    return found[0]
+
+def run_reference(stage: str, inputs: list, work: Path, spice: str = None):
+    """Run the reference script for one stage. Returns (output path, seconds)."""
+    if work.exists():
+        shutil.rmtree(work)
+    work.mkdir(parents=True)
+    py = sys.executable
+
+    if stage in ("raw_to_csv", "segment", "trim"):
+        raw_script, raw_txt, stem, trim_script = SPICE_FILES[spice]
+        if stage == "raw_to_csv":
+            script = CSV_ROOT / "CSV and Shuffle" / spice / "RawToCSV" / raw_script
+            staged, produced = raw_txt, f"{stem}.csv"
+        elif stage == "segment":
+            script = (CSV_ROOT / "CSV and Shuffle" / spice / "Scanning_Cycle_Segmentation"
+                      / f"{spice}_Scanning_Cycle_Segmentation.py")
+            staged, produced = f"{stem}.csv", f"{stem}_reordered.csv"
+        else:
+            script = CSV_ROOT / "Trimming_Messy_Scanning_Cycles" / spice / trim_script
+            staged, produced = f"{stem}_reordered.csv", f"{stem}_reordered_perfect_only.csv"
+        shutil.copyfile(inputs[0], work / (staged + SUFFIXES[method_of(inputs[0])]))
+        secs = _run([py, str(script)], work)
+        return work / csv_name(produced), secs
+
+    if stage == "label":
+        script = PRE_ROOT / "Data_Labelling" / "Train" / f"label_{spice.lower()}.py"
+        run_dir = work / "run"
+        run_dir.mkdir()
+        secs = _run([py, str(script), "--src", str(Path(inputs[0]).resolve())], run_dir)
+        return _single_csv(work / "labeled", "*_labeled.csv*"), secs
+
+    if stage == "merge":
+        run_dir, labeled = work / "run", work / "labeled"
+        run_dir.mkdir()
+        labeled.mkdir()
+        for f in inputs:
+            shutil.copyfile(f, labeled / Path(f).name)
+        script = PRE_ROOT / "Data_Labelling" / "Train" / "merge_training_labeled.py"
+        secs = _run([py, str(script)], run_dir)
+        return labeled / csv_name("master_training_labeled.csv"), secs
+
+    scripts = {
+        "step1": PRE_ROOT / "Step_1_Log_Transformation" / "Train" / "fe_step1_log_transform.py",
+        "step2": PRE_ROOT / "Step_2_Stepwise_Summaries" / "Train" / "fe_step2_stepwise_summaries_training.py",
+        "step3": PRE_ROOT / "Step_3_Normalization" / "Train" / "fe_step3_within_cycle_norm_training.py",
+        "step4": PRE_ROOT / "Step_4_Environmental_Context_Features" / "Train" / "fe_step4_context_features_training.py",
+        "step5": PRE_ROOT / "Step_5_Wide_Merge" / "Train" / "fe_step5_make_wide_table_training.py",
+    }
+    out_dir = work / "out"
+    if stage == "step5":
+        args = ["--summary", str(inputs[0]), "--context", str(inputs[1])]
+    else:
+        args = ["--src", str(inputs[0])]
+    secs = _run([py, str(scripts[stage])] + args + ["--out_dir", str(out_dir)], work)
+    return _single_csv(out_dir), secs
+
+def run_candidate(template: str, stage: str, inputs: list, work: Path, spice: str = None):
+    """Run a candidate command template. Returns (output path, seconds)."""
+    if work.exists():
+        shutil.rmtree(work)
+    out_dir = work / "out"
+    out_dir.mkdir(parents=True)
+
+    fields = {"out_dir": str(out_dir), "spice": spice or ""}
+    if stage == "merge":
+        src_dir = work / "in"
+        src_dir.mkdir()
+        for f in inputs:
+            shutil.copyfile(f, src_dir / Path(f).name)
+        fields["src_dir"] = str(src_dir)
+    else:
+        names = INPUT_NAMES.get(stage, ["src"])
+        fields.update({k: str(Path(v).resolve()) for k, v in zip(names, inputs)})
+
+    cmd = [part.format(**fields) for part in shlex.split(template)]
+    secs = _run(cmd, Path.cwd())
+    return _single_csv(out_dir), secs
+
+class Dataset:
+    """Holds the root input(s) of one dataset and memoizes reference outputs per stage."""
+
+    def __init__(self, name: str, work: Path, spices: list, roots: dict, master_order: str = "merge"):
+        self.name = name
+        self.work = work
+        self.spices = spices
+        self.master_order = master_order
+        self.outputs = dict(roots)  # (stage, spice or None) -> Path
+
+    def output(self, stage: str, spice: str = None) -> Path:
+        key = (stage, spice if stage in PER_SPICE else None)
+        if key not in self.outputs:
+            inputs = self.inputs(stage, spice)
+            tag = f"{stage}_{spice}" if stage in PER_SPICE else stage
+            self.outputs[key], _ = run_reference(stage, inputs, self.work / "ref_chain" / tag, spice)
+            if stage == "merge" and self.master_order == "reverse":
+                self.outputs[key] = reverse_master(self.outputs[key])
+        return self.outputs[key]
+
+    def inputs(self, stage: str, spice: str = None) -> list:
+        if stage == "merge":
+            return [self.output("label", s) for s in self.spices]
+        return [self.output(dep, spice) for dep in DEPS[stage]]
+
+def reverse_master(path: Path) -> Path:
+    """Copy of a master table with the spices in reverse order (rows keep their order per spice).
+    Group ids of the first spices then first appear after pandas' first parser chunk."""
+    import pandas as pd
+    df = pd.read_csv(path, float_precision="round_trip")
+    out = path.with_name(csv_name("master_reversed.csv"))
+    write_csv(df.sort_values("spice", ascending=False, kind="stable"), out)
+    return out
+
+def generated_dataset(work: Path, spices: list, n_blocks: int, seed: int, master_order: str = "merge") -> Dataset:
+    roots = {}
+    for spice in spices:
+        df = synthetic_data.make_session(spice, n_blocks, seed, messy_tail=137, swaps=5)
+        path = work / "generated" / f"{spice}_session.txt"
+        synthetic_data.write_raw_txt(df, path)
+        roots[("raw", spice)] = path
+    return Dataset("generated", work, spices, roots, master_order)
+
+def recorded_dataset(work: Path, src: Path, src_stage: str, spice: str) -> Dataset:
+    key = (src_stage, spice if src_stage in PER_SPICE else None)
+    return Dataset(f"recorded:{src.name}", work, [spice], {key: src})
+
+def _is_numeric(s: pd.Series) -> bool:
+    import pandas as pd
+    return pd.api.types.is_float_dtype(s) or pd.api.types.is_integer_dtype(s)
+
+def _is_integer(s: pd.Series) -> bool:
+    import pandas as pd
+    return pd.api.types.is_integer_dtype(s)
+
+def _tolerance(col: str, rtol: float, atol: float, col_tol: dict, exact: bool = False):
+    """--col_tol for the column if given, else exact for integer columns, else rtol/atol."""
+    for pat, tol in col_tol.items():
+        if fnmatch.fnmatch(col, pat):
+            return tol
+    return (0.0, 0.0) if exact else (rtol, atol)
+
+def compare_frames(ref: pd.DataFrame, cand: pd.DataFrame, rtol: float = 1e-9, atol: float = 1e-12,
+                   col_tol: dict = None, row_order: str = "strict", sort_keys: list = None,
+                   nan_equal: bool = True, check_column_order: bool = False) -> dict:
+    """Compare two outputs column by column. Returns a report dict (report["ok"] is the verdict)."""
+    col_tol = col_tol or {}
+    report = {"ok": True, "rows_ref": len(ref), "rows_cand": len(cand),
+              "missing_columns": [c for c in ref.columns if c not in cand.columns],
+              "extra_columns": [c for c in cand.columns if c not in ref.columns],
+              "column_order_differs": False, "columns": {}}
+
+    if report["missing_columns"] or report["extra_columns"]:
+        report["ok"] = False
+    common = [c for c in ref.columns if c in cand.columns]
+    if check_column_order and list(ref.columns) != list(cand.columns):
+        report["column_order_differs"] = True
+        report["ok"] = False
+    if len(ref) != len(cand):
+        report["ok"] = False
+        return report
+
+    if row_order == "sort":
+        keys = [k for k in (sort_keys or common) if k in common]
+        ref = ref.sort_values(keys, kind="mergesort").reset_index(drop=True)
+        cand = cand.sort_values(keys, kind="mergesort").reset_index(drop=True)
+    else:
+        ref = ref.reset_index(drop=True)
+        cand = cand.reset_index(drop=True)
+
+    for c in common:
+        a, b = ref[c], cand[c]
+        entry = {"mismatches": 0}
+        if _is_numeric(a) and _is_numeric(b):
+            x = a.to_numpy(dtype=float)
+            y = b.to_numpy(dtype=float)
+            # Indices, timestamps and counts must match exactly; rtol would let 1700000000 == 1700000001
+            r, t = _tolerance(c, rtol, atol, col_tol, exact=_is_integer(a) or _is_integer(b))
+            nan_x, nan_y = np.isnan(x), np.isnan(y)
+            with np.errstate(invalid="ignore"):
+                close = np.isclose(x, y, rtol=r, atol=t, equal_nan=False)
+            both_nan = nan_x & nan_y
+            bad = ~(close | (both_nan if nan_equal else False))
+            finite = ~(nan_x | nan_y)
+            if finite.any():
+                entry["max_abs_diff"] = float(np.max(np.abs(x[finite] - y[finite])))
+        else:
+            x = a.astype(str).to_numpy()
+            y = b.astype(str).to_numpy()
+            bad = x != y
+            if not nan_equal:
+                bad |= a.isna().to_numpy() & b.isna().to_numpy()
+        n_bad = int(bad.sum())
+        if n_bad:
+            first = int(np.argmax(bad))
+            entry.update({"mismatches": n_bad, "first_row": first,
+                          "ref_value": str(a.iat[first]), "cand_value": str(b.iat[first])})
+            report["ok"] = False
+        report["columns"][c] = entry
+    return report
+
+def print_report(title: str, report: dict, ref_secs: float, cand_secs: float):
+    ratio = ref_secs / cand_secs if cand_secs > 0 else float("inf")
+    status = "OK" if report["ok"] else "MISMATCH"
+    print(f"[{status}] {title}: ref {ref_secs:.3f}s, candidate {cand_secs:.3f}s, speedup x{ratio:.2f}")
+    if report["rows_ref"] != report["rows_cand"]:
+        print(f"    rows differ: ref={report['rows_ref']} candidate={report['rows_cand']}")
+    if report["missing_columns"]:
+        print(f"    missing in candidate: {report['missing_columns']}")
+    if report["extra_columns"]:
+        print(f"    extra in candidate: {report['extra_columns']}")
+    if report["column_order_differs"]:
+        print("    column order differs")
+    bad = {c: e for c, e in report["columns"].items() if e["mismatches"]}
+    for c, e in list(bad.items())[:20]:
+        diff = f", max|diff|={e['max_abs_diff']:.3g}" if "max_abs_diff" in e else ""
+        print(f"    {c}: {e['mismatches']} rows{diff} (first row {e['first_row']}: "
+              f"ref={e['ref_value']} candidate={e['cand_value']})")
+    if len(bad) > 20:
+        print(f"    ... and {len(bad) - 20} more columns")
+
+def parse_col_tol(items: list) -> dict:
+    # "S*_log_slope_per_s=1e-6,1e-9" -> {"S*_log_slope_per_s": (1e-6, 1e-9)}
+    out = {}
+    for item in items or []:
+        pat, _, vals = item.partition("=")
+        r, _, a = vals.partition(",")
+        out[pat] = (float(r), float(a or 0.0))
+    return out
+
+def main(args):
+    import pandas as pd
+    configure(args.compression)
+    work = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="conformance_"))
+    work.mkdir(parents=True, exist_ok=True)
+    spices = args.spices.split(",")
+
+    datasets = []
+    if args.generate:
+        datasets.append(generated_dataset(work / "generated_ds", spices, args.blocks, args.seed, args.master_order))
+    for src in args.src or []:
+        src = Path(src).resolve()
+        datasets.append(recorded_dataset(work / f"recorded_{src.stem}", src, args.src_stage, spices[0]))
+    if not datasets:
+        raise ValueError("Nothing to compare: pass --generate and/or --src")
+
+    col_tol = parse_col_tol(args.col_tol)
+    results, all_ok = [], True
+    for ds in datasets:
+        for spice in (ds.spices if args.stage in PER_SPICE else [None]):
+            inputs = ds.inputs(args.stage, spice)
+            tag = f"{args.stage}_{spice}" if spice else args.stage
+            ref_secs, cand_secs = [], []
+            for _ in range(args.repeat):
+                ref_out, t = run_reference(args.stage, inputs, ds.work / "ref" / tag, spice)
+                ref_secs.append(t)
+                cand_out, t = run_candidate(args.candidate, args.stage, inputs, ds.work / "cand" / tag, spice)
+                cand_secs.append(t)
+
+            report = compare_frames(
+                pd.read_csv(ref_out), pd.read_csv(cand_out),
+                rtol=args.rtol, atol=args.atol, col_tol=col_tol,
+                row_order=args.row_order, sort_keys=SORT_KEYS.get(args.stage),
+                nan_equal=not args.nan_mismatch, check_column_order=args.check_column_order,
+            )
+            report.update({"dataset": ds.name, "stage": args.stage, "spice": spice,
+                           "ref_seconds": min(ref_secs), "candidate_seconds": min(cand_secs),
+                           "ref_bytes": ref_out.stat().st_size, "candidate_bytes": cand_out.stat().st_size})
+            title = f"{args.stage}{'/' + spice if spice else ''} on {ds.name}"
+            print_report(title, report, report["ref_seconds"], report["candidate_seconds"])
+            results.append(report)
+            all_ok &= report["ok"]
+
+    if args.report:
+        Path(args.report).write_text(json.dumps(results, indent=2))
+        print(f"[OK] Report: {args.report}")
+    print(f"[INFO] Work directory: {work}")
+    return 0 if all_ok else 1
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Differential conformance check: reference scripts vs a candidate engine")
+    p.add_argument("--stage", required=True, choices=list(DEPS), help="Pipeline stage to check")
+    p.add_argument("--candidate", required=True, type=str,
+                   help="Command template, e.g. 'python fast.py --src {src} --out_dir {out_dir}'. "
+                        "Placeholders: {src}, {summary}, {context} (step5), {src_dir} (merge), {out_dir}, {spice}. "
+                        "The candidate must write exactly one CSV into {out_dir}.")
+    p.add_argument("--generate", action="store_true", help="Check on a generated multi-spice dataset")
+    p.add_argument("--blocks", type=int, default=10, help="400-row blocks per generated session")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--master_order", choices=["merge", "reverse"], default="merge",
+                   help="reverse: stages after merge get the generated master with the spices in reverse order "
+                        "(with --blocks 50 or more this checks category order past the parser's first chunk)")
+    p.add_argument("--spices", type=str, default="Anise,Chilli,Cinnamon,Nutmeg")
+    p.add_argument("--src", action="append", help="Recorded input file (repeatable)")
+    p.add_argument("--src_stage", default="merge", choices=["raw"] + list(DEPS),
+                   help="Which stage produced --src ('raw' = recorded .txt session). Default: merge (master labeled CSV)")
+    p.add_argument("--rtol", type=float, default=1e-9, help="Relative tolerance for float columns (integer columns must match exactly)")
+    p.add_argument("--atol", type=float, default=1e-12)
+    p.add_argument("--col_tol", action="append", help="Per-column tolerance PATTERN=RTOL,ATOL (fnmatch patterns)")
+    p.add_argument("--row_order", choices=["strict", "sort"], default="strict",
+                   help="strict: rows must match positionally; sort: align rows on the stage keys first")
+    p.add_argument("--nan_mismatch", action="store_true", help="Treat NaN vs NaN as a mismatch")
+    p.add_argument("--check_column_order", action="store_true")
+    p.add_argument("--repeat", type=int, default=1, help="Runs per side; the fastest time is reported")
+    p.add_argument("--work_dir", type=str, default=None)
+    p.add_argument("--report", type=str, default=None, help="Write the JSON report here")
+    p.add_argument("--compression", type=str, default=None,
+                   help="Codec for the reference scripts' outputs <method>[:<level>] (csv_codec.py; default $ENOSE_COMPRESSION)")
+    sys.exit(main(p.parse_args()))
@@ -0,0 +1,162 @@
+# csv_codec.py
+# Purpose: Optional compression of the pipeline's intermediate CSVs (raw, reordered, perfect-only,
+# labeled, master, Step 1-5, out_of_core / cycle_pool outputs and partitioned_store part files).
+# The codec is set by the ENOSE_COMPRESSION environment variable (or --compression in the
+# Pipeline_Tools runners, which also sets the variable for any reference scripts they start) as
+# "<method>[:<level>]": none (default), zstd, gzip, bz2 or xz. Writers append the codec suffix
+# (x.csv -> x.csv.zst). Readers need no setting: pandas picks the codec from the suffix, so
+# compressed and plain inputs can be mixed. Default levels are the fast end of each codec.
+# zstd needs the zstandard package; lz4 is not offered because pandas cannot read it, and
+# zstd at level 1 runs at a similar speed. The columnar caches (dataset_cache, binned_cache)
+# stay uncompressed: their .npy files are memory-mapped.
+# The CLI is the benchmark: it writes one table with each codec and reports the compression
+# ratio against write and read throughput.
+#
+# Example:
+#   ENOSE_COMPRESSION=zstd python fe_step1_log_transform.py --src master_training_labeled.csv --out_dir step1
+#   python out_of_core.py --stage all --raw Anise=Anise_Raw_Data.txt ... --out_dir run --compression zstd:3
+#   python csv_codec.py --src master_training_labeled.csv --codecs none,gzip:1,zstd:1,zstd:3
+
+from pathlib import Path
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ENV = "ENOSE_COMPRESSION"
+SUFFIXES = {"none": "", "zstd": ".zst", "gzip": ".gz", "bz2": ".bz2", "xz": ".xz"}
+LEVELS = {"zstd": 1, "gzip": 1, "bz2": 1, "xz": 0}
+LEVEL_ARG = {"zstd": "level", "gzip": "compresslevel", "bz2": "compresslevel", "xz": "preset"}
+BENCH_CODECS = "none,zstd:1,zstd:3,zstd:9,gzip:1,gzip:6,bz2:1,xz:0"
+
+def parse(spec: str) -> tuple:
+    """(method, level) of a "<method>[:<level>]" string; checks that the codec can be used."""
+    method, _, level = (spec or "none").strip().lower().partition(":")
+    if method not in SUFFIXES:
+        raise ValueError(f"Unknown compression '{spec}' (choose from {', '.join(SUFFIXES)})")
+    if method == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            raise ImportError("zstd compression needs zstandard (pip install zstandard)")
+    return method, int(level) if level else LEVELS.get(method)
+
+def configure(spec: str):
+    """Use this codec for the rest of the process and for the scripts it starts."""
+    if spec is not None:
+        parse(spec)
+        os.environ[ENV] = spec
+
+def current() -> tuple:
+    """(method, level) from ENOSE_COMPRESSION; ("none", None) when unset."""
+    return parse(os.environ.get(ENV, "none"))
+
+def method_of(path) -> str:
+    """Codec of a file, from its suffix."""
+    suffix = Path(path).suffix
+    for method, s in SUFFIXES.items():
+        if s and suffix == s:
+            return method
+    return "none"
+
+def csv_name(name):
+    """Output name with the current codec's suffix (str in, str out; Path in, Path out)."""
+    suffix = SUFFIXES[current()[0]]
+    return name.with_name(name.name + suffix) if isinstance(name, Path) else name + suffix
+
+def csv_stem(path) -> str:
+    """File name without the codec suffix and .csv (x.csv.zst -> x)."""
+    name = Path(path).name
+    suffix = SUFFIXES[method_of(name)]
+    if suffix:
+        name = name[:-len(suffix)]
+    return name[:-len(".csv")] if name.endswith(".csv") else Path(name).stem
+
+def find_csv(path):
+    """For fixed input names: the compressed or plain variant that exists (current codec first)."""
+    path = Path(path)
+    order = [current()[0]] + [m for m in SUFFIXES if m != current()[0]]
+    for method in order:
+        cand = path.with_name(path.name + SUFFIXES[method])
+        if cand.exists():
+            return cand
+    return path
+
+def options(path, method: str = None):
+    """compression= argument for DataFrame.to_csv."""
+    method = method or method_of(path)
+    if method == "none":
+        return None
+    cur, level = current()
+    level = level if cur == method else LEVELS[method]
+    return {"method": method, LEVEL_ARG[method]: level}
+
+def write_csv(df, path, **kwargs):
+    """df.to_csv(path, index=False) with the codec given by the path's suffix."""
+    df.to_csv(path, index=False, compression=options(path), **kwargs)
+
+def open_text(path, mode: str = "w", method: str = None):
+    """Text handle for streaming writers/readers; method defaults to the path's suffix."""
+    method = method or method_of(path)
+    opts = options(path, method)
+    if method == "none":
+        return open(path, mode, newline="")
+    if method == "zstd":
+        import zstandard
+        cctx = zstandard.ZstdCompressor(level=opts["level"]) if "r" not in mode else None
+        return zstandard.open(path, mode + "t", cctx=cctx, newline="")
+    import bz2, gzip, lzma
+    opener = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}[method]
+    level = {} if "r" in mode else {LEVEL_ARG[method]: opts[LEVEL_ARG[method]]}
+    return opener(path, mode + "t", newline="", **level)
+
+def main(src: Path, codecs: str = BENCH_CODECS, repeat: int = 3):
+    import pandas as pd
+    import dtype_schema
+
+    df = dtype_schema.read_csv(src, float_precision="round_trip")
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="csv_codec_") as tmp:
+        for spec in codecs.split(","):
+            try:
+                method, level = parse(spec)
+            except ImportError as e:
+                print(f"[WARN] {spec}: {e}", file=sys.stderr)
+                continue
+            os.environ[ENV] = spec
+            path = csv_name(Path(tmp) / "table.csv")
+            t_write, t_read = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                write_csv(df, path)
+                t_write.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                back = dtype_schema.read_csv(path, float_precision="round_trip")
+                t_read.append(time.perf_counter() - start)
+            if not back.equals(df):
+                print(f"[WARN] {spec}: table read back differs", file=sys.stderr)
+            rows.append((f"{method}:{level}" if level is not None else method, path.stat().st_size,
+                         min(t_write), min(t_read)))
+            path.unlink()
+    if not rows:
+        return rows
+
+    plain = next((r[1] for r in rows if r[0] == "none"), None)
+    base = plain or rows[0][1]
+    print(f"[INFO] {src.name}: {len(df):,} rows x {df.shape[1]} columns"
+          f"{f', {plain / 1e6:.1f} MB as plain CSV' if plain else ''}")
+    print(f"{'codec':<10}{'MB':>9}{'ratio':>8}{'write s':>9}{'MB/s':>8}{'read s':>9}{'MB/s':>8}")
+    for name, size, tw, tr in rows:
+        print(f"{name:<10}{size / 1e6:>9.2f}{base / size:>8.2f}{tw:>9.2f}{base / 1e6 / tw:>8.1f}"
+              f"{tr:>9.2f}{base / 1e6 / tr:>8.1f}")
+    print("[OK] Ratio = plain CSV size / compressed size; MB/s counts plain CSV bytes")
+    return rows
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark CSV compression codecs (ratio vs write/read throughput)")
+    p.add_argument("--src", required=True, type=str, help="Any pipeline table (raw, labeled, Step 1-5)")
+    p.add_argument("--codecs", type=str, default=BENCH_CODECS, help="Comma list of <method>[:<level>]")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per codec (fastest is reported)")
+    args = p.parse_args()
+    main(Path(args.src), args.codecs, args.repeat)
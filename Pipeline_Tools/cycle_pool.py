@@ -0,0 +1,224 @@
+# cycle_pool.py
+# Purpose: Run Step 2 (per-step summaries) or Step 5 (wide table) on a process pool. Both are
+# independent per cycle (group_id). The parent parses the input once into a column cache of
+# .npy files (dataset_cache.ColumnStore) in a temporary folder. It cuts the rows into contiguous
+# cycle ranges (shards) and sends workers only the cache folder and a row range. Workers
+# memory-map the columns, so no DataFrame is pickled to them. Each worker runs the reference
+# per-group code (Step 2's per_group_stats, Step 5's wide rows) on its cycles. The parent
+# concatenates the results in shard order, so the output matches the single-process scripts
+# byte for byte whatever the worker count.
+# Step 2 expects Step 1 output, where every (cycle, sensor, step) group is one contiguous run.
+# Step 5 sorts the Step 3 rows by KEY_COLS like the reference script (only the row order is
+# sorted in the parent; workers gather their rows through it).
+#
+# Example:
+#   python cycle_pool.py --stage step2 --src master_training_labeled_step1_log.csv --out_dir step2 --workers 8
+#   python cycle_pool.py --stage step5 --summary step3.csv --context step4.csv --out_dir step5 --workers 8
+#   python conformance_harness.py --stage step2 --generate \
+#       --candidate "python cycle_pool.py --stage step2 --src {src} --out_dir {out_dir} --workers 4"
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+import dtype_schema
+from conformance_harness import PRE_ROOT
+from csv_codec import configure, csv_name, csv_stem, write_csv
+from dataset_cache import ColumnStore
+from out_of_core import WideColumns, load_script, wide_frame
+
+SHARDS_PER_WORKER = 4    # more shards than workers evens out uneven cycles
+STEP2_SCRIPT = PRE_ROOT / "Step_2_Stepwise_Summaries" / "Train" / "fe_step2_stepwise_summaries_training.py"
+STEP5_SCRIPT = PRE_ROOT / "Step_5_Wide_Merge" / "Train" / "fe_step5_make_wide_table_training.py"
+STEP2_KEYS = ["group_id", "spice", "target", "sensor_index", "heater_profile_step_index"]
+
+_MODULES = {}
+
+def _script(path: Path):
+    """Reference stage module, imported once per process."""
+    if path not in _MODULES:
+        _MODULES[path] = load_script(path, path.stem)
+    return _MODULES[path]
+
+def codes(store: ColumnStore, name: str) -> np.ndarray:
+    """Sortable integer codes of a cached column (categories are sorted; missing values last)."""
+    entry = store.manifest["columns"][name]
+    arr = np.asarray(store.array(name), dtype=np.int64) if entry["kind"] == "cat" else np.asarray(store.array(name))
+    if entry["kind"] == "cat":
+        arr = np.where(arr < 0, len(entry["categories"]), arr)
+    return arr
+
+def run_starts(arrays: list) -> np.ndarray:
+    """Row positions where any of the key arrays changes (including row 0)."""
+    n = len(arrays[0])
+    change = np.zeros(n, dtype=bool)
+    if n:
+        change[0] = True
+    for a in arrays:
+        change[1:] |= a[1:] != a[:-1]
+    return np.flatnonzero(change)
+
+def shard_bounds(starts: np.ndarray, n_rows: int, n_shards: int) -> list:
+    """(start, stop) row ranges of about equal size, cut only at group starts."""
+    if n_rows == 0:
+        return []
+    targets = np.linspace(0, n_rows, n_shards + 1)[1:-1]
+    cuts = starts[np.minimum(np.searchsorted(starts, targets), len(starts) - 1)]
+    cuts = np.unique(np.r_[0, cuts[cuts > 0], n_rows])
+    return list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+
+def load_rows(task: dict):
+    """DataFrame of the task's columns for its rows, read from the memory-mapped column cache."""
+    import pandas as pd
+    store = ColumnStore(task["src"], task["cache"])
+    rows = slice(task["start"], task["stop"])
+    if task.get("order"):
+        rows = np.load(task["order"], mmap_mode="r")[rows]
+    data = {}
+    for c in task["columns"]:
+        entry = store.manifest["columns"][c]
+        arr = np.asarray(store.array(c)[rows])
+        data[c] = pd.Categorical.from_codes(arr, entry["categories"]) if entry["kind"] == "cat" else arr
+    return pd.DataFrame(data, columns=task["columns"])
+
+def step2_shard(task: dict):
+    step = _script(STEP2_SCRIPT)
+    df = load_rows(task)
+    return df.groupby(STEP2_KEYS, sort=False, observed=True).apply(step.per_group_stats).reset_index()
+
+def step5_shard(task: dict):
+    return wide_frame(load_rows(task), _script(STEP5_SCRIPT))
+
+def run_shards(fn, tasks: list, workers: int) -> list:
+    """fn over the tasks on a process pool; results come back in task order."""
+    if workers <= 1:
+        return [fn(t) for t in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(fn, tasks))
+
+def step2(src: Path, out_dir: Path, workers: int, cache: Path) -> Path:
+    import pandas as pd
+    step = _script(STEP2_SCRIPT)
+    header = list(pd.read_csv(src, nrows=0).columns)
+    missing = [c for c in step.REQ_COLS if c not in header]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+    columns = STEP2_KEYS + ["timestamp_since_poweron", "log_resistance"]
+    start = time.time()
+    store = ColumnStore(src, cache)
+    store.ensure(columns)
+    parse = time.time() - start
+
+    keys = [codes(store, c) for c in STEP2_KEYS]
+    starts = run_starts(keys)
+    n_groups = len(np.unique(np.stack(keys, axis=1), axis=0)) if len(starts) else 0
+    if len(starts) != n_groups:
+        raise ValueError(f"{src.name}: (group_id, sensor, step) groups are not contiguous; "
+                         f"pass Step 1 output (or use out_of_core.py --stage step2)")
+    cycle_starts = run_starts([keys[0]])
+    tasks = [{"src": str(src), "cache": str(cache), "columns": columns, "start": a, "stop": b}
+             for a, b in shard_bounds(cycle_starts, len(keys[0]), workers * SHARDS_PER_WORKER)]
+
+    start = time.time()
+    parts = run_shards(step2_shard, tasks, workers)
+    pool = time.time() - start
+    agg = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+    out_path = out_dir / csv_name(f"{csv_stem(src)}_step2_stepwise.csv")
+    write_csv(agg, out_path)
+    print(f"[OK] Wrote: {out_path}  (rows={len(agg)})")
+    print(f"[INFO] {len(cycle_starts)} cycles in {len(tasks)} shards on {workers} worker(s) | "
+          f"parse {parse:.2f}s, summaries {pool:.2f}s")
+    return out_path
+
+def step5(summary: Path, context: Path, out_dir: Path, workers: int, cache: Path) -> Path:
+    import pandas as pd
+    step = _script(STEP5_SCRIPT)
+    ids, stats, count = step.ID_COLS, step.STAT_COLS_ABS + step.STAT_COLS_REL, step.COUNT_COL
+    ctx_cols = ["temp_mean", "rh_mean", "pressure_mean"]
+    header = list(pd.read_csv(summary, nrows=0).columns)
+    missing = [c for c in step.KEY_COLS + stats + [count] if c not in header]
+    if missing:
+        raise ValueError(f"Missing required columns in Step-3 file: {missing}")
+    ctx = dtype_schema.read_csv(context)
+    missing_ctx = [c for c in ids + ctx_cols if c not in ctx.columns]
+    if missing_ctx:
+        raise ValueError(f"Missing required columns in Step-4 context file: {missing_ctx}")
+
+    columns = step.KEY_COLS + stats + [count]
+    start = time.time()
+    store = ColumnStore(summary, cache)
+    store.ensure(columns)
+    parse = time.time() - start
+
+    # Row order of df.sort_values(KEY_COLS) (a stable lexsort), shared with the workers as a file
+    keys = [codes(store, c) for c in step.KEY_COLS]
+    order = np.lexsort(keys[::-1])
+    order_path = cache / "order.npy"
+    np.save(order_path, order)
+    cycle_starts = run_starts([k[order] for k in keys[:len(ids)]])
+    tasks = [{"src": str(summary), "cache": str(cache), "columns": columns, "start": a, "stop": b,
+              "order": str(order_path)}
+             for a, b in shard_bounds(cycle_starts, len(order), workers * SHARDS_PER_WORKER)]
+
+    start = time.time()
+    parts = run_shards(step5_shard, tasks, workers)
+    pool = time.time() - start
+    union = WideColumns()
+    for wide in parts:
+        union.add(wide)
+    wide = pd.concat([union.settle(w) for w in parts], ignore_index=True) if parts else pd.DataFrame(columns=ids)
+    final = wide.merge(ctx[ids + ctx_cols], on=ids, how="left")
+
+    print(f"[INFO] Cycles (rows): {final.shape[0]}")
+    print(f"[INFO] Feature columns (including context): {final.shape[1] - len(ids)}")
+    n_cols = [c for c in final.columns if c.endswith("_n")]
+    if not n_cols:
+        print("[WARN] No *_n columns found. Cannot verify cell counts.", file=sys.stderr)
+    else:
+        bad = int((final[n_cols].isna().sum(axis=1) > 0).sum())
+        if bad > 0:
+            print(f"[WARN] {bad} cycle rows have missing sensor/step cells (NaN in *_n).", file=sys.stderr)
+    stem = csv_stem(summary)
+    if stem.endswith("_step3_norm"):
+        stem = stem[:-len("_step3_norm")]
+    out_path = out_dir / csv_name(f"{stem}_features.csv")
+    write_csv(final, out_path)
+    print(f"[OK] Wrote features: {out_path}")
+    print(f"[INFO] {len(cycle_starts)} cycles in {len(tasks)} shards on {workers} worker(s) | "
+          f"parse {parse:.2f}s, wide rows {pool:.2f}s")
+    return out_path
+
+def main(stage: str, out_dir: Path, workers: int = None, src: Path = None, summary: Path = None,
+         context: Path = None, compression: str = None):
+    configure(compression)
+    workers = max(1, workers or os.cpu_count() or 1)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix="cycle_pool_") as tmp:
+        if stage == "step2":
+            if src is None:
+                raise ValueError("--stage step2 needs --src")
+            return step2(src, out_dir, workers, Path(tmp))
+        if summary is None or context is None:
+            raise ValueError("--stage step5 needs --summary and --context")
+        return step5(summary, context, out_dir, workers, Path(tmp))
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Step 2 / Step 5 on a process pool, sharded by cycle")
+    p.add_argument("--stage", required=True, choices=["step2", "step5"], help="Stage to run")
+    p.add_argument("--src", type=str, default=None, help="Step 2: Step-1 CSV (sorted by group, sensor, step)")
+    p.add_argument("--summary", type=str, default=None, help="Step 5: Step-3 CSV")
+    p.add_argument("--context", type=str, default=None, help="Step 5: Step-4 context CSV")
+    p.add_argument("--out_dir", required=True, type=str, help="Output directory")
+    p.add_argument("--workers", type=int, default=None, help="Worker processes (default: #cpus)")
+    p.add_argument("--compression", type=str, default=None,
+                   help="Output codec <method>[:<level>] (csv_codec.py; default $ENOSE_COMPRESSION)")
+    args = p.parse_args()
+    main(args.stage, Path(args.out_dir), args.workers,
+         Path(args.src) if args.src else None,
+         Path(args.summary) if args.summary else None,
+         Path(args.context) if args.context else None, args.compression)
@@ -0,0 +1,166 @@
+# dataset_cache.py
+# Purpose: Dataset fingerprints and a per-column on-disk cache for wide CSV tables.
+# A column is parsed from the CSV the first time it is requested and stored as a .npy file,
+# so later requests for any subset of columns are served from memory-mapped arrays
+# instead of re-parsing the (1000+ column) source table.
+# Several processes may fill the same cache: column files are named by a hash of the column
+# name (never by position), and the manifest is re-read and merged under a file lock before
+# every write, so one process never drops columns another one added.
+
+from __future__ import annotations
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import json
+import os
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # Windows: no advisory locks, single-writer use only
+    fcntl = None
+
+import dtype_schema
+
+FINGERPRINT_SAMPLE = 1 << 20  # bytes hashed from the head and tail of the file
+
+def fingerprint(path: Path) -> str:
+    """Cheap content fingerprint: size, mtime and the first/last MiB of the file."""
+    path = Path(path)
+    st = path.stat()
+    h = hashlib.sha1()
+    h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        h.update(f.read(FINGERPRINT_SAMPLE))
+        if st.st_size > FINGERPRINT_SAMPLE:
+            f.seek(max(st.st_size - FINGERPRINT_SAMPLE, FINGERPRINT_SAMPLE))
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+def cache_root(src: Path) -> Path:
+    """Default cache folder for artifacts derived from src (kept next to the dataset)."""
+    src = Path(src)
+    return src.parent / ".cache" / f"{src.stem}_{fingerprint(src)}"
+
+def _write_json_atomic(path: Path, obj):
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    tmp.write_text(json.dumps(obj, indent=2))
+    os.replace(tmp, path)
+
+@contextmanager
+def _file_lock(path: Path):
+    """Exclusive advisory lock on path (created if needed) for the duration of the block."""
+    with open(path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+class ColumnStore:
+    """Column-wise cache of one CSV file, filled lazily on first access to each column."""
+
+    def __init__(self, src: Path, cache_dir: Path = None):
+        import pandas as pd
+        self.src = Path(src)
+        self.dir = Path(cache_dir) if cache_dir else cache_root(self.src) / "columns"
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.dir / "manifest.json"
+        self.lock_path = self.dir / "manifest.lock"
+        with _file_lock(self.lock_path):
+            if self.manifest_path.exists():
+                self.manifest = json.loads(self.manifest_path.read_text())
+            else:
+                header = list(pd.read_csv(self.src, nrows=0).columns)
+                self.manifest = {"source": str(self.src), "header": header, "n_rows": None, "columns": {}}
+                _write_json_atomic(self.manifest_path, self.manifest)
+
+    @property
+    def header(self) -> list:
+        return self.manifest["header"]
+
+    def cached(self) -> set:
+        return set(self.manifest["columns"])
+
+    def _store(self, name: str, s: pd.Series):
+        import pandas as pd
+        fname = f"c{hashlib.sha1(name.encode()).hexdigest()[:16]}.npy"
+        entry = {"file": fname}
+        tmp = self.dir / f"{fname}.tmp{os.getpid()}.npy"
+        if pd.api.types.is_numeric_dtype(s) or pd.api.types.is_bool_dtype(s):
+            np.save(tmp, s.to_numpy())
+            entry["kind"] = "num"
+        else:
+            cat = pd.Categorical(s)
+            np.save(tmp, cat.codes)
+            entry["kind"] = "cat"
+            entry["categories"] = [str(c) for c in cat.categories]
+        os.replace(tmp, self.dir / fname)
+        self.manifest["columns"][name] = entry
+
+    def _commit(self):
+        """Merge this process's entries into the manifest on disk (under the lock) and write it."""
+        with _file_lock(self.lock_path):
+            disk = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+            merged = {**disk, **{k: v for k, v in self.manifest.items() if k not in ("columns", "derived")}}
+            if disk.get("n_rows") is not None and self.manifest.get("n_rows") is None:
+                merged["n_rows"] = disk["n_rows"]
+            for key in ("columns", "derived"):
+                if key in disk or key in self.manifest:
+                    merged[key] = {**disk.get(key, {}), **self.manifest.get(key, {})}
+            _write_json_atomic(self.manifest_path, merged)
+            self.manifest = merged
+
+    def put(self, frame: pd.DataFrame, prefix: str = ""):
+        """Store computed columns (e.g. a derived feature set) under an optional prefix."""
+        for c in frame.columns:
+            if prefix + c not in self.manifest["columns"]:
+                self._store(prefix + c, frame[c])
+        self._commit()
+
+    def put_derived(self, name: str, frame: pd.DataFrame):
+        """Cache a computed frame (e.g. a derived feature set) under its own name."""
+        self.put(frame, prefix=f"__{name}__/")
+        self.manifest.setdefault("derived", {})[name] = list(frame.columns)
+        self._commit()
+
+    def load_derived(self, name: str):
+        """Return a frame cached with put_derived, or None if it was never stored."""
+        cols = self.manifest.get("derived", {}).get(name)
+        return None if cols is None else self.load(cols, prefix=f"__{name}__/")
+
+    def ensure(self, columns: list):
+        """Parse (once) any requested source columns that are not cached yet."""
+        import pandas as pd
+        todo = [c for c in columns if c not in self.manifest["columns"]]
+        if not todo:
+            return
+        unknown = [c for c in todo if c not in self.header]
+        if unknown:
+            raise KeyError(f"Columns not in {self.src.name}: {unknown[:10]}")
+        df = dtype_schema.read_csv(self.src, usecols=todo)
+        self.manifest["n_rows"] = len(df)
+        for c in todo:
+            self._store(c, df[c])
+        self._commit()
+
+    def array(self, name: str) -> np.ndarray:
+        entry = self.manifest["columns"][name]
+        return np.load(self.dir / entry["file"], mmap_mode="r")
+
+    def load(self, columns: list, prefix: str = "") -> pd.DataFrame:
+        """Return the requested columns as a DataFrame (parsing only what is not cached)."""
+        import pandas as pd
+        if not prefix:
+            self.ensure(columns)
+        data = {}
+        for c in columns:
+            entry = self.manifest["columns"][prefix + c]
+            arr = self.array(prefix + c)
+            if entry["kind"] == "cat":
+                data[c] = pd.Categorical.from_codes(np.asarray(arr), entry["categories"]).astype(object)
+            else:
+                data[c] = np.asarray(arr)
+        return pd.DataFrame(data, columns=columns)
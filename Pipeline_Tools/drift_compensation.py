@@ -0,0 +1,186 @@
+# drift_compensation.py
+# Purpose: Optional drift-compensation stage that adds log_resistance_dc next to log_resistance.
+# Step 3 normalises each cycle against heater step 0, so slow baseline drift over a 6-hour
+# session passes through to the models. This stage tracks an exponentially weighted baseline
+# of log1p(resistance) per (session, sensor, heater step). It anchors that baseline once the
+# first --warmup readings of the cell are in and subtracts how far it has moved since:
+#   log_resistance_dc = log_resistance - (baseline before this reading - anchor)
+# The level each session starts at (the odour response) is kept, and only the slow drift
+# inside the session is removed. Sessions are told apart as in drift_monitor.py. Each chunk is
+# handled in one vectorized pass (no Python loop over rows). The update is causal, so batch
+# runs over the master file and incremental runs on live rows (--state carries the baselines
+# over) give the same values.
+# Run it on the labeled master file in recording order, before Step 1: Step 1 recomputes the same
+# log_resistance and keeps log_resistance_dc as an extra column.
+#
+# Example:
+#   python drift_compensation.py --src master_training_labeled.csv --out_dir drift_comp
+#   python drift_compensation.py --src live_rows.csv --out_dir live --state live/drift_state.npz
+
+from pathlib import Path
+import argparse
+import json
+import time
+import numpy as np
+
+import dtype_schema
+from drift_monitor import NUM_HEATERS, NUM_SENSORS, SessionTracker, cell_index, session_runs
+
+REQ_COLS = ["sensor_index", "heater_profile_step_index", "timestamp_since_poweron", "resistance_gassensor"]
+N_CELLS = NUM_SENSORS * NUM_HEATERS
+MAX_EXPONENT = 600.0     # rows per vectorized block stay below 2**600 in the weight scaling
+
+class CellBaseline:
+    """EWMA state of one session: weighted sums, reading counts and anchors per cell."""
+
+    __slots__ = ("num", "den", "count", "anchor")
+
+    def __init__(self):
+        self.num = np.zeros(N_CELLS)
+        self.den = np.zeros(N_CELLS)
+        self.count = np.zeros(N_CELLS, dtype=np.int64)
+        self.anchor = np.full(N_CELLS, np.nan)
+
+class DriftCompensator:
+    """Causal per-(session, sensor, step) baseline tracking. transform() returns log_resistance_dc."""
+
+    def __init__(self, halflife: float = 20.0, warmup: int = 5):
+        self.halflife = float(halflife)
+        self.warmup = max(1, int(warmup))
+        self.decay = 0.5 ** (1.0 / self.halflife)
+        self.block = max(N_CELLS, int(MAX_EXPONENT * self.halflife))
+        self.tracker = SessionTracker()
+        self.sessions = {}
+
+    def transform(self, chunk) -> tuple:
+        """(log_resistance, log_resistance_dc) for the chunk's rows, updating the baselines."""
+        log_r = np.log1p(chunk["resistance_gassensor"].to_numpy(dtype=np.float64))
+        dc = np.full(len(chunk), np.nan)
+        if len(chunk) == 0:
+            return log_r, dc
+        cells, _, ok = cell_index(chunk)
+        ok &= np.isfinite(log_r)
+        for name, a, b in session_runs(self.tracker.assign(chunk)):
+            st = self.sessions.setdefault(name, CellBaseline())
+            for s in range(a, b, self.block):
+                e = min(b, s + self.block)
+                m = np.flatnonzero(ok[s:e]) + s
+                dc[m] = self._block(st, cells[m], log_r[m])
+        return log_r, dc
+
+    def _block(self, st: CellBaseline, cells: np.ndarray, x: np.ndarray) -> np.ndarray:
+        # Lay the block out as (cell, k-th reading of the cell) and run the EWMA recurrence for
+        # every cell at once with cumulative sums along k
+        d = self.decay
+        counts = np.bincount(cells, minlength=N_CELLS)
+        order = np.argsort(cells, kind="stable")
+        starts = np.cumsum(counts) - counts
+        k = np.empty(len(cells), dtype=np.int64)
+        k[order] = np.arange(len(cells)) - np.repeat(starts, counts)
+        width = int(counts.max())
+        scale = d ** -np.arange(width, dtype=np.float64)      # d^-k, undone below
+        X = np.zeros((N_CELLS, width))
+        X[cells, k] = x
+        W = np.zeros((N_CELLS, width))
+        W[cells, k] = 1.0
+        keep = d ** np.arange(1, width + 1, dtype=np.float64)  # d^(k+1): weight of the carried state
+        num = keep * st.num[:, None] + np.cumsum(X * scale, axis=1) / scale
+        den = keep * st.den[:, None] + np.cumsum(W * scale, axis=1) / scale
+        with np.errstate(invalid="ignore", divide="ignore"):
+            level = num / den                                    # baseline after reading k
+        # Baseline before each reading: the carried state for k = 0, else the previous column
+        prev = np.empty_like(level)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            prev[:, 0] = st.num / st.den
+        prev[:, 1:] = level[:, :-1]
+
+        # Anchor = baseline once `warmup` readings of the cell have been seen
+        seen = st.count[:, None] + np.arange(1, width + 1)       # readings after reading k
+        anchor = st.anchor.copy()
+        hits = (seen == self.warmup) & (np.arange(width) < counts[:, None])
+        r, c = np.nonzero(hits)
+        anchor[r] = level[r, c]
+        total = st.count[cells] + k                              # readings before this one
+        drift = prev[cells, k] - anchor[cells]
+        out = np.where(total >= self.warmup, x - drift, x)
+
+        last = np.maximum(counts - 1, 0)
+        has = counts > 0
+        st.num[has] = num[has, last[has]]
+        st.den[has] = den[has, last[has]]
+        st.count += counts
+        st.anchor = anchor
+        return out
+
+    def save(self, path: Path):
+        names = list(self.sessions)
+        meta = {"halflife": self.halflife, "warmup": self.warmup, "sessions": names,
+                "tracker": self.tracker.state()}
+        arrays = {f: np.stack([getattr(self.sessions[n], f) for n in names]) if names else np.zeros((0, N_CELLS))
+                  for f in CellBaseline.__slots__}
+        np.savez(path, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8), **arrays)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as z:
+            meta = json.loads(bytes(z["meta"]).decode())
+            arrays = {k: z[k] for k in z.files if k != "meta"}
+        comp = cls(meta["halflife"], meta["warmup"])
+        comp.tracker = SessionTracker(meta["tracker"])
+        for i, name in enumerate(meta["sessions"]):
+            st = comp.sessions[name] = CellBaseline()
+            for f in CellBaseline.__slots__:
+                setattr(st, f, arrays[f][i].copy())
+        return comp
+
+def main(src: Path, out_dir: Path, halflife: float = 20.0, warmup: int = 5, chunk_rows: int = 200000,
+         state: Path = None):
+    import pandas as pd
+
+    header = list(pd.read_csv(src, nrows=0).columns)
+    missing = [c for c in REQ_COLS if c not in header]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if state is not None and state.exists():
+        comp = DriftCompensator.load(state)
+        print(f"[INFO] Continuing from {state} ({len(comp.sessions)} sessions, halflife {comp.halflife}, "
+              f"warmup {comp.warmup})")
+    else:
+        comp = DriftCompensator(halflife, warmup)
+
+    out_path = out_dir / f"{src.stem}_dc.csv"
+    tmp_path = out_path.with_name(out_path.name + ".partial")
+    n_rows, work, shift = 0, 0.0, []
+    with open(tmp_path, "w", newline="") as f:
+        for chunk in dtype_schema.read_csv(src, chunksize=chunk_rows):
+            start = time.perf_counter()
+            log_r, dc = comp.transform(chunk)
+            work += time.perf_counter() - start
+            chunk["log_resistance"] = log_r
+            chunk["log_resistance_dc"] = dc
+            chunk.to_csv(f, header=(n_rows == 0), index=False)
+            n_rows += len(chunk)
+            shift.append(np.nan_to_num(np.abs(dc - log_r)).sum())
+    tmp_path.replace(out_path)
+    if state is not None:
+        comp.save(state)
+        print(f"[OK] State: {state}")
+
+    print(f"[OK] Wrote: {out_path}  (rows={n_rows}, sessions={len(comp.sessions)})")
+    print(f"[INFO] Mean |correction|: {sum(shift) / max(n_rows, 1):.4f} log units | "
+          f"compensation {1e6 * work / max(n_rows, 1):.2f} us/row")
+    return out_path
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Drift-compensated log resistance (per session/sensor/step EWMA baseline)")
+    p.add_argument("--src", required=True, type=str, help="Labeled master (or raw) CSV in recording order")
+    p.add_argument("--out_dir", required=True, type=str, help="Output directory for <src>_dc.csv")
+    p.add_argument("--halflife", type=float, default=20.0, help="Baseline half-life, in readings per (sensor, step)")
+    p.add_argument("--warmup", type=int, default=5, help="Readings per cell before the baseline is anchored")
+    p.add_argument("--chunk_rows", type=int, default=200000, help="Rows read per chunk")
+    p.add_argument("--state", type=str, default=None,
+                   help="Baseline state file: loaded if present and saved after the run (incremental use)")
+    args = p.parse_args()
+    main(Path(args.src), Path(args.out_dir), args.halflife, args.warmup, args.chunk_rows,
+         Path(args.state) if args.state else None)
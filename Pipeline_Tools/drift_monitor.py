@@ -0,0 +1,354 @@
+# drift_monitor.py
+# Purpose: Sensor-drift monitor for incoming BME688 rows against the training data.
+# A reference profile is built once from master_training_labeled.csv. It holds, per
+# (spice, sensor, heater step), the count, mean and std of log resistance (log1p, as in Step 1);
+# per (spice, sensor), the mean and std of temperature, relative humidity and pressure; and the same
+# statistics pooled over all spices. The profile is a few KB (.npz).
+# The monitor streams rows in chunks. Per recording session it keeps the same cell statistics,
+# merged chunk by chunk, and an exponentially weighted recent mean per cell, so memory does not
+# grow with the stream. Drift scores are standardised mean shifts against the profile of the
+# session's spice (or the pooled profile for unlabeled live data): whole-session and recent RMS
+# over all cells, the worst cell, the average resistance shift in percent and the environment shifts.
+# Sessions come from a `session` column, or are inferred as in group_cv.py (timestamp restarts).
+#
+# Example:
+#   python drift_monitor.py --train master_training_labeled.csv --reference drift_reference.npz
+#   python drift_monitor.py --reference drift_reference.npz --src new_sessions_labeled.csv --out_dir drift
+
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+import dtype_schema
+
+NUM_SENSORS = 8
+NUM_HEATERS = 10
+ENV_COLS = ["temperature", "relative_humidity", "pressure"]
+REQ_COLS = ["sensor_index", "heater_profile_step_index", "timestamp_since_poweron", "resistance_gassensor"] + ENV_COLS
+POOLED = "all"
+STD_FLOOR = 1e-6          # keeps constant training cells from producing infinite z-scores
+
+class CellStats:
+    """Count, mean and co-moment for a fixed set of cells, merged chunk by chunk (Chan et al.)."""
+
+    def __init__(self, n_cells: int):
+        self.n = np.zeros(n_cells)
+        self.mean = np.zeros(n_cells)
+        self.m2 = np.zeros(n_cells)
+
+    def update(self, cells: np.ndarray, values: np.ndarray):
+        ok = np.isfinite(values)
+        cells, values = cells[ok], values[ok]
+        if len(values) == 0:
+            return
+        size = len(self.n)
+        nb = np.bincount(cells, minlength=size).astype(np.float64)
+        hit = nb > 0
+        mb = np.zeros(size)
+        mb[hit] = np.bincount(cells, values, minlength=size)[hit] / nb[hit]
+        m2b = np.bincount(cells, (values - mb[cells]) ** 2, minlength=size)
+        n_new = self.n + nb
+        delta = mb - self.mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(hit, nb / n_new, 0.0)
+            self.m2 += m2b + np.where(hit, delta * delta * self.n * frac, 0.0)
+        self.mean += delta * frac
+        self.n = n_new
+
+    def std(self) -> np.ndarray:
+        return np.sqrt(np.divide(self.m2, self.n, out=np.zeros_like(self.m2), where=self.n > 0))
+
+class RecentMean:
+    """Exponentially weighted mean per cell (pandas ewm(adjust=True) semantics), updated per chunk."""
+
+    def __init__(self, n_cells: int, halflife: float):
+        self.decay = 0.5 ** (1.0 / halflife)
+        self.num = np.zeros(n_cells)
+        self.den = np.zeros(n_cells)
+
+    def update(self, cells: np.ndarray, values: np.ndarray):
+        ok = np.isfinite(values)
+        cells, values = cells[ok], values[ok]
+        if len(values) == 0:
+            return
+        size = len(self.num)
+        # Age of each value within its cell: later arrivals in the chunk weigh more
+        order = np.argsort(cells, kind="stable")
+        counts = np.bincount(cells, minlength=size)
+        starts = np.cumsum(counts) - counts
+        rank = np.empty(len(cells), dtype=np.int64)
+        rank[order] = np.arange(len(cells)) - np.repeat(starts, counts)
+        age = counts[cells] - 1 - rank
+        w = self.decay ** age
+        shrink = self.decay ** counts
+        self.num = self.num * shrink + np.bincount(cells, w * values, minlength=size)
+        self.den = self.den * shrink + np.bincount(cells, w, minlength=size)
+
+    def value(self) -> np.ndarray:
+        return np.divide(self.num, self.den, out=np.full_like(self.num, np.nan), where=self.den > 0)
+
+class DriftReference:
+    """Per-(spice, sensor, step) log-resistance and per-(spice, sensor) environment profile."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.arrays = arrays
+        self.meta = meta
+        self.spices = meta["spices"]
+
+    def profile(self, spice: str) -> dict:
+        i = self.spices.index(spice if spice in self.spices else POOLED)
+        return {k: v[i] for k, v in self.arrays.items()}
+
+    def save(self, path: Path):
+        np.savez(path, meta=np.frombuffer(json.dumps(self.meta).encode(), dtype=np.uint8), **self.arrays)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as z:
+            meta = json.loads(bytes(z["meta"]).decode())
+            arrays = {k: z[k] for k in z.files if k != "meta"}
+        return cls(arrays, meta)
+
+def read_chunks(src: Path, chunk_rows: int, extra: list = ()):
+    import pandas as pd
+    header = list(pd.read_csv(src, nrows=0).columns)
+    missing = [c for c in REQ_COLS if c not in header]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+    cols = REQ_COLS + [c for c in extra if c in header]
+    yield from dtype_schema.read_csv(src, usecols=cols, chunksize=chunk_rows)
+
+def cell_index(chunk) -> tuple:
+    """(sensor*steps + step, sensor, in-range mask) for a chunk."""
+    sensor = chunk["sensor_index"].to_numpy(dtype=np.int64)
+    step = chunk["heater_profile_step_index"].to_numpy(dtype=np.int64)
+    ok = (sensor >= 0) & (sensor < NUM_SENSORS) & (step >= 0) & (step < NUM_HEATERS)
+    return sensor * NUM_HEATERS + step, sensor, ok
+
+def build_reference(src: Path, chunk_rows: int = 500000) -> DriftReference:
+    """One streaming pass over the labeled master file."""
+    spices, logr, env = [], {}, {}
+    n_rows = skipped = 0
+
+    def stats_for(name: str):
+        if name not in logr:
+            spices.append(name)
+            logr[name] = CellStats(NUM_SENSORS * NUM_HEATERS)
+            env[name] = CellStats(NUM_SENSORS * len(ENV_COLS))
+        return logr[name], env[name]
+
+    for chunk in read_chunks(src, chunk_rows, extra=["spice"]):
+        cells, sensor, ok = cell_index(chunk)
+        skipped += int((~ok).sum())
+        chunk, cells, sensor = chunk[ok], cells[ok], sensor[ok]
+        v = np.log1p(chunk["resistance_gassensor"].to_numpy(dtype=np.float64))
+        E = chunk[ENV_COLS].to_numpy(dtype=np.float64)
+        spice = chunk["spice"].astype(str).to_numpy() if "spice" in chunk.columns else np.full(len(chunk), POOLED)
+        for name in [POOLED] + sorted(set(spice) - {POOLED}):
+            m = slice(None) if name == POOLED else spice == name
+            lr, en = stats_for(name)
+            lr.update(cells[m], v[m])
+            for j in range(len(ENV_COLS)):
+                en.update(sensor[m] * len(ENV_COLS) + j, E[m, j])
+        n_rows += len(chunk)
+    if n_rows == 0:
+        raise ValueError(f"No usable rows in {src.name}")
+    if skipped:
+        print(f"[WARN] {skipped} rows outside {NUM_SENSORS} sensors x {NUM_HEATERS} heater steps were ignored",
+              file=sys.stderr)
+
+    shape_lr, shape_env = (NUM_SENSORS, NUM_HEATERS), (NUM_SENSORS, len(ENV_COLS))
+    arrays = {
+        "logr_n": np.stack([logr[s].n.reshape(shape_lr) for s in spices]),
+        "logr_mean": np.stack([logr[s].mean.reshape(shape_lr) for s in spices]),
+        "logr_std": np.stack([logr[s].std().reshape(shape_lr) for s in spices]),
+        "env_mean": np.stack([env[s].mean.reshape(shape_env) for s in spices]),
+        "env_std": np.stack([env[s].std().reshape(shape_env) for s in spices]),
+    }
+    meta = {"source": str(src), "rows": n_rows, "spices": spices, "sensors": NUM_SENSORS,
+            "heater_steps": NUM_HEATERS, "env": ENV_COLS}
+    return DriftReference(arrays, meta)
+
+class SessionState:
+    __slots__ = ("name", "spice", "rows", "logr", "recent", "env")
+
+    def __init__(self, name: str, spice: str, halflife: float):
+        self.name = name
+        self.spice = spice
+        self.rows = 0
+        self.logr = CellStats(NUM_SENSORS * NUM_HEATERS)
+        self.recent = RecentMean(NUM_SENSORS * NUM_HEATERS, halflife)
+        self.env = CellStats(NUM_SENSORS * len(ENV_COLS))
+
+class SessionTracker:
+    """Session label per row for rows arriving in recording order, chunk after chunk.
+    A new session starts when timestamp_since_poweron goes back (a new power-on) or the spice
+    changes, as in group_cv.session_ids; a `session` column is used as is."""
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        self.last_ts = state.get("last_ts")
+        self.last_spice = state.get("last_spice")
+        self.current = state.get("current")
+        self.counter = dict(state.get("counter", {}))
+
+    def state(self) -> dict:
+        return {"last_ts": self.last_ts, "last_spice": self.last_spice, "current": self.current,
+                "counter": self.counter}
+
+    def assign(self, chunk) -> np.ndarray:
+        if "session" in chunk.columns:
+            return chunk["session"].astype(str).to_numpy()
+        spice = chunk["spice"].astype(str).to_numpy() if "spice" in chunk.columns else np.full(len(chunk), "live")
+        ts = chunk["timestamp_since_poweron"].to_numpy()
+        first = self.current is None or ts[0] < self.last_ts or spice[0] != self.last_spice
+        new = np.r_[first, (ts[1:] < ts[:-1]) | (spice[1:] != spice[:-1])]
+        labels = [] if first else [self.current]
+        for i in np.flatnonzero(new):
+            k = self.counter.get(spice[i], 0)
+            self.counter[spice[i]] = k + 1
+            labels.append(f"{spice[i]}_s{k}")
+        self.last_ts, self.last_spice, self.current = int(ts[-1]), str(spice[-1]), labels[-1]
+        return np.asarray(labels, dtype=object)[np.cumsum(new) - (1 if first else 0)]
+
+def session_runs(sessions: np.ndarray) -> list:
+    """(session, start, stop) for each run of equal labels; a session's rows are contiguous."""
+    bounds = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1], True])
+    return [(sessions[a], a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+class DriftMonitor:
+    """Running drift statistics per recording session. Feed chunks with update(); read scores()."""
+
+    def __init__(self, reference: DriftReference, halflife: float = 50.0):
+        self.reference = reference
+        self.halflife = halflife
+        self.sessions = {}
+        self.tracker = SessionTracker()
+
+    def update(self, chunk) -> list:
+        """Add a chunk of raw or labeled rows. Returns the sessions it touched."""
+        if len(chunk) == 0:
+            return []
+        sessions = self.tracker.assign(chunk)
+        cells, sensor, ok = cell_index(chunk)
+        v = np.log1p(chunk["resistance_gassensor"].to_numpy(dtype=np.float64))
+        E = chunk[ENV_COLS].to_numpy(dtype=np.float64)
+        spice = chunk["spice"].astype(str).to_numpy() if "spice" in chunk.columns else None
+        touched = []
+        for name, a, b in session_runs(sessions):
+            st = self.sessions.get(name)
+            if st is None:
+                st = self.sessions[name] = SessionState(name, spice[a] if spice is not None else POOLED,
+                                                        self.halflife)
+            m = ok[a:b]
+            c = cells[a:b][m]
+            st.logr.update(c, v[a:b][m])
+            st.recent.update(c, v[a:b][m])
+            s = sensor[a:b][m]
+            for j in range(len(ENV_COLS)):
+                st.env.update(s * len(ENV_COLS) + j, E[a:b, j][m])
+            st.rows += b - a
+            touched.append(name)
+        return touched
+
+    def scores(self, name: str) -> dict:
+        st = self.sessions[name]
+        ref = self.reference.profile(st.spice)
+        ref_n, ref_mean = ref["logr_n"].ravel(), ref["logr_mean"].ravel()
+        ref_std = np.maximum(ref["logr_std"].ravel(), STD_FLOOR)
+        valid = (ref_n > 1) & (st.logr.n > 0)
+        out = {"session": name, "spice": st.spice,
+               "profile": st.spice if st.spice in self.reference.spices else POOLED, "rows": st.rows}
+        if not valid.any():
+            return out
+        w = st.logr.n[valid]
+        z = (st.logr.mean[valid] - ref_mean[valid]) / ref_std[valid]
+        recent = (st.recent.value()[valid] - ref_mean[valid]) / ref_std[valid]
+        worst = np.flatnonzero(valid)[np.argmax(np.abs(z))]
+        shift = np.average(st.logr.mean[valid] - ref_mean[valid], weights=w)
+        out.update({
+            "drift_z_rms": float(np.sqrt(np.average(z * z, weights=w))),
+            "recent_z_rms": float(np.sqrt(np.nanmean(recent * recent))),
+            "max_abs_z": float(np.abs(z).max()),
+            "max_z_sensor": int(worst // NUM_HEATERS), "max_z_step": int(worst % NUM_HEATERS),
+            "resistance_shift_pct": float(100.0 * np.expm1(shift)),
+        })
+        env_n = st.env.n.reshape(NUM_SENSORS, len(ENV_COLS))
+        env_z = (st.env.mean.reshape(env_n.shape) - ref["env_mean"]) / np.maximum(ref["env_std"], STD_FLOOR)
+        for j, c in enumerate(ENV_COLS):
+            has = env_n[:, j] > 0
+            out[f"{c}_z"] = float(np.average(env_z[has, j], weights=env_n[has, j])) if has.any() else np.nan
+        return out
+
+def main(reference_path: Path, train_csv: Path = None, src: Path = None, out_dir: Path = None,
+         chunk_rows: int = 100000, halflife: float = 50.0, report_every: int = 100000, threshold: float = 3.0):
+    import pandas as pd
+
+    if train_csv is not None:
+        start = time.time()
+        ref = build_reference(train_csv, max(chunk_rows, 500000))
+        reference_path.parent.mkdir(parents=True, exist_ok=True)
+        ref.save(reference_path)
+        print(f"[OK] Reference profile from {ref.meta['rows']:,} rows ({', '.join(ref.spices)}) "
+              f"in {time.time() - start:.2f}s: {reference_path}")
+    else:
+        ref = DriftReference.load(reference_path)
+    if src is None:
+        return ref
+
+    out_dir = out_dir or src.parent
+    out_dir.mkdir(parents=True, exist_ok=True)
+    monitor = DriftMonitor(ref, halflife)
+    timeline_path = out_dir / f"{src.stem}_drift_timeline.csv"
+    n_rows, next_report, update_sec, first = 0, report_every, 0.0, True
+    since = set()
+    with open(timeline_path, "w", newline="") as f:
+        for chunk in read_chunks(src, chunk_rows, extra=["spice", "session"]):
+            start = time.perf_counter()
+            since.update(monitor.update(chunk))
+            update_sec += time.perf_counter() - start
+            n_rows += len(chunk)
+            if n_rows >= next_report:
+                snap = pd.DataFrame([dict(monitor.scores(s), rows_seen=n_rows) for s in sorted(since)])
+                snap.to_csv(f, header=first, index=False, float_format="%.6g")
+                first, since = False, set()
+                next_report = n_rows + report_every
+        if since:
+            pd.DataFrame([dict(monitor.scores(s), rows_seen=n_rows) for s in sorted(since)]) \
+                .to_csv(f, header=first, index=False, float_format="%.6g")
+
+    scores = pd.DataFrame([monitor.scores(s) for s in monitor.sessions])
+    scores_path = out_dir / f"{src.stem}_drift_scores.csv"
+    scores.to_csv(scores_path, index=False, float_format="%.6g")
+    rate = n_rows / max(update_sec, 1e-9)
+    print(f"[OK] Wrote: {scores_path}  (sessions={len(scores)}, rows={n_rows})")
+    print(f"[OK] Timeline: {timeline_path}")
+    print(f"[INFO] Monitor cost: {1e6 * update_sec / max(n_rows, 1):.2f} us/row ({rate:,.0f} rows/s, excluding CSV parsing)")
+    for _, r in scores.iterrows():
+        if r.get("recent_z_rms", 0) > threshold:
+            print(f"[WARN] {r['session']}: recent drift z {r['recent_z_rms']:.2f} > {threshold} "
+                  f"(resistance shift {r['resistance_shift_pct']:+.1f}%, worst sensor {r['max_z_sensor']} "
+                  f"step {r['max_z_step']})", file=sys.stderr)
+        env = [f"{c} z {r[f'{c}_z']:+.2f}" for c in ENV_COLS if abs(r.get(f"{c}_z", 0)) > threshold]
+        if env:
+            print(f"[WARN] {r['session']}: environment outside the training profile ({', '.join(env)})",
+                  file=sys.stderr)
+    return scores
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Streaming sensor-drift scores per session against a training profile")
+    p.add_argument("--reference", required=True, type=str, help="Reference profile (.npz); written when --train is given")
+    p.add_argument("--train", type=str, default=None, help="Build the profile from this labeled master CSV")
+    p.add_argument("--src", type=str, default=None, help="Raw or labeled CSV to monitor (rows in recording order)")
+    p.add_argument("--out_dir", type=str, default=None, help="Output folder (default: next to --src)")
+    p.add_argument("--chunk_rows", type=int, default=100000, help="Rows read per chunk")
+    p.add_argument("--halflife", type=float, default=50.0, help="Half-life of the recent mean, in readings per cell")
+    p.add_argument("--report_every", type=int, default=100000, help="Rows between timeline snapshots")
+    p.add_argument("--threshold", type=float, default=3.0, help="Recent drift z above this is reported as a warning")
+    args = p.parse_args()
+    main(Path(args.reference), Path(args.train) if args.train else None, Path(args.src) if args.src else None,
+         Path(args.out_dir) if args.out_dir else None, args.chunk_rows, args.halflife, args.report_every,
+         args.threshold)
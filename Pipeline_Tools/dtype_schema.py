@@ -0,0 +1,185 @@
+# dtype_schema.py
+# Purpose: One column-dtype schema shared by every pipeline stage, applied when a CSV is read.
+# With plain pd.read_csv every table holds int64 indices, float64 readings and Python strings for
+# spice and group_id. Here the small indices and labels are int8 (sensor 0-7, heater step 0-9,
+# cycle 1-5, target 0-3), spice and group_id are categoricals, and counts are int32. That loses
+# nothing: each integer is range-checked before it is narrowed and kept as int64 (with a warning)
+# if it does not fit. float32=True also stores readings and features as float32, about 7
+# significant digits, which is finer than the BME688 resolution. The Step 1-5 scripts read with
+# the lossless schema, so their outputs stay byte-identical. The CLI reports memory per column.
+#
+# Example:
+#   python dtype_schema.py --src master_training_labeled.csv
+#   python dtype_schema.py --src Train_All.csv --float32
+
+from pathlib import Path
+import argparse
+import re
+import sys
+import time
+import numpy as np
+
+CATEGORY = "category"
+FLOAT = "float"          # float64, or float32 with float32=True
+
+# Every named column of the pipeline tables (raw DevKit export -> labeled -> Steps 1-5)
+COLUMNS = {
+    "sensor_index": "int8",
+    "heater_profile_step_index": "int8",
+    "scanning_cycle_index": "int8",
+    "label_tag": "int8",
+    "target": "int8",
+    "error_code": "int16",
+    "n_samples": "int32",
+    "timestamp_since_poweron": "int64",   # ms since power-on; int32 would wrap after 24 days
+    "real_time_clock": "int64",
+    "spice": CATEGORY,
+    "group_id": CATEGORY,
+    "temperature": FLOAT,
+    "pressure": FLOAT,
+    "relative_humidity": FLOAT,
+    "resistance_gassensor": FLOAT,
+    "log_resistance": FLOAT,
+    "log_resistance_dc": FLOAT,
+    "temp_mean": FLOAT,
+    "rh_mean": FLOAT,
+    "pressure_mean": FLOAT,
+}
+# Derived families: Step 2-3 summaries (log_*, base_log_*, *_rel) and Step 5 wide columns
+# (S<sensor>_H<step>_<stat>; the _n counts are only integers when no cell is missing)
+PATTERNS = [
+    (re.compile(r"^(base_)?log_\w+$"), FLOAT),
+    (re.compile(r"^S\d+_H\d+_n$"), "int32"),
+    (re.compile(r"^S\d+_H\d+_\w+$"), FLOAT),
+    (re.compile(r"^PC\d+$"), FLOAT),
+]
+
+_ID = ["group_id", "spice", "target"]
+_RAW = ["sensor_index", "heater_profile_step_index", "scanning_cycle_index", "timestamp_since_poweron",
+        "real_time_clock", "temperature", "pressure", "relative_humidity", "resistance_gassensor",
+        "label_tag", "error_code"]
+_SUMMARY = ["n_samples", "log_mean", "log_std", "log_median", "log_min", "log_max", "log_p10", "log_p90",
+            "log_delta", "log_slope_per_s"]
+# Columns each stage writes (Step 5 adds the S*_H* family matched by PATTERNS)
+STAGES = {
+    "raw": _RAW,
+    "labeled": _RAW + ["spice", "target", "group_id"],
+    "step1": _RAW + ["spice", "target", "group_id", "log_resistance"],
+    "step2": _ID + ["sensor_index", "heater_profile_step_index"] + _SUMMARY,
+    "step3": _ID + ["sensor_index", "heater_profile_step_index"] + _SUMMARY,
+    "step4": _ID + ["temp_mean", "rh_mean", "pressure_mean"],
+    "step5": _ID + ["temp_mean", "rh_mean", "pressure_mean"],
+}
+
+def column_dtype(name: str):
+    """Schema dtype of a column, or None if the schema does not know it."""
+    if name in COLUMNS:
+        return COLUMNS[name]
+    for rx, kind in PATTERNS:
+        if rx.match(name):
+            return kind
+    return None
+
+def stage_of(header: list) -> str:
+    """Latest stage whose columns are all present (None if the table matches none)."""
+    cols = set(header)
+    found = [s for s, req in STAGES.items() if set(req) <= cols]
+    return found[-1] if found else None
+
+def parse_dtypes(columns=None) -> dict:
+    """dtype= argument for pd.read_csv: categorical keys are parsed straight into categories."""
+    names = [c for c, kind in COLUMNS.items() if kind == CATEGORY]
+    return {c: CATEGORY for c in names if columns is None or c in columns}
+
+def compact(df, float32: bool = False, name: str = ""):
+    """Return df with the schema applied (one astype call). Integers are range-checked first."""
+    import pandas as pd
+    conv, reorder = {}, {}
+    for c in df.columns:
+        kind = column_dtype(c)
+        s = df[c]
+        if kind == CATEGORY:
+            if not isinstance(s.dtype, pd.CategoricalDtype):
+                conv[c] = CATEGORY
+            elif not s.cat.categories.is_monotonic_increasing:
+                # The low-memory parser appends values first seen in later internal chunks; code
+                # order must be string order for sort_values / sorted groupby to match object columns
+                # (astype would not do it: unordered dtypes with the same categories compare equal)
+                reorder[c] = s.cat.reorder_categories(s.cat.categories.sort_values())
+        elif kind is not None and kind != FLOAT and pd.api.types.is_integer_dtype(s.dtype):
+            info = np.iinfo(kind)
+            if len(s) == 0 or (s.min() >= info.min and s.max() <= info.max):
+                if s.dtype != kind:
+                    conv[c] = kind
+            else:
+                print(f"[WARN] {name}{c}: values {s.min()}..{s.max()} do not fit {kind}; kept {s.dtype}",
+                      file=sys.stderr)
+        elif float32 and pd.api.types.is_float_dtype(s.dtype) and s.dtype != np.float32:
+            conv[c] = np.float32
+    if reorder:
+        df = df.assign(**reorder)
+    return df.astype(conv) if conv else df
+
+def read_csv(src, float32: bool = False, **kwargs):
+    """pd.read_csv with the schema applied; with chunksize= each chunk is compacted as it is read."""
+    import pandas as pd
+    usecols = kwargs.get("usecols")
+    dtype = parse_dtypes(None if usecols is None or callable(usecols) else set(usecols))
+    dtype.update(kwargs.pop("dtype", None) or {})
+    label = f"{Path(src).name}: "
+    if kwargs.get("chunksize"):
+        return (compact(chunk, float32, label) for chunk in pd.read_csv(src, dtype=dtype, **kwargs))
+    return compact(pd.read_csv(src, dtype=dtype, **kwargs), float32, label)
+
+def _mb(s) -> float:
+    return s.memory_usage(deep=True, index=False) / 1e6
+
+def main(src: Path, float32: bool = False):
+    import pandas as pd
+    start = time.time()
+    before = pd.read_csv(src)
+    t_plain = time.time() - start
+    start = time.time()
+    after = read_csv(src, float32=float32)
+    t_schema = time.time() - start
+    header = list(before.columns)
+    print(f"[INFO] {src.name}: {len(before):,} rows x {len(header)} columns, stage: {stage_of(header) or 'unknown'}")
+
+    rows = []
+    for c in header:
+        err = None
+        if before[c].dtype.kind == "f" and after[c].dtype == np.float32:
+            ref = before[c].to_numpy()
+            with np.errstate(invalid="ignore", divide="ignore"):
+                rel = np.abs(after[c].to_numpy(dtype=np.float64) - ref) / np.abs(ref)
+            err = float(np.nanmax(rel, initial=0.0))
+        rows.append((c, str(before[c].dtype), str(after[c].dtype), _mb(before[c]), _mb(after[c]), err))
+    unknown = [c for c in header if column_dtype(c) is None]
+
+    # Group the wide S*_H* families so a 1000+ column table still prints a short report
+    groups = {}
+    for c, old, new, mb_old, mb_new, err in rows:
+        key = re.sub(r"^S\d+_H\d+_", "S*_H*_", c)
+        g = groups.setdefault((key, old, new), [0, 0.0, 0.0, None])
+        g[0] += 1
+        g[1] += mb_old
+        g[2] += mb_new
+        if err is not None:
+            g[3] = max(g[3] or 0.0, err)
+    print(f"{'column':<28}{'n':>5}  {'read_csv':<10}{'schema':<10}{'MB before':>11}{'MB after':>10}  max rel err")
+    for (key, old, new), (n, mb_old, mb_new, err) in groups.items():
+        print(f"{key:<28}{n:>5}  {old:<10}{new:<10}{mb_old:>11.2f}{mb_new:>10.2f}  {'' if err is None else f'{err:.1e}'}")
+    total_old = sum(r[3] for r in rows)
+    total_new = sum(r[4] for r in rows)
+    print(f"[OK] Memory: {total_old:.1f} MB -> {total_new:.1f} MB ({total_old / max(total_new, 1e-9):.1f}x smaller) | "
+          f"read {t_plain:.2f}s plain, {t_schema:.2f}s with schema")
+    if unknown:
+        print(f"[INFO] Not in the schema (left as parsed): {unknown[:10]}{' ...' if len(unknown) > 10 else ''}")
+    return total_old, total_new
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Report the memory saved by the shared column dtype schema")
+    p.add_argument("--src", required=True, type=str, help="Any pipeline table (raw, labeled, Step 1-5, Train/Test)")
+    p.add_argument("--float32", action="store_true", help="Also store float columns as float32")
+    args = p.parse_args()
+    main(Path(args.src), args.float32)
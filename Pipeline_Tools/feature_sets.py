@@ -0,0 +1,158 @@
+# feature_sets.py
+# Purpose: Declare each feature set (Reduced, ReducedPlus, ReducedPlus2, ...) once as a column plan
+# over the Step-5 wide table, and materialise it on demand.
+# Only the source columns a set needs are parsed (and cached per column by dataset_cache),
+# and derived columns are computed when the set is first requested, then cached as well.
+#
+# Example:
+#   python feature_sets.py --list
+#   python feature_sets.py --src train_features.csv --set reduced_plus2 --dst train_reduced_plus2.csv
+
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import re
+import numpy as np
+
+from dataset_cache import ColumnStore
+import rp2_features
+
+ID_COLS = ["group_id","spice","target"]
+CTX_COLS = ["temp_mean","rh_mean","pressure_mean"]
+
+REL_MEAN_PAT = re.compile(r"^S(\d+)_H(\d+)_log_mean_rel$")
+
+class FeatureSet:
+    """A named column plan: which wide-table columns it reads and how derived columns are built."""
+
+    def __init__(self, name: str, select, derive=None, description: str = ""):
+        self.name = name
+        self.select = select    # header (list of column names) -> source feature columns, in order
+        self.derive = derive    # DataFrame of ID + source columns -> DataFrame of ID + features
+        self.description = description
+
+    def source_columns(self, header: list) -> list:
+        cols = self.select(header)
+        return [c for c in ID_COLS if c in header] + [c for c in cols if c not in ID_COLS]
+
+REGISTRY = {}
+
+def register(name: str, select, derive=None, description: str = "") -> FeatureSet:
+    fs = FeatureSet(name, select, derive, description)
+    REGISTRY[name] = fs
+    return fs
+
+# === Column plans ===
+
+def select_all(header):
+    return [c for c in header if c not in ID_COLS]
+
+def select_reduced_cols(header):
+    # Approach_1: rel, log_slope_per_s, log_std, plus context means; per-cell counts (_n) dropped
+    keep = []
+    for c in header:
+        if c in ID_COLS:
+            continue
+        if c in CTX_COLS:
+            keep.append(c)
+            continue
+        if c.endswith("_n"):
+            continue
+        if c.endswith("_rel") or c.endswith("_log_slope_per_s") or c.endswith("_log_std"):
+            keep.append(c)
+    return keep
+
+def select_reduced_plus_sources(header):
+    # Reduced base; the log_mean_rel block it derives from is already part of it
+    return select_reduced_cols(header)
+
+def derive_reduced_plus(df: pd.DataFrame) -> pd.DataFrame:
+    import pandas as pd
+    # Approach_2: Reduced base plus per-sensor AUC and step-to-step deltas of log_mean_rel
+    base_cols = select_reduced_cols(list(df.columns))
+    per_sensor = {}
+    for c in df.columns:
+        m = REL_MEAN_PAT.match(c)
+        if m:
+            per_sensor.setdefault(int(m.group(1)), []).append((int(m.group(2)), c))
+
+    feats = {c: df[c].to_numpy() for c in base_cols}
+    for s, seq in per_sensor.items():
+        cols = [c for _, c in sorted(seq, key=lambda x: x[0])]
+        vals = df[cols].to_numpy(dtype=float)
+
+        # AUC across steps 1..9 (exclude baseline step 0); NaN-skipping like Series.sum
+        if len(cols) >= 2:
+            auc = np.ascontiguousarray(np.where(np.isnan(vals[:, 1:]), 0.0, vals[:, 1:])).sum(axis=1)
+        else:
+            auc = np.zeros(len(df))
+        feats[f"S{s}_AUC_rel_mean"] = auc
+
+        # Deltas rel(k) - rel(k-1) by position in the step-sorted sequence
+        for k in range(1, len(cols)):
+            feats[f"S{s}_H{k}_d_rel_mean"] = vals[:, k] - vals[:, k - 1]
+
+    out = pd.concat([df[ID_COLS].reset_index(drop=True), pd.DataFrame(feats)], axis=1)
+    for c in out.columns:
+        if c in ID_COLS:
+            continue
+        out[c] = pd.to_numeric(out[c], errors="coerce")
+    return out
+
+def derive_selected(df: pd.DataFrame) -> pd.DataFrame:
+    return df
+
+register("full", select_all, derive_selected,
+         "Complete Step-5 wide table (all stats, counts and context)")
+register("reduced", select_reduced_cols, derive_selected,
+         "Approach_1 Reduced: *_rel, *_log_slope_per_s, *_log_std, context means")
+register("reduced_plus", select_reduced_plus_sources, derive_reduced_plus,
+         "Approach_2 ReducedPlus: Reduced + per-sensor AUC and step deltas of log_mean_rel")
+register("reduced_plus2", lambda header: [c for c in rp2_features.source_columns(header) if c not in ID_COLS],
+         rp2_features.rp2_frame,
+         "Approach_3 ReducedPlus2: early/mid/tail shape summaries, peaks, ratios, slopes, pair ratios")
+
+# === Materialisation ===
+
+def materialise(src: Path, name: str, store: ColumnStore = None, cache_derived: bool = True) -> pd.DataFrame:
+    """Return feature set `name` for the wide table at src (ID columns first)."""
+    fs = REGISTRY[name]
+    store = store or ColumnStore(src)
+    computed = fs.derive is not derive_selected
+
+    # Derived sets are cached after the first build and served from the store afterwards
+    if cache_derived and computed:
+        cached = store.load_derived(name)
+        if cached is not None:
+            return cached
+
+    frame = fs.derive(store.load(fs.source_columns(store.header)))
+    if cache_derived and computed:
+        store.put_derived(name, frame)
+    return frame
+
+def write_feature_set(src: Path, name: str, dst: Path):
+    out = materialise(src, name)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    out.to_csv(dst, index=False)
+    print(f"[OK] Wrote {name}: {dst} | feature cols = {out.shape[1] - len(ID_COLS)}")
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Materialise a registered feature set from a Step-5 wide table")
+    p.add_argument("--list", action="store_true", help="List registered feature sets and exit")
+    p.add_argument("--src", type=str, help="Path to Step-5 features CSV")
+    p.add_argument("--set", type=str, choices=sorted(REGISTRY), help="Feature set name")
+    p.add_argument("--dst", type=str, help="Output CSV (optional; omit to only warm the cache)")
+    args = p.parse_args()
+
+    if args.list:
+        for n, fs in REGISTRY.items():
+            print(f"{n:15s} {fs.description}")
+    else:
+        if not args.src or not args.set:
+            p.error("--src and --set are required unless --list is given")
+        if args.dst:
+            write_feature_set(Path(args.src), args.set, Path(args.dst))
+        else:
+            out = materialise(Path(args.src), args.set)
+            print(f"[OK] {args.set}: rows={len(out)} feature cols={out.shape[1] - len(ID_COLS)}")
@@ -0,0 +1,126 @@
+# feature_sweep.py
+# Purpose: One run in place of the per-feature raw-data notebooks (resistance, pressure,
+# temperature, humidity, all features). Train_All/Test_All are parsed once, and every
+# (feature subset, model) pair is one job on a shared process pool. Jobs read columns of the
+# same memory-mapped arrays (and, with --prebin, the same pre-binned codes for gb/xgb). Each
+# subset writes the usual notebook artifacts under <out_dir>/<subset>/<Model>/, and the sweep
+# writes one comparison table of accuracy against training and inference time.
+#
+# Example:
+#   python feature_sweep.py --train Train_All.csv --test Test_All.csv --out_dir sweep
+#   python feature_sweep.py --train Train_All.csv --test Test_All.csv --out_dir sweep \
+#       --subsets "relative_humidity;pressure;pressure,temperature" --models rf,gb,lr
+
+from pathlib import Path
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import binned_cache
+import train_models
+from train_models import MODELS, FEATURES
+
+# Tags used by the single-feature notebooks (rf_humidity_model.joblib, ...)
+SHORT = {"resistance_gassensor": "resistance", "pressure": "pressure",
+         "temperature": "temperature", "relative_humidity": "humidity"}
+ALL_TAG = "all_features"
+
+def all_subsets(features: list) -> list:
+    """Every non-empty combination of features, smallest first (15 for the four raw features)."""
+    return [list(c) for r in range(1, len(features) + 1) for c in itertools.combinations(features, r)]
+
+def parse_subsets(spec: str) -> list:
+    """'a;b,c' -> [['a'], ['b', 'c']]"""
+    return [[c.strip() for c in part.split(",") if c.strip()] for part in spec.split(";") if part.strip()]
+
+def subset_tag(subset: list, features: list) -> str:
+    if sorted(subset) == sorted(features):
+        return ALL_TAG
+    return "_".join(SHORT.get(c, c) for c in subset)
+
+def main(train_csv: Path, test_csv: Path, out_base: Path, models: list, subsets: list = None,
+         workers: int = None, force: bool = False, prebin: bool = False):
+    import pandas as pd
+    subsets = subsets or all_subsets(FEATURES)
+    features = [c for c in FEATURES if any(c in s for s in subsets)]
+    features += [c for s in subsets for c in s if c not in features]
+    tags = [subset_tag(s, FEATURES) for s in subsets]
+
+    # Safety guard: stop if a subset folder exists and is not empty to protect prior runs
+    busy = [t for t in tags if (out_base / t).exists() and any((out_base / t).iterdir())]
+    if busy and not force:
+        print(f"Safety guard: output folders already exist and are not empty: {busy}")
+        print("Create a new output folder, archive/clear the existing ones, or pass --force.")
+        sys.exit(1)
+    out_base.mkdir(parents=True, exist_ok=True)
+
+    # Parse once; every job selects its columns from the same shared arrays
+    arrays, spice_map = train_models.load_xy(train_csv, test_csv, features)
+    encoder = None
+    if prebin and binned_cache.PREBIN_MODELS.intersection(models):
+        arrays["Xb_train"], train_bins = binned_cache.binned_matrix(train_csv, features)
+        arrays["Xb_test"], _ = binned_cache.binned_matrix(test_csv, features, reference=train_bins)
+        encoder = train_bins.encoder(features)
+    n_test = len(arrays["y_test"])
+    print(f"[INFO] Train {arrays['X_train'].shape} | Test {arrays['X_test'].shape} | "
+          f"{len(subsets)} subsets x {len(models)} models")
+
+    jobs = []
+    for key in [k for k in train_models.SCHEDULE_ORDER if k in models]:
+        for subset, tag in zip(subsets, tags):
+            cols = [features.index(c) for c in subset]
+            enc = binned_cache.BinEncoder([encoder.thresholds[i] for i in cols]) if encoder else None
+            jobs.append((train_models.train_one, dict(
+                key=key, shared=None, out_base=str(out_base / tag),
+                tag=None if tag == ALL_TAG else tag,
+                feature=None if tag == ALL_TAG else ",".join(subset),
+                spice_map=spice_map, n_jobs=1, encoder=enc, columns=cols)))
+
+    cpus = os.cpu_count() or 1
+    workers = workers or min(len(jobs), cpus)
+    n_jobs = max(1, cpus // workers)
+    with tempfile.TemporaryDirectory(prefix="sweep_shared_") as tmp:
+        shared = train_models.share_arrays(arrays, Path(tmp))
+        del arrays
+        for _, kw in jobs:
+            kw.update(shared=shared, n_jobs=n_jobs)
+        start = time.time()
+        results = train_models.run_pool(jobs, workers)
+        wall = time.time() - start
+
+    table = pd.DataFrame(results)
+    table["subset"] = table["tag"].fillna(ALL_TAG)
+    table["n_features"] = table["subset"].map(dict(zip(tags, map(len, subsets))))
+    if "predict_time_sec" in table:
+        table["predict_us_per_row"] = (1e6 * table["predict_time_sec"] / max(n_test, 1)).round(3)
+    cols = ["subset", "n_features", "model", "name", "test_accuracy_percent", "train_time_sec",
+            "predict_time_sec", "predict_us_per_row", "error"]
+    table = table.reindex(columns=cols).sort_values(["test_accuracy_percent", "train_time_sec"],
+                                                    ascending=[False, True])
+    table.to_csv(out_base / "sweep_comparison.csv", index=False)
+    table.pivot_table(index="subset", columns="model", values="test_accuracy_percent") \
+        .to_csv(out_base / "sweep_accuracy_matrix.csv")
+
+    print(table.head(15).to_string(index=False))
+    print(f"[INFO] {len(jobs)} jobs | workers {workers} x {n_jobs} threads | wall {wall:.2f}s vs "
+          f"sum of train times {table['train_time_sec'].sum():.2f}s")
+    print(f"[OK] Comparison: {out_base / 'sweep_comparison.csv'}")
+    return table
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Train every model on every feature subset from a single data load")
+    p.add_argument("--train", required=True, type=str, help="Training CSV (e.g. Train_All.csv)")
+    p.add_argument("--test", required=True, type=str, help="Testing CSV (e.g. Test_All.csv)")
+    p.add_argument("--out_dir", required=True, type=str, help="Base output folder (one sub-folder per subset)")
+    p.add_argument("--models", type=str, default=",".join(MODELS), help=f"Comma list from {list(MODELS)}")
+    p.add_argument("--subsets", type=str, default=None,
+                   help="Semicolon-separated subsets of comma-separated columns (default: all 15 combinations)")
+    p.add_argument("--workers", type=int, default=None, help="Process count (default: min(#jobs, #cpus))")
+    p.add_argument("--force", action="store_true", help="Write into non-empty subset folders")
+    p.add_argument("--prebin", action="store_true", help="Fit gb/xgb on cached pre-binned codes (changes XGBoost results)")
+    args = p.parse_args()
+    main(Path(args.train), Path(args.test), Path(args.out_dir), args.models.split(","),
+         parse_subsets(args.subsets) if args.subsets else None, args.workers, args.force, args.prebin)
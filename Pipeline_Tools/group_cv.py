@@ -0,0 +1,255 @@
+# group_cv.py
+# Purpose: Leakage-free cross-validation for the existing classifiers.
+# Folds keep whole groups (recording sessions, cycles within a session, or scanning cycles) on
+# one side of the split, are stratified by spice, and are built once per dataset: the fold assignment is cached
+# under the dataset fingerprint (.cache/<stem>_<fp>/folds/) and reused by every later run.
+# All (model, fold) fits run on one process pool over memory-mapped X/y. The default level is
+# session_cycle: the standard layout records each spice in one session, so whole-session folds
+# would test each spice on a model that never saw it. A level where some spice has fewer
+# groups than folds falls back to the next finer one with a warning.
+#
+# Example:
+#   python group_cv.py --src Train_All.csv --models rf,gb,knn --folds 5 --out_dir cv_outputs
+#   python group_cv.py --src train_features.csv --feature_set reduced --group_level cycle --out_dir cv_reduced
+
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+from dataset_cache import ColumnStore, cache_root, _write_json_atomic
+import binned_cache
+import train_models
+from train_models import MODELS, FEATURES, LABEL_COL
+
+GROUP_LEVELS = ["session", "session_cycle", "cycle"]   # coarsest first
+DEFAULT_LEVEL = "session_cycle"   # the standard layout has one session per spice but several cycles
+
+def session_ids(df: pd.DataFrame) -> np.ndarray:
+    """Recording session per row: a `session` column if present, else inferred per spice from
+    timestamp_since_poweron restarting (a new power-on) while reading rows in recording order."""
+    import pandas as pd
+    if "session" in df.columns:
+        return df["session"].astype(str).to_numpy()
+    if "timestamp_since_poweron" not in df.columns:
+        raise ValueError("Session grouping needs a 'session' or 'timestamp_since_poweron' column")
+    spice = df["spice"].astype(str) if "spice" in df.columns else df[LABEL_COL].astype(str)
+    ts = df["timestamp_since_poweron"].to_numpy()
+    new_session = np.r_[True, (ts[1:] < ts[:-1]) | (spice.to_numpy()[1:] != spice.to_numpy()[:-1])]
+    counter = pd.Series(new_session.astype(int)).groupby(spice.to_numpy()).cumsum().to_numpy() - 1
+    return (spice + "_s" + pd.Series(counter, index=spice.index).astype(str)).to_numpy()
+
+def make_groups(df: pd.DataFrame, level: str) -> np.ndarray:
+    """Group label per row for the requested level (session, session_cycle or cycle)."""
+    import pandas as pd
+    if level == "session":
+        return session_ids(df)
+    if "group_id" in df.columns:
+        cycle = df["group_id"].astype(str)
+    else:
+        cycle = df["spice"].astype(str) + "_cycle_" + df["scanning_cycle_index"].astype(int).astype(str)
+    if level == "cycle":
+        return cycle.to_numpy()
+    if level == "session_cycle":
+        return (pd.Series(session_ids(df), index=df.index) + "/" + cycle).to_numpy()
+    raise ValueError(f"Unknown group level: {level}")
+
+def resolve_level(df: pd.DataFrame, level: str, n_splits: int) -> str:
+    """The requested level, or the next finer one (with a warning) when it cannot be grouped or
+    some class has fewer groups than folds, so that every test fold can hold every class."""
+    import pandas as pd
+    y = df[LABEL_COL].to_numpy()
+    reason, last = None, level
+    for cand in GROUP_LEVELS[GROUP_LEVELS.index(level):]:
+        try:
+            per_class = pd.Series(make_groups(df, cand)).groupby(y).nunique()
+        except ValueError as e:
+            reason = f"{cand}: {e}"
+            continue
+        last = cand
+        if per_class.min() >= n_splits:
+            if cand != level:
+                print(f"[WARN] {reason}; using --group_level {cand}", file=sys.stderr)
+            return cand
+        reason = f"{cand}: class {per_class.idxmin()} has only {per_class.min()} group(s) for {n_splits} folds"
+    print(f"[WARN] {reason}; no finer level helps, some folds will miss classes", file=sys.stderr)
+    return last
+
+def build_folds(y: np.ndarray, groups: np.ndarray, n_splits: int, seed: int) -> np.ndarray:
+    """Assign every row a test-fold number; groups never straddle folds, classes are stratified."""
+    import pandas as pd
+    from sklearn.model_selection import StratifiedGroupKFold
+
+    n_groups = len(pd.unique(groups))
+    if n_groups < n_splits:
+        raise ValueError(f"Only {n_groups} groups for {n_splits} folds; use fewer folds or a finer --group_level")
+    fold = np.full(len(y), -1, dtype=np.int8)
+    cv = StratifiedGroupKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    for k, (_, test_idx) in enumerate(cv.split(np.zeros(len(y)), y, groups)):
+        fold[test_idx] = k
+
+    classes = np.unique(y)
+    for k in range(n_splits):
+        missing = np.setdiff1d(classes, np.unique(y[fold != k]))
+        if missing.size:
+            print(f"[WARN] Fold {k}: classes {missing.tolist()} absent from training part", file=sys.stderr)
+    return fold
+
+def cached_folds(src: Path, df: pd.DataFrame, level: str, n_splits: int, seed: int) -> np.ndarray:
+    """Return fold assignments for src, building and caching them on first use."""
+    import pandas as pd
+    folds_dir = cache_root(src) / "folds"
+    folds_dir.mkdir(parents=True, exist_ok=True)
+    base = folds_dir / f"{level}_k{n_splits}_seed{seed}"
+    if base.with_suffix(".npy").exists():
+        print(f"[INFO] Reusing cached folds: {base.with_suffix('.npy')}")
+        return np.load(base.with_suffix(".npy"))
+
+    groups = make_groups(df, level)
+    y = df[LABEL_COL].to_numpy()
+    fold = build_folds(y, groups, n_splits, seed)
+    np.save(base.with_suffix(".npy"), fold)
+    meta = {
+        "source": str(src), "group_level": level, "n_splits": n_splits, "seed": seed,
+        "n_rows": int(len(fold)), "n_groups": int(len(pd.unique(groups))),
+        "groups_per_fold": {str(k): sorted(pd.unique(groups[fold == k]).tolist()) for k in range(n_splits)},
+    }
+    _write_json_atomic(base.with_suffix(".json"), meta)
+    print(f"[OK] Built folds: {base.with_suffix('.npy')}  (groups={meta['n_groups']})")
+    return fold
+
+def load_data(src: Path, features: list, feature_set: str, level: str):
+    """Return (X, y, frame used for grouping, feature names). Columns come from the per-column cache."""
+    if feature_set:
+        import feature_sets
+        frame = feature_sets.materialise(src, feature_set)
+        feats = [c for c in frame.columns if c not in feature_sets.ID_COLS]
+        return frame[feats].to_numpy(dtype=float), frame[LABEL_COL].to_numpy(), frame, feats
+
+    store = ColumnStore(src)
+    header = store.header
+    missing = [c for c in features + [LABEL_COL] if c not in header]
+    if missing:
+        raise ValueError(f"{src.name} is missing columns: {missing}")
+    group_cols = [c for c in ["spice", "group_id", "scanning_cycle_index", "session", "timestamp_since_poweron"]
+                  if c in header and c not in features]
+    frame = store.load(features + [LABEL_COL] + group_cols)
+    return frame[features].to_numpy(), frame[LABEL_COL].to_numpy(), frame, features
+
+def run_fold(key: str, fold: int, shared: dict, n_jobs: int) -> dict:
+    """Worker: fit one model on all folds but `fold` and score it on `fold`."""
+    from threadpoolctl import threadpool_limits
+    from sklearn.metrics import accuracy_score, f1_score
+
+    data = train_models.load_shared(shared)
+    X, y, folds = data["X"], data["y"], data["folds"]
+    if key in binned_cache.PREBIN_MODELS and "Xb" in data:
+        X = binned_cache.model_input(data["Xb"][fold])
+    train_idx = np.flatnonzero(folds != fold)
+    test_idx = np.flatnonzero(folds == fold)
+    X_train, y_train = X[train_idx], y[train_idx]
+    X_test, y_test = X[test_idx], y[test_idx]
+
+    with threadpool_limits(limits=n_jobs):
+        clf, _ = train_models.build_model(key, X.shape[1], int(np.unique(y).size), n_jobs)
+        start = time.time()
+        clf.fit(X_train, y_train)
+        fit_time = time.time() - start
+        start = time.time()
+        y_pred = np.asarray(clf.predict(X_test))
+        predict_time = time.time() - start
+
+    acc = accuracy_score(y_test, y_pred)
+    return {
+        "model": key, "fold": fold,
+        "n_train": int(len(train_idx)), "n_test": int(len(test_idx)),
+        "accuracy": acc,
+        "macro_f1": f1_score(y_test, y_pred, average="macro"),
+        "fit_time_sec": round(fit_time, 4),
+        "predict_time_sec": round(predict_time, 4),
+    }
+
+def summarise(folds_df: pd.DataFrame) -> pd.DataFrame:
+    ok = folds_df.dropna(subset=["accuracy"])
+    summary = ok.groupby("model").agg(
+        folds=("fold", "count"),
+        mean_accuracy=("accuracy", "mean"),
+        std_accuracy=("accuracy", "std"),
+        mean_macro_f1=("macro_f1", "mean"),
+        std_macro_f1=("macro_f1", "std"),
+        mean_fit_time_sec=("fit_time_sec", "mean"),
+        total_fit_time_sec=("fit_time_sec", "sum"),
+    ).reset_index()
+    summary["mean_accuracy_percent"] = (100.0 * summary["mean_accuracy"]).round(2)
+    return summary
+
+def main(src: Path, out_dir: Path, models: list, features: list, feature_set: str = None,
+         level: str = DEFAULT_LEVEL, n_splits: int = 5, seed: int = 42, workers: int = None,
+         prebin: bool = False):
+    import pandas as pd
+    out_dir.mkdir(parents=True, exist_ok=True)
+    X, y, frame, feats = load_data(src, features, feature_set, level)
+    level = resolve_level(frame, level, n_splits)
+    fold = cached_folds(src, frame, level, n_splits, seed)
+    del frame
+    arrays = {"X": X, "y": y, "folds": fold}
+    if prebin and binned_cache.PREBIN_MODELS.intersection(models):
+        # One code matrix per fold, binned on that fold's training rows only
+        arrays["Xb"] = np.stack([binned_cache.fold_codes(X, fold != f)[0] for f in range(n_splits)])
+    print(f"[INFO] Rows: {len(y)} | features: {X.shape[1]} | folds: {n_splits} ({level})")
+
+    jobs_spec = [(k, f) for k in train_models.SCHEDULE_ORDER if k in models for f in range(n_splits)]
+    cpus = os.cpu_count() or 1
+    workers = workers or min(len(jobs_spec), cpus)
+    n_jobs = max(1, cpus // workers)
+
+    with tempfile.TemporaryDirectory(prefix="cv_shared_") as tmp:
+        shared = train_models.share_arrays(arrays, Path(tmp))
+        del X, arrays
+        jobs = [(run_fold, dict(key=k, fold=f, shared=shared, n_jobs=n_jobs)) for k, f in jobs_spec]
+        start = time.time()
+        results = train_models.run_pool(jobs, workers)
+        wall = time.time() - start
+
+    cols = ["model", "fold", "n_train", "n_test", "accuracy", "macro_f1", "fit_time_sec", "predict_time_sec", "error"]
+    folds_df = pd.DataFrame(results).reindex(columns=cols).sort_values(["model", "fold"])
+    summary = summarise(folds_df)
+    folds_df.to_csv(out_dir / "cv_folds.csv", index=False)
+    summary.to_csv(out_dir / "cv_summary.csv", index=False)
+    (out_dir / "cv_config.json").write_text(json.dumps({
+        "source": str(src), "feature_set": feature_set, "features": None if feature_set else features,
+        "group_level": level, "n_splits": n_splits, "seed": seed, "prebin": prebin,
+        "workers": workers, "threads_per_worker": n_jobs, "wall_time_sec": round(wall, 4)
+    }, indent=2))
+
+    for _, r in summary.iterrows():
+        print(f"[OK] {MODELS[r['model']][2]}: {r['mean_accuracy_percent']}% "
+              f"(std {100.0 * r['std_accuracy']:.2f}) over {r['folds']} folds | "
+              f"fit {r['mean_fit_time_sec']:.2f}s/fold")
+    print(f"[INFO] Wall {wall:.2f}s vs sum of fit times {folds_df['fit_time_sec'].sum():.2f}s")
+    print(f"[OK] Results: {out_dir / 'cv_folds.csv'} , {out_dir / 'cv_summary.csv'}")
+    return summary
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Group-aware parallel cross-validation with cached fold indices")
+    p.add_argument("--src", required=True, type=str, help="Labeled CSV (raw rows or a Step-5 wide table)")
+    p.add_argument("--out_dir", required=True, type=str, help="Folder for cv_folds.csv / cv_summary.csv")
+    p.add_argument("--models", type=str, default="rf,gb", help=f"Comma list from {list(MODELS)}")
+    p.add_argument("--features", type=str, default=",".join(FEATURES), help="Comma list of feature columns")
+    p.add_argument("--feature_set", type=str, default=None,
+                   help="Registered feature set (feature_sets.py) to use instead of --features")
+    p.add_argument("--group_level", choices=GROUP_LEVELS, default=DEFAULT_LEVEL,
+                   help="Unit kept whole within a fold (session needs rows in recording order or a 'session' "
+                        "column); falls back to a finer level if a class has fewer groups than folds")
+    p.add_argument("--folds", type=int, default=5)
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--workers", type=int, default=None, help="Process count (default: min(#fits, #cpus))")
+    p.add_argument("--prebin", action="store_true", help="Fit gb/xgb folds on codes binned from each fold's training rows")
+    args = p.parse_args()
+    main(Path(args.src), Path(args.out_dir), args.models.split(","), args.features.split(","),
+         args.feature_set, args.group_level, args.folds, args.seed, args.workers, args.prebin)
@@ -0,0 +1,227 @@
+# hyper_search.py
+# Purpose: Budgeted successive-halving search for the forest and boosting models (rf, gb, xgb).
+# Many sampled configurations are scored on a small training sample; only the best 1/eta move up
+# to the next rung, which trains on eta times more rows, until the last rung uses all rows.
+# Every fit grows its ensemble in steps and stops once the group-aware validation score stops
+# improving (early stopping). Validation uses the cached group folds from group_cv.py, so no
+# session or cycle appears on both sides. Candidates in a rung run in parallel, and the search
+# stops promoting once the CPU-hour budget would be exceeded.
+#
+# Example:
+#   python hyper_search.py --src Train_All.csv --model gb --candidates 27 --cpu_hours 0.5 --out_dir search
+
+from pathlib import Path
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+import binned_cache
+import group_cv
+import train_models
+from train_models import MODELS, FEATURES
+
+# Search spaces over the notebook estimators; the ensemble size is the early-stopped resource
+SPACES = {
+    "rf": {
+        "max_depth": [None, 8, 16, 32],
+        "max_features": ["sqrt", "log2", 0.5, 1.0],
+        "min_samples_leaf": [1, 2, 5, 10],
+        "bootstrap": [True, False],
+    },
+    "gb": {
+        "learning_rate": [0.03, 0.05, 0.1, 0.2, 0.3],
+        "max_leaf_nodes": [15, 31, 63, 127],
+        "max_depth": [None, 4, 6, 10],
+        "min_samples_leaf": [10, 20, 50, 100],
+        "l2_regularization": [0.0, 0.1, 1.0, 10.0],
+    },
+    "xgb": {
+        "learning_rate": [0.03, 0.05, 0.1, 0.2, 0.3],
+        "max_depth": [3, 4, 6, 8, 10],
+        "subsample": [0.6, 0.8, 1.0],
+        "colsample_bytree": [0.5, 0.8, 1.0],
+        "min_child_weight": [1, 3, 5],
+        "reg_lambda": [0.1, 1.0, 10.0],
+    },
+}
+
+# Ensemble-size parameter, growth step and ceiling per model
+GROWTH = {
+    "rf":  ("n_estimators", 50, 500),
+    "gb":  ("max_iter", 25, 500),
+    "xgb": ("n_estimators", 10, 1000),  # native early stopping after patience * step rounds
+}
+
+def sample_candidates(key: str, n: int, seed: int) -> list:
+    from sklearn.model_selection import ParameterSampler
+    return list(ParameterSampler(SPACES[key], n_iter=n, random_state=seed))
+
+def rung_plan(n_candidates: int, n_rows: int, min_rows: int, eta: int) -> list:
+    """[(candidates kept, training rows)] per rung; the last rung trains on all rows."""
+    n_rungs = max(1, 1 + int(math.floor(math.log(max(n_rows / min_rows, 1), eta))))
+    n_rungs = min(n_rungs, 1 + int(math.ceil(math.log(max(n_candidates, 1), eta))))
+    plan = []
+    for i in range(n_rungs):
+        keep = max(1, int(math.ceil(n_candidates / eta ** i)))
+        rows = n_rows if i == n_rungs - 1 else min(n_rows, min_rows * eta ** i)
+        plan.append((keep, rows))
+    return plan
+
+def evaluate(key: str, cand_id: int, params: dict, n_rows: int, val_fold: int, shared: dict,
+             n_jobs: int, patience: int, seed: int) -> dict:
+    """Worker: fit one configuration on the first n_rows of a fixed shuffle of the training part,
+    growing the ensemble until the validation accuracy stops improving."""
+    from threadpoolctl import threadpool_limits
+    from sklearn.metrics import accuracy_score
+
+    data = train_models.load_shared(shared)
+    X, y, folds = data["X"], data["y"], data["folds"]
+    train_idx = np.flatnonzero(folds != val_fold)
+    val_idx = np.flatnonzero(folds == val_fold)
+    # Nested samples across rungs: every rung takes a prefix of the same permutation
+    train_idx = np.sort(np.random.default_rng(seed).permutation(train_idx)[:n_rows])
+    X_train, y_train = X[train_idx], y[train_idx]
+    X_val, y_val = X[val_idx], y[val_idx]
+
+    size_param, step, ceiling = GROWTH[key]
+    start = time.time()
+    with threadpool_limits(limits=n_jobs):
+        clf, _ = train_models.build_model(key, X.shape[1], int(np.unique(y).size), n_jobs)
+        clf.set_params(**params)
+        if key == "xgb":
+            clf.set_params(n_estimators=ceiling, early_stopping_rounds=patience * step)
+            clf.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+            best_size = int(clf.best_iteration) + 1
+            score = accuracy_score(y_val, clf.predict(X_val))
+        else:
+            clf.set_params(warm_start=True)
+            if key == "gb":
+                clf.set_params(early_stopping=False)
+            score, best_size, stale = -1.0, 0, 0
+            for size in range(step, ceiling + 1, step):
+                clf.set_params(**{size_param: size})
+                clf.fit(X_train, y_train)
+                s = accuracy_score(y_val, clf.predict(X_val))
+                if s > score:
+                    score, best_size, stale = s, size, 0
+                else:
+                    stale += 1
+                    if stale >= patience:
+                        break
+    fit_time = time.time() - start
+
+    return {
+        "model": key, "candidate": cand_id, "rows": int(n_rows),
+        "val_accuracy": score, size_param: best_size,
+        "fit_time_sec": round(fit_time, 4), "cpu_sec": round(fit_time * n_jobs, 4),
+        "params": json.dumps(params),
+    }
+
+def main(src: Path, out_dir: Path, key: str, features: list, feature_set: str = None,
+         level: str = group_cv.DEFAULT_LEVEL, n_splits: int = 5, val_fold: int = 0, n_candidates: int = 27,
+         eta: int = 3, min_rows: int = None, cpu_hours: float = 1.0, patience: int = 2,
+         seed: int = 42, workers: int = None, prebin: bool = False):
+    import pandas as pd
+    if key not in SPACES:
+        raise ValueError(f"Search supports {sorted(SPACES)}, not {key}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    X, y, frame, _ = group_cv.load_data(src, features, feature_set, level)
+    level = group_cv.resolve_level(frame, level, n_splits)
+    folds = group_cv.cached_folds(src, frame, level, n_splits, seed)
+    del frame
+    if prebin and key in binned_cache.PREBIN_MODELS:
+        # Every trial trains on the same codes; edges come from the training part only
+        X = binned_cache.model_input(binned_cache.fold_codes(X, folds != val_fold)[0])
+    n_train = int((folds != val_fold).sum())
+    min_rows = min_rows or max(500, n_train // eta ** 3)
+    plan = rung_plan(n_candidates, n_train, min_rows, eta)
+    print(f"[INFO] {MODELS[key][2]}: {n_candidates} candidates, rungs (keep, rows) = {plan}")
+
+    budget_sec = cpu_hours * 3600.0
+    cpus = os.cpu_count() or 1
+    candidates = dict(enumerate(sample_candidates(key, n_candidates, seed)))
+    alive = list(candidates)
+    trials, spent, last_rung = [], 0.0, None
+
+    with tempfile.TemporaryDirectory(prefix="search_shared_") as tmp:
+        shared = train_models.share_arrays({"X": X, "y": y, "folds": folds}, Path(tmp))
+        del X
+        for rung, (keep, rows) in enumerate(plan):
+            alive = alive[:keep]
+            # Budget check: the next rung costs about eta x the previous per-candidate cost
+            if last_rung is not None:
+                per_cand = last_rung["cpu_sec"].mean() * rows / max(last_rung["rows"].iat[0], 1)
+                if spent + per_cand * len(alive) > budget_sec:
+                    print(f"[WARN] CPU budget reached ({spent / 3600:.3f} h spent); "
+                          f"stopping before rung {rung}", file=sys.stderr)
+                    break
+
+            workers_r = workers or min(len(alive), cpus)
+            n_jobs = max(1, cpus // workers_r)
+            jobs = [(evaluate, dict(key=key, cand_id=c, params=candidates[c], n_rows=rows, val_fold=val_fold,
+                                    shared=shared, n_jobs=n_jobs, patience=patience, seed=seed)) for c in alive]
+            start = time.time()
+            res = pd.DataFrame([r for r in train_models.run_pool(jobs, workers_r) if "error" not in r])
+            if res.empty:
+                raise RuntimeError(f"Every candidate failed in rung {rung}")
+            res["rung"] = rung
+            spent += res["cpu_sec"].sum()
+            trials.append(res)
+            last_rung = res
+
+            res = res.sort_values(["val_accuracy", "fit_time_sec"], ascending=[False, True])
+            alive = res["candidate"].tolist()
+            print(f"[OK] Rung {rung}: {len(res)} candidates on {rows} rows | best val acc "
+                  f"{100.0 * res['val_accuracy'].iat[0]:.2f}% | wall {time.time() - start:.1f}s | "
+                  f"CPU {spent / 3600:.3f} h")
+
+    trials_df = pd.concat(trials, ignore_index=True)
+    best = last_rung.sort_values(["val_accuracy", "fit_time_sec"], ascending=[False, True]).iloc[0]
+    size_param = GROWTH[key][0]
+    best_params = dict(json.loads(best["params"]), **{size_param: int(best[size_param])})
+
+    folder, prefix, console = MODELS[key]
+    trials_csv = out_dir / f"{prefix}_search_trials.csv"
+    trials_df.to_csv(trials_csv, index=False)
+    best_json = out_dir / f"{prefix}_best_params.json"
+    best_json.write_text(json.dumps({
+        "model": console, "best_params": best_params,
+        "val_accuracy": float(best["val_accuracy"]), "rows": int(best["rows"]),
+        "rungs_completed": int(trials_df["rung"].max()) + 1, "rungs_planned": len(plan),
+        "cpu_hours_spent": round(spent / 3600.0, 4), "cpu_hours_budget": cpu_hours,
+        "group_level": level, "val_fold": val_fold, "source": str(src),
+    }, indent=2))
+    print(f"[OK] Best {console}: {best_params} | val acc {100.0 * best['val_accuracy']:.2f}%")
+    print(f"[OK] Trials: {trials_csv} | best: {best_json}")
+    return best_params
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Successive-halving hyperparameter search for rf / gb / xgb")
+    p.add_argument("--src", required=True, type=str, help="Labeled CSV (raw rows or a Step-5 wide table)")
+    p.add_argument("--out_dir", required=True, type=str)
+    p.add_argument("--model", choices=sorted(SPACES), default="gb")
+    p.add_argument("--features", type=str, default=",".join(FEATURES), help="Comma list of feature columns")
+    p.add_argument("--feature_set", type=str, default=None, help="Registered feature set instead of --features")
+    p.add_argument("--group_level", choices=group_cv.GROUP_LEVELS, default=group_cv.DEFAULT_LEVEL,
+                   help="Unit kept whole within a fold (finer level used if a class has fewer groups than folds)")
+    p.add_argument("--folds", type=int, default=5, help="Group folds; one of them is the validation part")
+    p.add_argument("--val_fold", type=int, default=0)
+    p.add_argument("--candidates", type=int, default=27, help="Configurations sampled for the first rung")
+    p.add_argument("--eta", type=int, default=3, help="Keep 1/eta of the candidates per rung; rows grow by eta")
+    p.add_argument("--min_rows", type=int, default=None, help="Training rows in the first rung")
+    p.add_argument("--cpu_hours", type=float, default=1.0, help="CPU-hour budget for the whole search")
+    p.add_argument("--patience", type=int, default=2,
+                   help="Growth steps without validation improvement before a fit stops")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--prebin", action="store_true", help="Run gb/xgb trials on codes binned from the training part")
+    args = p.parse_args()
+    main(Path(args.src), Path(args.out_dir), args.model, args.features.split(","), args.feature_set,
+         args.group_level, args.folds, args.val_fold, args.candidates, args.eta, args.min_rows,
+         args.cpu_hours, args.patience, args.seed, args.workers, args.prebin)
@@ -0,0 +1,284 @@
+# ingest_daemon.py
+# Purpose: Watch an inbox folder for new raw BME688 .txt sessions and push each one through the
+# pipeline without rebuilding anything. Each new session runs RawToCSV -> segmentation ->
+# trimming -> labeling and then Steps 1-5 on its own rows, using the repo's reference scripts
+# (as conformance_harness.py runs them). The results are appended to the master labeled file
+# and to one table per step in --data_dir, so earlier sessions are never recomputed.
+# The spice comes from the file's folder or name (inbox/Anise/x.txt, anise_2024-05-02.txt) or from --spice.
+# A file is only picked up once its size and mtime stay the same for one poll, so half-copied
+# uploads are left alone. Processed files are recorded in ingest_ledger.json under the SHA-256
+# of their content, so touching, renaming or copying a file that was already ingested does not
+# ingest it again. A file that fails a stage is recorded as failed and is not retried until its
+# content changes (or its ledger entry is deleted). Nothing is appended until every stage of a
+# session has succeeded. Before the appends start, a pending ledger entry records the size of
+# every table. If an append or the partition write fails, or the daemon dies partway, the
+# tables are truncated back to those sizes (on the spot, or at the next start) and the
+# session's partitions are removed. The file is then ingested again from scratch, so a crash
+# never leaves duplicated rows.
+# Group ids: the labeling scripts name groups <Spice>_cycle_<c>, which is the same for every
+# session of a spice. Appending one session's Step 2-5 rows under those ids would duplicate
+# groups that a full rebuild merges. New sessions are therefore labeled
+# <Spice>_<session>_cycle_<c>, where <session> is the raw file name. Their step rows then stand on their
+# own, and rows already in the tables are left unchanged.
+# With --partition_root, each session's labeled rows are also written to a partitioned_store.py
+# store (spice=/day=/session=) so readers can prune by spice, day or session.
+#
+# Example:
+#   python ingest_daemon.py --inbox inbox --data_dir pipeline_data
+#   python ingest_daemon.py --inbox inbox --data_dir pipeline_data --spice Nutmeg --once
+
+from pathlib import Path
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import sys
+import time
+
+import partitioned_store
+from conformance_harness import SPICE_FILES, run_reference
+from dataset_cache import _write_json_atomic
+
+MASTER_NAME = "master_training_labeled.csv"
+TABLES = {
+    "step1": "master_step1_log.csv",
+    "step2": "master_step2_summaries.csv",
+    "step3": "master_step3_norm.csv",
+    "step4": "master_step4_context.csv",
+    "step5": "master_step5_wide.csv",
+}
+LEDGER_NAME = "ingest_ledger.json"
+
+def spice_for(path: Path, default: str = None) -> str:
+    """Spice named by the file's folder or file name, else the --spice default."""
+    for part in (path.parent.name, path.stem):
+        for spice in SPICE_FILES:
+            if re.search(rf"(?i)(^|[^a-z]){spice}([^a-z]|$)", part):
+                return spice
+    if default is None:
+        raise ValueError(f"Cannot tell the spice of {path.name}; put it under inbox/<Spice>/ or pass --spice")
+    return default
+
+def session_tag(path: Path) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "-", path.stem).strip("-") or "session"
+
+def stat_key(path: Path) -> str:
+    """Cheap name:size:mtime signature, used to see whether a file is still changing."""
+    st = path.stat()
+    return f"{path.name}:{st.st_size}:{st.st_mtime_ns}"
+
+def file_key(path: Path) -> str:
+    """Ledger key: SHA-256 of the file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"sha256:{digest.hexdigest()}"
+
+class Ledger:
+    """Processed inbox files (content hash -> summary), kept in <data_dir>/ingest_ledger.json.
+    Files that failed are kept too ({"failed": True, ...}) so they are not re-run on every poll."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.done = json.loads(path.read_text()) if path.exists() else {}
+        # Ledgers written before content keys used name:size:mtime; re-key the files still present
+        old = [k for k, v in self.done.items() if not k.startswith("sha256:")
+               and v.get("source") and Path(v["source"]).is_file()]
+        for k in old:
+            self.done.setdefault(file_key(Path(self.done[k]["source"])), self.done.pop(k))
+        if old:
+            _write_json_atomic(self.path, self.done)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.done and not self.done[key].get("pending")
+
+    def add(self, key: str, info: dict):
+        self.done[key] = info
+        _write_json_atomic(self.path, self.done)
+
+    def drop(self, key: str):
+        self.done.pop(key, None)
+        _write_json_atomic(self.path, self.done)
+
+    def pending(self) -> dict:
+        """Entries whose appends were started but never confirmed."""
+        return {k: v for k, v in self.done.items() if v.get("pending")}
+
+    def failed(self) -> int:
+        return sum(1 for v in self.done.values() if v.get("failed"))
+
+    def sessions(self) -> set:
+        return {v["session"] for v in self.done.values() if "session" in v}
+
+def table_sizes(data_dir: Path) -> dict:
+    """Byte size of every shared table (None if it does not exist yet)."""
+    sizes = {}
+    for name in [MASTER_NAME] + list(TABLES.values()):
+        path = data_dir / name
+        sizes[name] = path.stat().st_size if path.exists() else None
+    return sizes
+
+def roll_back(data_dir: Path, entry: dict):
+    """Undo a pending entry's appends: truncate each table to its recorded size and remove the
+    session's partitions."""
+    for name, size in entry["sizes"].items():
+        path = data_dir / name
+        if size is None:
+            path.unlink(missing_ok=True)
+        elif path.exists() and path.stat().st_size > size:
+            os.truncate(path, size)
+    if entry.get("partition_root"):
+        root = Path(entry["partition_root"])
+        session = partitioned_store.safe_value(entry["session"])
+        for folder in root.glob(f"spice=*/day=*/session={session}"):
+            shutil.rmtree(folder)
+        if root.exists():
+            partitioned_store.rebuild_manifest(root)
+
+def qualify_groups(labeled: Path, spice: str, tag: str) -> int:
+    """Rewrite <Spice>_cycle_<c> group ids as <Spice>_<session>_cycle_<c>. Returns the group count."""
+    import pandas as pd
+    df = pd.read_csv(labeled)
+    df["group_id"] = df["group_id"].astype(str).str.replace(rf"^{spice}_", f"{spice}_{tag}_", regex=True)
+    df.to_csv(labeled, index=False)
+    return int(df["group_id"].nunique())
+
+def append_rows(src: Path, table: Path) -> int:
+    """Append src's rows to table in table's column order (new columns are dropped with a warning)."""
+    import pandas as pd
+    new = pd.read_csv(src)
+    if not table.exists():
+        new.to_csv(table, index=False)
+        return len(new)
+    header = list(pd.read_csv(table, nrows=0).columns)
+    extra = [c for c in new.columns if c not in header]
+    if extra:
+        print(f"[WARN] {table.name}: dropping {len(extra)} column(s) not in the table: {extra[:5]}",
+              file=sys.stderr)
+    new.reindex(columns=header).to_csv(table, mode="a", header=False, index=False)
+    return len(new)
+
+def ingest(path: Path, spice: str, data_dir: Path, tag: str, ledger: Ledger, key: str,
+           partition_root: Path = None) -> dict:
+    """Run one raw session through every stage in a scratch folder, then append its results
+    under a pending ledger entry (rolled back if any append fails)."""
+    work = data_dir / "work" / tag
+    secs = {}
+    out = path
+    for stage in ("raw_to_csv", "segment", "trim", "label"):
+        out, secs[stage] = run_reference(stage, [out], work / stage, spice)
+    labeled = out
+    groups = qualify_groups(labeled, spice, tag)
+
+    step1, secs["step1"] = run_reference("step1", [labeled], work / "step1")
+    step2, secs["step2"] = run_reference("step2", [step1], work / "step2")
+    step3, secs["step3"] = run_reference("step3", [step2], work / "step3")
+    step4, secs["step4"] = run_reference("step4", [labeled], work / "step4")
+    step5, secs["step5"] = run_reference("step5", [step3, step4], work / "step5")
+
+    # Everything computed: only now touch the shared tables
+    entry = {"pending": True, "session": tag, "sizes": table_sizes(data_dir),
+             "partition_root": str(partition_root) if partition_root is not None else None}
+    ledger.add(key, entry)
+    try:
+        rows = {"master": append_rows(labeled, data_dir / MASTER_NAME)}
+        for stage, out in zip(TABLES, (step1, step2, step3, step4, step5)):
+            rows[stage] = append_rows(out, data_dir / TABLES[stage])
+        if partition_root is not None:
+            partitioned_store.write(labeled, partition_root, session=tag)
+    except BaseException:
+        roll_back(data_dir, entry)
+        ledger.drop(key)
+        raise
+    shutil.rmtree(work, ignore_errors=True)
+    return {"session": tag, "spice": spice, "groups": groups, "rows": rows,
+            "seconds": {k: round(v, 2) for k, v in secs.items()}}
+
+def scan(inbox: Path) -> list:
+    return sorted(p for p in inbox.rglob("*.txt") if p.is_file())
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def main(inbox: Path, data_dir: Path, spice: str = None, interval: float = 10.0, once: bool = False,
+         partition_root: Path = None):
+    # The stage scripts run in other folders, so hand them absolute paths
+    inbox, data_dir = inbox.resolve(), data_dir.resolve()
+    inbox.mkdir(parents=True, exist_ok=True)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    ledger = Ledger(data_dir / LEDGER_NAME)
+    # A run that died between its pending entry and the final one: undo its appends, ingest again
+    for key, entry in ledger.pending().items():
+        roll_back(data_dir, entry)
+        ledger.drop(key)
+        print(f"[WARN] Rolled back the unfinished ingest of session {entry['session']}", file=sys.stderr)
+    signal.signal(signal.SIGTERM, _raise_interrupt)
+    print(f"[INFO] Watching {inbox} every {interval:g}s -> {data_dir} ({len(ledger.sessions())} sessions "
+          f"ingested so far, {ledger.failed()} failed)")
+
+    seen, hashes = {}, {}
+    try:
+        while True:
+            for path in scan(inbox):
+                sig = stat_key(path)
+                # Hash a file only when its signature changes, not on every poll
+                if path in hashes and hashes[path][0] == sig:
+                    key = hashes[path][1]
+                    if key in ledger:
+                        continue
+                # Wait until the file stops changing (one unchanged poll); --once takes files as they are
+                if not once and seen.get(path) != sig:
+                    seen[path] = sig
+                    hashes.pop(path, None)
+                    continue
+                seen.pop(path, None)
+                key = file_key(path)
+                hashes[path] = (sig, key)
+                if key in ledger:
+                    entry = ledger.done[key]
+                    what = "failed before" if entry.get("failed") else f"already ingested as {entry['session']}"
+                    if entry.get("source") != str(path):
+                        print(f"[INFO] {path.name}: same content as {Path(entry['source']).name}, {what}; skipped")
+                    continue
+                try:
+                    kind = spice_for(path, spice)
+                    tag = session_tag(path)
+                    if tag in ledger.sessions():
+                        tag = f"{tag}-{time.strftime('%Y%m%d%H%M%S')}"
+                    start = time.time()
+                    info = ingest(path, kind, data_dir, tag, ledger, key, partition_root)
+                except Exception as e:
+                    ledger.add(key, {"failed": True, "source": str(path), "error": str(e)})
+                    print(f"[WARN] {path.name}: {e} (not retried until the file changes)", file=sys.stderr)
+                    continue
+                info["source"] = str(path)
+                ledger.add(key, info)
+                print(f"[OK] {path.name} -> {info['session']} ({kind}): {info['rows']['master']} rows, "
+                      f"{info['groups']} cycles, {info['rows']['step5']} wide rows | "
+                      f"feature-ready in {time.time() - start:.1f}s")
+                print(f"[INFO] Stage seconds: {info['seconds']}")
+            if once:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("[INFO] Stopped")
+    return ledger
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Watch an inbox for raw .txt sessions and ingest each one incrementally")
+    p.add_argument("--inbox", required=True, type=str, help="Folder to watch (raw .txt files, optionally in <Spice>/ subfolders)")
+    p.add_argument("--data_dir", required=True, type=str,
+                   help="Folder holding the master labeled file, the Step 1-5 tables and the ledger")
+    p.add_argument("--spice", type=str, default=None, choices=sorted(SPICE_FILES),
+                   help="Spice for files whose folder/name does not say")
+    p.add_argument("--interval", type=float, default=10.0, help="Seconds between inbox scans")
+    p.add_argument("--once", action="store_true", help="Ingest what is in the inbox now and exit")
+    p.add_argument("--partition_root", type=str, default=None,
+                   help="Also write each session's labeled rows to this partitioned store")
+    args = p.parse_args()
+    main(Path(args.inbox), Path(args.data_dir), args.spice, args.interval, args.once,
+         Path(args.partition_root) if args.partition_root else None)
@@ -0,0 +1,392 @@
+# model_artifact.py
+# Purpose: Model artifacts whose numeric arrays are memory-mapped read-only instead of unpickled.
+# An artifact is a folder with artifact.json (kind, classes, feature order) and one .npy
+# file per array: tree nodes for RandomForest / AdaBoost / HistGradientBoosting / XGBoost (the
+# flat layout from tree_export.py), coefficients for LogisticRegression / LinearSVC / SGD,
+# layer weights for the MLP, and for KNN the reference rows (small sets, searched by brute
+# force) or a KD-tree over them (kind knn_tree, as knn_index.py stores it; a --knn_index
+# KNNIndexModel is converted too). KD-trees are searched by a NumPy walk over the mapped node
+# arrays, so serving needs no scikit-learn. The Keras CNN is not covered and stays a .keras
+# file. Loading only maps the files, so every worker on a host shares the same page-cache
+# pages. A new worker starts in milliseconds and adds almost no private memory. --check
+# removes the artifact and exits non-zero if any prediction differs.
+#
+# Example:
+#   python model_artifact.py --model outputs/RandomForest/rf_model.joblib --out rf_model.mmodel --check Test_All.csv
+#   python serve_model.py --model rf_model.mmodel --workers 4
+
+from pathlib import Path
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+MANIFEST = "artifact.json"
+KNN_CHUNK_BYTES = 64 << 20   # distance block per query chunk
+KNN_BRUTE_MAX_ROWS = 100_000  # larger KNN reference sets are exported with a KD-tree
+
+class LinearModel:
+    """Linear decision function (LinearSVC, or any linear model without probabilities)."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.coef = arrays["coef"]
+        self.intercept = arrays["intercept"]
+        self.meta = meta
+        self.classes_ = np.asarray(meta["classes"])
+
+    def decision_function(self, X) -> np.ndarray:
+        return np.asarray(X, dtype=np.float64) @ self.coef.T + self.intercept
+
+    def predict(self, X) -> np.ndarray:
+        d = self.decision_function(X)
+        if d.shape[1] == 1:
+            return self.classes_[(d[:, 0] > 0).astype(int)]
+        return self.classes_[np.argmax(d, axis=1)]
+
+class LinearProbaModel(LinearModel):
+    """LogisticRegression (softmax) or SGDClassifier with log loss (normalised one-vs-rest)."""
+
+    def predict_proba(self, X) -> np.ndarray:
+        d = self.decision_function(X)
+        if d.shape[1] == 1:
+            p = 1.0 / (1.0 + np.exp(-d[:, 0]))
+            return np.column_stack([1.0 - p, p])
+        if self.meta["proba"] == "softmax":
+            d -= d.max(axis=1, keepdims=True)
+            e = np.exp(d)
+            return e / e.sum(axis=1, keepdims=True)
+        p = 1.0 / (1.0 + np.exp(-d))
+        return p / p.sum(axis=1, keepdims=True)
+
+class MLPModel:
+    """Forward pass of a fitted MLPClassifier (ReLU hidden layers, softmax output)."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        n = meta["n_layers"]
+        self.weights = [arrays[f"W{i}"] for i in range(n)]
+        self.biases = [arrays[f"b{i}"] for i in range(n)]
+        self.meta = meta
+        self.classes_ = np.asarray(meta["classes"])
+
+    def predict_proba(self, X) -> np.ndarray:
+        a = np.asarray(X, dtype=np.float64)
+        for i, (W, b) in enumerate(zip(self.weights, self.biases)):
+            a = a @ W + b
+            if i < len(self.weights) - 1:
+                np.maximum(a, 0, out=a)
+        if a.shape[1] == 1:
+            p = 1.0 / (1.0 + np.exp(-a[:, 0]))
+            return np.column_stack([1.0 - p, p])
+        a -= a.max(axis=1, keepdims=True)
+        np.exp(a, out=a)
+        return a / a.sum(axis=1, keepdims=True)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+class KNNModel:
+    """Euclidean k-nearest-neighbour vote over memory-mapped reference rows (exact search)."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.X = arrays["X"]
+        self.y = arrays["y"]
+        self.sq_norm = arrays["sq_norm"] if "sq_norm" in arrays else (self.X * self.X).sum(axis=1)
+        self.meta = meta
+        self.k = int(meta["n_neighbors"])
+        self.weights = meta["weights"]
+        self.classes_ = np.asarray(meta["classes"])
+
+    def kneighbors(self, X):
+        """(distances, indices), nearest first."""
+        X = np.asarray(X, dtype=np.float64)
+        n_ref = self.X.shape[0]
+        k = min(self.k, n_ref)
+        m = min(n_ref, 2 * k)        # candidates from the fast expansion, re-ranked exactly
+        step = max(1, KNN_CHUNK_BYTES // (8 * n_ref))
+        dist = np.empty((len(X), k))
+        ind = np.empty((len(X), k), dtype=np.int64)
+        for s in range(0, len(X), step):
+            q = X[s:s + step]
+            d2 = self.sq_norm[None, :] - 2.0 * (q @ self.X.T)
+            cand = np.argpartition(d2, m - 1, axis=1)[:, :m] if m < n_ref else np.broadcast_to(
+                np.arange(n_ref), (len(q), n_ref))
+            exact = np.sqrt(((self.X[cand] - q[:, None, :]) ** 2).sum(axis=2))
+            order = np.argsort(exact, axis=1, kind="stable")[:, :k]
+            dist[s:s + step] = np.take_along_axis(exact, order, axis=1)
+            ind[s:s + step] = np.take_along_axis(cand, order, axis=1)
+        return dist, ind
+
+    def predict_proba(self, X) -> np.ndarray:
+        dist, ind = self.kneighbors(X)
+        return vote(dist, self.y[ind], self.classes_.size, self.weights)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+class KDTreeModel:
+    """k-nearest-neighbour vote over a scikit-learn KDTree's arrays, searched with NumPy.
+
+    The arrays are the tree's own (data, idx_array, node_data, node_bounds): node i has children
+    2i+1 and 2i+2, and each node's points are idx_array[idx_start:idx_end]. The walk is the
+    depth-first search of KDTree.query (nearer child first, prune nodes farther than the k-th
+    best), so queries cost O(log n) per row and touch only the pages of the visited nodes."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        node_data = arrays["node_data"]
+        if meta.get("tree", "KDTree") != "KDTree" or node_data.dtype.names[:3] != ("idx_start", "idx_end", "is_leaf"):
+            raise ValueError(f"Unsupported tree layout ({meta.get('tree')}, {node_data.dtype}); rebuild the index")
+        self.data = arrays["data"]
+        self.idx = arrays["idx_array"]
+        self.start, self.end, self.is_leaf = node_data["idx_start"], node_data["idx_end"], node_data["is_leaf"]
+        self.lower, self.upper = arrays["node_bounds"][0], arrays["node_bounds"][1]
+        self.y = arrays["y"]
+        self.meta = meta
+        self.k = int(meta["n_neighbors"])
+        self.weights = meta["weights"]
+        self.classes_ = np.asarray(meta["classes"])
+
+    def _min_rdist(self, node: int, x: np.ndarray) -> float:
+        gap = np.maximum(self.lower[node] - x, 0.0) + np.maximum(x - self.upper[node], 0.0)
+        return float((gap * gap).sum())
+
+    def _query_one(self, x: np.ndarray, k: int) -> tuple:
+        best_rd = np.full(k, np.inf)
+        best_i = np.full(k, -1, dtype=np.int64)
+        stack = [(self._min_rdist(0, x), 0)]
+        while stack:
+            rd, node = stack.pop()
+            if rd > best_rd[-1]:
+                continue
+            if self.is_leaf[node]:
+                pts = np.asarray(self.idx[self.start[node]:self.end[node]])
+                diff = self.data[pts] - x
+                cand_rd = np.concatenate([best_rd, (diff * diff).sum(axis=1)])
+                cand_i = np.concatenate([best_i, pts])
+                # Stable: on equal distances the neighbour found first is kept, as in KDTree.query
+                order = np.argsort(cand_rd, kind="stable")[:k]
+                best_rd, best_i = cand_rd[order], cand_i[order]
+                continue
+            left, right = 2 * node + 1, 2 * node + 2
+            rd_left, rd_right = self._min_rdist(left, x), self._min_rdist(right, x)
+            if rd_left <= rd_right:
+                stack += [(rd_right, right), (rd_left, left)]
+            else:
+                stack += [(rd_left, left), (rd_right, right)]
+        return np.sqrt(best_rd), best_i
+
+    def kneighbors(self, X):
+        """(distances, indices), nearest first."""
+        X = np.asarray(X, dtype=np.float64)
+        k = min(self.k, len(self.y))
+        dist = np.empty((len(X), k))
+        ind = np.empty((len(X), k), dtype=np.int64)
+        for r in range(len(X)):
+            dist[r], ind[r] = self._query_one(X[r], k)
+        return dist, ind
+
+    def predict_proba(self, X) -> np.ndarray:
+        dist, ind = self.kneighbors(X)
+        return vote(dist, self.y[ind], self.classes_.size, self.weights)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def vote(dist: np.ndarray, labels: np.ndarray, n_classes: int, weights: str) -> np.ndarray:
+    """Class probabilities from the neighbours' distances and class indices, as KNeighborsClassifier."""
+    if weights == "distance":
+        with np.errstate(divide="ignore"):
+            w = 1.0 / dist
+        exact = np.isinf(w)
+        hit = exact.any(axis=1)
+        w[hit] = exact[hit]      # a zero-distance match outvotes everything else
+    else:
+        w = np.ones_like(dist)
+    proba = np.zeros((len(dist), n_classes))
+    np.add.at(proba, (np.arange(len(dist))[:, None], labels), w)
+    total = proba.sum(axis=1, keepdims=True)
+    total[total == 0.0] = 1.0
+    return proba / total
+
+def _forest_class():
+    from tree_export import FlatForest
+    return FlatForest
+
+def _knn_tree_class():
+    from knn_index import KNNIndexModel
+    return KNNIndexModel
+
+KINDS = {"forest": _forest_class, "linear": lambda: LinearModel, "linear_proba": lambda: LinearProbaModel,
+         "mlp": lambda: MLPModel, "knn": lambda: KNNModel, "knn_tree": lambda: KDTreeModel}
+
+def _knn_arrays(X: np.ndarray, y: np.ndarray, meta: dict, tree=None) -> tuple:
+    """(kind, arrays, meta) for KNN: brute-force rows for small sets, else a KDTree's arrays
+    (the fitted one when given, otherwise built here with knn_index.py's leaf size)."""
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.int64)
+    if len(X) <= KNN_BRUTE_MAX_ROWS:
+        return "knn", {"X": X, "y": y, "sq_norm": (X * X).sum(axis=1)}, meta
+    import knn_index
+    if type(tree).__name__ != "KDTree":
+        from sklearn.neighbors import KDTree
+        tree = KDTree(X, leaf_size=knn_index.LEAF_SIZE)
+    arrays, tree_meta = knn_index.tree_arrays(tree)
+    arrays["y"] = y
+    return "knn_tree", arrays, dict(meta, **tree_meta)
+
+def to_arrays(model):
+    """Return (kind, arrays, meta) for a fitted estimator (a BinnedModel wrapper is unwrapped)."""
+    inner = getattr(model, "model", model)
+    name = type(inner).__name__
+    if name in ("RandomForestClassifier", "ExtraTreesClassifier", "AdaBoostClassifier",
+                "HistGradientBoostingClassifier", "XGBClassifier"):
+        import tree_export
+        flat = tree_export.export(model)
+        return "forest", flat.arrays(), dict(flat.meta)
+
+    if name == "KNNIndexModel":
+        # train_models.py --knn_index: the index's tree data are the reference rows in training order
+        meta = {k: inner.meta[k] for k in ("classes", "n_features", "n_neighbors", "weights")}
+        return _knn_arrays(inner.tree.get_arrays()[0], inner.y, dict(meta, source=name), inner.tree)
+
+    meta = {"source": name, "classes": np.asarray(inner.classes_).tolist(),
+            "n_features": int(getattr(inner, "n_features_in_", 0))}
+    if name in ("LogisticRegression", "SGDClassifier", "LinearSVC"):
+        arrays = {"coef": np.asarray(inner.coef_, dtype=np.float64),
+                  "intercept": np.asarray(inner.intercept_, dtype=np.float64).ravel()}
+        if name == "LogisticRegression":
+            return "linear_proba", arrays, dict(meta, proba="softmax")
+        if name == "SGDClassifier" and inner.loss == "log_loss":
+            return "linear_proba", arrays, dict(meta, proba="ovr")
+        return "linear", arrays, meta
+    if name == "MLPClassifier":
+        if inner.activation != "relu":
+            raise ValueError(f"Only ReLU MLPs are supported (got {inner.activation})")
+        arrays = {}
+        for i, (W, b) in enumerate(zip(inner.coefs_, inner.intercepts_)):
+            arrays[f"W{i}"], arrays[f"b{i}"] = np.asarray(W), np.asarray(b)
+        return "mlp", arrays, dict(meta, n_layers=len(inner.coefs_))
+    if name == "KNeighborsClassifier":
+        if inner.effective_metric_ != "euclidean":
+            raise ValueError(f"Only Euclidean KNN is supported (got {inner.effective_metric_})")
+        meta = dict(meta, n_neighbors=int(inner.n_neighbors), weights=inner.weights)
+        return _knn_arrays(inner._fit_X, inner._y, meta, getattr(inner, "_tree", None))
+    raise ValueError(f"No array artifact for {name}")
+
+def save(model, path: Path, features: list = None) -> Path:
+    """Write the artifact folder (replaced atomically if it exists)."""
+    kind, arrays, meta = to_arrays(model)
+    if features:
+        meta["features"] = list(features)
+    return write(path, kind, arrays, meta)
+
+def write(path: Path, kind: str, arrays: dict, meta: dict) -> Path:
+    path = Path(path)
+    tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for name, arr in arrays.items():
+        np.save(tmp / f"{name}.npy", np.ascontiguousarray(arr))
+    manifest = {"kind": kind, "meta": meta, "arrays": {k: [str(a.dtype), list(a.shape)] for k, a in arrays.items()}}
+    (tmp / MANIFEST).write_text(json.dumps(manifest, indent=2))
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return path
+
+def is_artifact(path: Path) -> bool:
+    return (Path(path) / MANIFEST).is_file()
+
+def read_manifest(path: Path) -> dict:
+    return json.loads((Path(path) / MANIFEST).read_text())
+
+def load(path: Path, mmap: bool = True, search_tree: bool = False):
+    """Open an artifact. Arrays are read-only memory maps unless mmap=False.
+    A KD-tree (kind knn_tree) is searched with NumPy; search_tree=True restores scikit-learn's
+    KDTree on the same arrays instead (threaded, for large offline batches)."""
+    path = Path(path)
+    manifest = read_manifest(path)
+    kind = manifest["kind"]
+    arrays = {k: np.load(path / f"{k}.npy", mmap_mode="r" if mmap else None) for k in manifest["arrays"]}
+    if kind == "knn_tree" and search_tree:
+        return _knn_tree_class()(arrays, manifest["meta"])
+    return KINDS[kind]()(arrays, manifest["meta"])
+
+_PROBE = """
+import sys, time
+sys.path.insert(0, {tools!r})
+start = time.perf_counter()
+if {artifact!r}:
+    import model_artifact; m = model_artifact.load({path!r})
+else:
+    import joblib; m = joblib.load({path!r})
+load = time.perf_counter() - start
+import numpy as np
+X = np.load({rows!r})
+m.predict(X)
+status = dict(l.split(":", 1) for l in open("/proc/self/status") if l.startswith("Rss"))
+print(load, int(status["RssAnon"].split()[0]), int(status.get("RssFile", "0 kB").split()[0]))
+"""
+
+def _probe_worker(path: Path, artifact: bool, rows: Path) -> tuple:
+    """Fresh process: (load seconds, private RSS kB, file-backed RSS kB) after load + predict."""
+    code = _PROBE.format(tools=str(Path(__file__).resolve().parent), artifact=artifact, path=str(path),
+                         rows=str(rows))
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    load_s, anon, filed = out.split()
+    return float(load_s), int(anon), int(filed)
+
+def main(model_path: Path, out_path: Path, check_csv: Path = None, features: list = None):
+    import joblib
+
+    from serve_model import features_for
+
+    model = joblib.load(model_path)
+    features = features_for(model_path, features)
+    save(model, out_path, features)
+    size = sum(f.stat().st_size for f in out_path.iterdir())
+    print(f"[OK] Wrote: {out_path}  ({size / 1e6:.1f} MB, {len(list(out_path.glob('*.npy')))} arrays)")
+
+    if check_csv is None:
+        return 0
+    import pandas as pd
+    X = pd.read_csv(check_csv, usecols=features)[features].to_numpy()
+    got = load(out_path).predict(X)
+    mismatch = int((np.asarray(model.predict(X)) != got).sum())
+    if mismatch:
+        # A wrong artifact must not be left where serve_model.py could pick it up
+        shutil.rmtree(out_path)
+        print(f"[WARN] {mismatch} of {len(X)} predictions differ; removed {out_path}", file=sys.stderr)
+        return 1
+    print(f"[OK] Identical predictions on {len(X)} rows")
+
+    # Per-worker cost in fresh processes: private (anonymous) memory is what multiplies with workers
+    with tempfile.TemporaryDirectory(prefix="artifact_probe_") as tmp:
+        rows = Path(tmp) / "rows.npy"
+        np.save(rows, X[:1000])
+        _report_workers(model_path, out_path, rows)
+    return 0
+
+def _report_workers(model_path: Path, out_path: Path, rows: Path):
+    try:
+        for label, path, is_art in [("joblib", model_path, False), ("artifact", out_path, True)]:
+            load_s, anon, filed = _probe_worker(path, is_art, rows)
+            print(f"[INFO] {label:8s} worker: load {1000 * load_s:7.1f} ms | private {anon / 1024:7.1f} MB | "
+                  f"shared file pages {filed / 1024:6.1f} MB")
+    except (OSError, subprocess.CalledProcessError, KeyError) as e:
+        print(f"[WARN] Worker memory probe skipped: {e}", file=sys.stderr)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Convert a trained model to a memory-mappable array artifact")
+    p.add_argument("--model", required=True, type=str, help="joblib model (rf, ada, gb, xgb, lr, svm, sgd, mlp, knn)")
+    p.add_argument("--out", required=True, type=str, help="Output artifact folder (e.g. rf_model.mmodel)")
+    p.add_argument("--check", type=str, default=None, help="CSV to compare predictions and per-worker memory")
+    p.add_argument("--features", type=str, default=None,
+                   help="Comma list of feature columns (default: from <prefix>_metrics.json, else all four)")
+    args = p.parse_args()
+    sys.exit(main(Path(args.model), Path(args.out), Path(args.check) if args.check else None,
+                  args.features.split(",") if args.features else None))
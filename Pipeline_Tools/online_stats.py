@@ -0,0 +1,311 @@
+# online_stats.py
+# Purpose: Online version of the Step-2 stepwise summaries for live recordings.
+# Each (group_id, sensor, heater step) keeps a fixed-size accumulator updated per arriving row:
+# Welford mean/variance, min/max, first/last by timestamp and P-square quantile markers for
+# p10/median/p90 (exact while the group is still small). When the stream moves on to the
+# next heater step, the finished step's Step-2 rows are emitted. When a scanning cycle
+# finishes, its Step-5-style wide vector (abs + rel stats, counts, context means) is emitted
+# and its accumulators are dropped, so memory holds only the cycle being recorded.
+# Rows must come in recording order (cycle -> heater step -> sensor), as the DevKit writes them
+# and the labeled files keep them. A row for a heater step that was already reported (e.g. the
+# sensor-major Step-1 output) raises ValueError instead of reporting the step twice. The
+# labeling scripts reuse <Spice>_cycle_<c> for the same cycle index of every 400-row chunk;
+# Step 2 pools those blocks, the online rows describe each scanning cycle as it is recorded.
+#
+# Example (replay a labeled recording as if it were live):
+#   python online_stats.py --src Anise_Session1_labeled.csv --out_dir online
+
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import math
+import time
+import numpy as np
+
+import dtype_schema
+
+STEP2_STATS = [
+    "n_samples","log_mean","log_std","log_median","log_min","log_max",
+    "log_p10","log_p90","log_delta","log_slope_per_s"
+]
+STAT_COLS_ABS = [
+    "log_mean","log_std","log_median","log_min","log_max","log_p10","log_p90",
+    "log_delta","log_slope_per_s"
+]
+REL_BASE_COLS = ["log_mean","log_median","log_p10","log_p90"]
+ID_COLS = ["group_id","spice","target"]
+EXACT_UNTIL = 256  # samples kept for exact quantiles before switching to P-square estimates
+
+class P2Quantile:
+    """P-square streaming estimate of one quantile (Jain & Chlamtac) with five markers."""
+
+    __slots__ = ("p", "n", "q", "pos", "des", "inc")
+
+    def __init__(self, p: float):
+        self.p = p
+        self.n = 0
+        self.q = []
+
+    def add(self, x: float):
+        if self.n < 5:
+            self.q.append(x)
+            self.n += 1
+            if self.n == 5:
+                p = self.p
+                self.q.sort()
+                self.pos = [1.0, 2.0, 3.0, 4.0, 5.0]
+                self.des = [1.0, 1.0 + 2.0 * p, 1.0 + 4.0 * p, 3.0 + 2.0 * p, 5.0]
+                self.inc = [0.0, p / 2.0, p, (1.0 + p) / 2.0, 1.0]
+            return
+
+        q, pos, des = self.q, self.pos, self.des
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            pos[i] += 1.0
+        for i in range(5):
+            des[i] += self.inc[i]
+
+        # Move the three middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = des[i] - pos[i]
+            if (d >= 1.0 and pos[i + 1] - pos[i] > 1.0) or (d <= -1.0 and pos[i - 1] - pos[i] < -1.0):
+                s = 1.0 if d > 0 else -1.0
+                qp = q[i] + s / (pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + s) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i])
+                    + (pos[i + 1] - pos[i] - s) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    j = i + int(s)
+                    qp = q[i] + s * (q[j] - q[i]) / (pos[j] - pos[i])
+                q[i] = qp
+                pos[i] += s
+        self.n += 1
+
+    def value(self) -> float:
+        if self.n == 0:
+            return np.nan
+        if self.n < 5:
+            return float(np.percentile(self.q, 100.0 * self.p))
+        return self.q[2]
+
+class StepStats:
+    """Accumulator for one (group_id, sensor, heater step) cell; memory does not grow with n."""
+
+    __slots__ = ("n", "k", "mean", "m2", "vmin", "vmax", "t_first", "v_first", "t_last", "v_last",
+                 "q10", "q50", "q90", "exact")
+
+    def __init__(self):
+        self.n = 0          # all rows, as n_samples in Step 2
+        self.k = 0          # non-NaN values
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.vmin = math.inf
+        self.vmax = -math.inf
+        self.t_first = math.inf
+        self.v_first = np.nan
+        self.t_last = -math.inf
+        self.v_last = np.nan
+        self.q10, self.q50, self.q90 = P2Quantile(0.10), P2Quantile(0.50), P2Quantile(0.90)
+        self.exact = []
+
+    def add(self, ts: float, v: float):
+        self.n += 1
+        # first/last follow timestamp order, ties keep arrival order (Step 2 uses a stable sort)
+        if ts < self.t_first:
+            self.t_first, self.v_first = ts, v
+        if ts >= self.t_last:
+            self.t_last, self.v_last = ts, v
+        if v != v:  # NaN is counted but skipped, like the nan* reductions
+            return
+        self.k += 1
+        d = v - self.mean
+        self.mean += d / self.k
+        self.m2 += d * (v - self.mean)
+        if v < self.vmin:
+            self.vmin = v
+        if v > self.vmax:
+            self.vmax = v
+        self.q10.add(v)
+        self.q50.add(v)
+        self.q90.add(v)
+        if self.exact is not None:
+            self.exact.append(v)
+            if len(self.exact) > EXACT_UNTIL:
+                self.exact = None
+
+    def row(self) -> dict:
+        if self.exact is not None and self.exact:
+            p10, med, p90 = np.percentile(self.exact, [10, 50, 90])
+        else:
+            p10, med, p90 = self.q10.value(), self.q50.value(), self.q90.value()
+        if self.n > 1:
+            std = math.sqrt(self.m2 / (self.k - 1)) if self.k > 1 else np.nan
+        else:
+            std = 0.0
+        dt_ms = self.t_last - self.t_first
+        delta = self.v_last - self.v_first
+        return {
+            "n_samples": self.n,
+            "log_mean": self.mean if self.k else np.nan,
+            "log_std": std,
+            "log_median": med,
+            "log_min": self.vmin if self.k else np.nan,
+            "log_max": self.vmax if self.k else np.nan,
+            "log_p10": p10,
+            "log_p90": p90,
+            "log_delta": delta,
+            "log_slope_per_s": delta / (dt_ms / 1000.0) if dt_ms != 0 else np.nan,
+        }
+
+class OnlineStepwise:
+    """Routes rows to per-cell accumulators and reports finished heater steps and cycles.
+
+    on_step(rows)             -> Step-2 rows (dicts) of a heater step that just finished
+    on_cycle(group_id, entry) -> wide feature dict (Step-5 layout) of a scanning cycle that just finished
+    """
+
+    def __init__(self, on_step=None, on_cycle=None):
+        self.cells = {}       # group_id -> {(sensor, step): StepStats}   (open cycle only)
+        self.ctx = {}         # group_id -> [n, sum_temp, sum_rh, sum_pressure]
+        self.ids = {}         # group_id -> (spice, target)
+        self.reported = {}    # group_id -> heater steps already passed to on_step
+        self.on_step = on_step
+        self.on_cycle = on_cycle
+        self.current = None   # (group_id, step) being filled
+
+    def update(self, group_id: str, spice: str, target: int, sensor: int, step: int,
+               ts: float, log_r: float, temperature: float = np.nan, rh: float = np.nan,
+               pressure: float = np.nan):
+        key = (group_id, step)
+        if key != self.current:
+            if step in self.reported.get(group_id, ()):
+                raise ValueError(f"{group_id}: row for heater step {step} after that step was reported. "
+                                 "Rows must arrive in recording order (cycle -> heater step -> sensor); "
+                                 "replay a labeled file, not the sensor-major Step-1 output")
+            if self.current is not None:
+                self._finish(self.current, cycle_done=group_id != self.current[0])
+            self.current = key
+
+        cells = self.cells.get(group_id)
+        if cells is None:
+            cells = self.cells[group_id] = {}
+            self.ids[group_id] = (spice, target)
+        cell = cells.get((sensor, step))
+        if cell is None:
+            cell = cells[(sensor, step)] = StepStats()
+        cell.add(ts, log_r)
+
+        c = self.ctx.get(group_id)
+        if c is None:
+            c = self.ctx[group_id] = [0, 0.0, 0.0, 0.0]
+        c[0] += 1
+        c[1] += temperature
+        c[2] += rh
+        c[3] += pressure
+
+    def update_row(self, row: dict):
+        """Convenience entry point for one raw or labeled row (dict-like)."""
+        log_r = row["log_resistance"] if "log_resistance" in row else np.log1p(float(row["resistance_gassensor"]))
+        gid = row.get("group_id") or f"{row['spice']}_cycle_{int(row['scanning_cycle_index'])}"
+        self.update(gid, row["spice"], int(row["target"]), int(row["sensor_index"]),
+                    int(row["heater_profile_step_index"]), float(row["timestamp_since_poweron"]),
+                    float(log_r), float(row.get("temperature", np.nan)),
+                    float(row.get("relative_humidity", np.nan)), float(row.get("pressure", np.nan)))
+
+    def flush(self):
+        """End of stream: report the step and cycle still open."""
+        if self.current is not None:
+            self._finish(self.current, cycle_done=True)
+            self.current = None
+
+    def _finish(self, key, cycle_done: bool):
+        gid, step = key
+        if self.on_step is not None:
+            self.on_step(self.step_rows(gid, step))
+        self.reported.setdefault(gid, set()).add(step)
+        if cycle_done:
+            if self.on_cycle is not None:
+                self.on_cycle(gid, self.cycle_vector(gid))
+            # The cycle is complete: a later block with the same id starts a new scanning cycle
+            for state in (self.cells, self.ctx, self.ids, self.reported):
+                del state[gid]
+
+    def step_rows(self, group_id: str, step: int) -> list:
+        spice, target = self.ids[group_id]
+        return [dict(group_id=group_id, spice=spice, target=target, sensor_index=s,
+                     heater_profile_step_index=h, **cell.row())
+                for (s, h), cell in self.cells[group_id].items() if h == step]
+
+    def cycle_vector(self, group_id: str) -> dict:
+        """Wide per-cycle row as Step 5 builds it from Steps 2-4 (stats so far for this cycle)."""
+        spice, target = self.ids[group_id]
+        cells = sorted((s, h, cell.row()) for (s, h), cell in self.cells[group_id].items())
+        base = {s: r for s, h, r in cells if h == 0}
+        entry = {"group_id": group_id, "spice": spice, "target": target}
+        for s, h, r in cells:
+            for stat in STAT_COLS_ABS:
+                entry[f"S{s}_H{h}_{stat}"] = r[stat]
+            for stat in REL_BASE_COLS:
+                entry[f"S{s}_H{h}_{stat}_rel"] = r[stat] - base[s][stat] if s in base else np.nan
+            entry[f"S{s}_H{h}_n"] = r["n_samples"]
+        n, t, rh, p = self.ctx[group_id]
+        entry.update(temp_mean=t / n, rh_mean=rh / n, pressure_mean=p / n)
+        return entry
+
+def replay(src: Path, out_dir: Path):
+    """Feed a labeled CSV row by row in file order and record what a live run would emit."""
+    import pandas as pd
+    out_dir.mkdir(parents=True, exist_ok=True)
+    df = dtype_schema.read_csv(src)
+    if "log_resistance" not in df.columns:
+        df["log_resistance"] = np.log1p(df["resistance_gassensor"].astype(float))
+    if "group_id" not in df.columns:
+        df["group_id"] = df["spice"].astype(str) + "_cycle_" + df["scanning_cycle_index"].astype(int).astype(str)
+    for c in ["temperature","relative_humidity","pressure"]:
+        if c not in df.columns:
+            df[c] = np.nan
+
+    steps, cycles, cycle_ms = [], [], []
+    state = {"t_end": None}
+
+    def on_cycle(gid, entry):
+        cycles.append(entry)
+        cycle_ms.append(1000.0 * (time.perf_counter() - state["t_end"]))
+
+    acc = OnlineStepwise(on_step=steps.extend, on_cycle=on_cycle)
+    cols = ["group_id","spice","target","sensor_index","heater_profile_step_index",
+            "timestamp_since_poweron","log_resistance","temperature","relative_humidity","pressure"]
+    start = time.perf_counter()
+    for gid, sp, tgt, s, h, ts, lr, t, rh, p in df[cols].itertuples(index=False, name=None):
+        state["t_end"] = time.perf_counter()
+        acc.update(gid, sp, int(tgt), int(s), int(h), float(ts), float(lr), float(t), float(rh), float(p))
+    state["t_end"] = time.perf_counter()
+    acc.flush()
+    total = time.perf_counter() - start
+
+    step2 = pd.DataFrame(steps, columns=ID_COLS + ["sensor_index","heater_profile_step_index"] + STEP2_STATS)
+    step2_path = out_dir / f"{src.stem}_step2_online.csv"
+    step2.to_csv(step2_path, index=False)
+    cyc = pd.DataFrame(cycles)
+    cyc_path = out_dir / f"{src.stem}_cycles_online.csv"
+    cyc.to_csv(cyc_path, index=False)
+
+    print(f"[OK] Wrote: {step2_path}  (rows={len(step2)})")
+    print(f"[OK] Wrote: {cyc_path}  (cycle vectors emitted={len(cyc)})")
+    print(f"[INFO] {len(df)} rows in {total:.2f}s ({1e6 * total / max(len(df), 1):.1f} us/row) | "
+          f"cycle vector ready {np.median(cycle_ms) if cycle_ms else float('nan'):.2f} ms after the cycle's last row (median)")
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Replay a labeled recording through the online Step-2 accumulator")
+    p.add_argument("--src", required=True, type=str, help="Labeled CSV (Data_Labelling output), in recording order")
+    p.add_argument("--out_dir", required=True, type=str, help="Output directory")
+    args = p.parse_args()
+    replay(Path(args.src), Path(args.out_dir))
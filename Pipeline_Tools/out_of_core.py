@@ -0,0 +1,888 @@
+# out_of_core.py
+# Purpose: Run the pipeline stages (RawToCSV -> segmentation -> trimming -> labeling -> merge ->
+# Steps 1-5) inside a fixed memory budget, on a small gateway box or on archives larger than RAM.
+# The reference scripts load each input whole. Here every stage reads in chunks, and the chunk
+# row count comes from --memory-budget and the in-memory size of a sample of rows. Stages that
+# need global state spill to disk:
+#   segmentation  each row's output position comes from running counts, then an external sort on it
+#   Step 1        external merge sort on (group_id, sensor, step, timestamp)
+#   Step 3        sort-merge join of every cycle with its own step-0 baseline (input that is not
+#                 grouped by cycle is external-sorted first and put back in order afterwards)
+#   Step 2 / 5    stream whole groups, external-sorting first when they are not contiguous
+#                 (one group must fit in memory)
+#   Step 4        running per-cycle sums (means agree with the reference to float rounding)
+# Sorted runs are pickled DataFrame blocks in a spill folder. They are merged k ways with at most
+# the budget's worth of blocks in memory, in several passes if there are many runs. Each column's
+# dtype is settled over the whole input, as in a full read, so outputs match the reference
+# scripts (check with conformance_harness.py). The budget covers data, not the ~70 MB
+# interpreter with pandas loaded; the peak RSS is printed at the end. Outputs are compressed with
+# --compression (see csv_codec.py), and compressed inputs are read as they are.
+#
+# Example:
+#   python out_of_core.py --stage step1 --src master_training_labeled.csv --out_dir ooc --memory-budget 256MB
+#   python out_of_core.py --stage all --raw Anise=Anise_Raw_Data.txt --raw Nutmeg=Nutmeg_Sem_Two_Recorded.txt \
+#       --out_dir ooc --memory-budget 512MB
+#   python conformance_harness.py --stage step1 --generate \
+#       --candidate "python out_of_core.py --stage step1 --src {src} --out_dir {out_dir} --memory-budget 32MB"
+
+from pathlib import Path
+import argparse
+import importlib.util
+import json
+import re
+import resource
+import shutil
+import sys
+import time
+import numpy as np
+
+import dtype_schema
+from csv_codec import configure, csv_name, csv_stem, method_of, open_text
+from conformance_harness import CSV_ROOT, PRE_ROOT, SPICE_FILES
+from synthetic_data import LABEL_MAP
+
+SAMPLE_ROWS = 2000
+WORK_FACTOR = 8          # copies of a chunk alive at once (parse, transform, sort, write buffers)
+MIN_CHUNK_ROWS = 1000
+MIN_BLOCK_ROWS = 2048    # smallest block read per run while merging
+MAX_FANIN = 64
+RAW_TEXT_FACTOR = 40     # JSON text read per batch = budget / this (parsed rows are ~5x the text, x WORK_FACTOR)
+TRIM_CHUNK = 400         # window of the trimming scripts
+ROW = "_row"
+KEY = "_key"
+STAGES = ["raw_to_csv", "segment", "trim", "label", "merge", "step1", "step2", "step3", "step4", "step5"]
+
+def parse_size(text: str) -> int:
+    """'512MB', '2G', '750k' or plain bytes -> bytes."""
+    m = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)i?b?\s*", str(text).lower())
+    if not m:
+        raise ValueError(f"Cannot read memory size {text!r} (e.g. 512MB, 2GB)")
+    return int(float(m.group(1)) * 1024 ** " kmgt".index(m.group(2) or " "))
+
+def peak_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class Budget:
+    """Turns the memory budget into chunk sizes from the in-memory size of sample rows."""
+
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+    def rows_for(self, row_bytes: float, factor: float = WORK_FACTOR) -> int:
+        return max(MIN_CHUNK_ROWS, int(self.nbytes / (max(row_bytes, 1.0) * factor)))
+
+    def csv_rows(self, src: Path, reader, factor: float = WORK_FACTOR) -> int:
+        sample = reader(src, nrows=SAMPLE_ROWS)
+        if len(sample) == 0:
+            return MIN_CHUNK_ROWS
+        return self.rows_for(sample.memory_usage(deep=True).sum() / len(sample), factor)
+
+def plain_csv(src, **kwargs):
+    import pandas as pd
+    return pd.read_csv(src, **kwargs)
+
+class Kinds:
+    """Integer columns that a whole-file read would have turned into floats (NaNs or decimals in other chunks)."""
+
+    def __init__(self):
+        self.ints, self.floats = set(), set()
+
+    def see(self, frame):
+        for c, dt in frame.dtypes.items():
+            if dt.kind in "iu":
+                self.ints.add(c)
+            elif dt.kind == "f":
+                self.floats.add(c)
+
+    def settle(self, frame):
+        cols = [c for c in self.ints & self.floats if c in frame.columns and frame[c].dtype.kind in "iu"]
+        return frame.astype({c: np.float64 for c in cols}) if cols else frame
+
+def scan_kinds(chunks) -> tuple:
+    kinds, n = Kinds(), 0
+    for chunk in chunks:
+        kinds.see(chunk)
+        n += len(chunk)
+    return kinds, n
+
+class CsvOut:
+    """Streams frames into one CSV (header once), via a .partial file renamed on close."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.tmp = path.with_name(path.name + ".partial")
+        self.f = open_text(self.tmp, "w", method_of(path))
+        self.rows = 0
+        self.started = False
+
+    def write(self, frame):
+        frame.to_csv(self.f, header=not self.started, index=False)
+        self.started = True
+        self.rows += len(frame)
+
+    def close(self) -> Path:
+        self.f.close()
+        self.tmp.replace(self.path)
+        return self.path
+
+def lex_count(frame, keys: list, bound: tuple) -> int:
+    """Rows of a key-sorted frame whose key is <= bound (they form a prefix)."""
+    le = np.zeros(len(frame), dtype=bool)
+    eq = np.ones(len(frame), dtype=bool)
+    for k, b in zip(keys, bound):
+        a = frame[k].to_numpy()
+        le |= eq & (a < b)
+        eq &= a == b
+    return int((le | eq).sum())
+
+def sort_frame(frame, keys: list):
+    return frame.iloc[np.lexsort([frame[k].to_numpy() for k in reversed(keys)])]
+
+class ExternalSorter:
+    """Bounded-memory sort of DataFrame chunks on numeric key columns. Every added chunk becomes
+    a sorted run of pickled blocks; sorted() merges the runs k ways (several passes if needed).
+    Keys must be unique (add a row number as the last key), which also keeps the sort stable."""
+
+    def __init__(self, keys: list, spill: Path, run_rows: int):
+        self.keys = keys
+        self.dir = spill
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.fanin = max(2, min(MAX_FANIN, run_rows // MIN_BLOCK_ROWS))
+        self.block_rows = max(1, run_rows // self.fanin)
+        self.runs = []
+        self.files = 0
+        self.passes = 0
+
+    def _write_run(self, frames) -> list:
+        paths = []
+        for frame in frames:
+            for s in range(0, len(frame), self.block_rows):
+                path = self.dir / f"b{self.files:07d}.pkl"
+                self.files += 1
+                frame.iloc[s:s + self.block_rows].to_pickle(path)
+                paths.append(path)
+        return paths
+
+    def add(self, frame):
+        if len(frame):
+            self.runs.append(self._write_run([sort_frame(frame, self.keys)]))
+
+    def sorted(self):
+        """Yield the rows of every added chunk in key order, as frames of at most ~run_rows rows."""
+        runs = self.runs
+        self.runs = []
+        while len(runs) > self.fanin:
+            runs = [self._write_run(self._merge(runs[i:i + self.fanin])) for i in range(0, len(runs), self.fanin)]
+            self.passes += 1
+        yield from self._merge(runs)
+
+    def _merge(self, runs):
+        import pandas as pd
+        queues = [list(r) for r in runs]
+        heads = [None] * len(runs)
+        while True:
+            for i, q in enumerate(queues):
+                if (heads[i] is None or len(heads[i]) == 0) and q:
+                    path = q.pop(0)
+                    heads[i] = pd.read_pickle(path)
+                    path.unlink()
+            live = [i for i, h in enumerate(heads) if h is not None and len(h)]
+            if not live:
+                return
+            # Rows up to the smallest last key among runs with blocks still on disk are final
+            waiting = [i for i in live if queues[i]]
+            if waiting:
+                bound = min(tuple(heads[i][k].iat[-1] for k in self.keys) for i in waiting)
+                take = [lex_count(heads[i], self.keys, bound) for i in live]
+            else:
+                take = [len(heads[i]) for i in live]
+            pieces = []
+            for i, n in zip(live, take):
+                if n:
+                    pieces.append(heads[i].iloc[:n])
+                    heads[i] = heads[i].iloc[n:]
+            yield sort_frame(pd.concat(pieces, ignore_index=True), self.keys)
+
+def group_codes(values, categories: np.ndarray) -> np.ndarray:
+    """Position of each value in the sorted category array (the order pandas sorts categoricals in).
+    Missing values get len(categories), so they sort last as in sort_values."""
+    import pandas as pd
+    values = pd.Series(values, dtype=object)
+    missing = values.isna().to_numpy()
+    codes = np.searchsorted(categories, values.fillna("").astype(str).to_numpy())
+    codes[missing] = len(categories)
+    return codes
+
+def unique_sorted(src: Path, column: str, rows: int) -> np.ndarray:
+    import pandas as pd
+    seen = set()
+    for chunk in pd.read_csv(src, usecols=[column], chunksize=rows, dtype={column: str}):
+        seen.update(chunk[column].dropna().unique())
+    return np.array(sorted(seen), dtype=object).astype(str)
+
+def key_order_breaks(prev: tuple, keys: list) -> tuple:
+    """(rows out of order vs. the previous row, last key) for key arrays of one chunk."""
+    n = len(keys[0])
+    if n == 0:
+        return 0, prev
+    full = [np.concatenate([[p], k]) if prev is not None else k for p, k in zip(prev or [None] * len(keys), keys)]
+    gt = np.zeros(len(full[0]) - 1, dtype=bool)
+    eq = np.ones(len(full[0]) - 1, dtype=bool)
+    for a in full:
+        gt |= eq & (a[:-1] > a[1:])
+        eq &= a[:-1] == a[1:]
+    return int(gt.sum()), tuple(k[-1] for k in keys)
+
+def group_batches(frames, keys: list, limit_rows: int, name: str):
+    """Re-chunk a stream whose groups are contiguous into batches that only hold whole groups."""
+    import pandas as pd
+    carry = None
+    warned = False
+    for frame in frames:
+        if carry is not None and len(carry):
+            frame = pd.concat([carry, frame], ignore_index=True)
+        if len(frame) == 0:
+            continue
+        change = np.zeros(len(frame), dtype=bool)
+        for k in keys:
+            a = frame[k].to_numpy()
+            change[1:] |= a[1:] != a[:-1]
+        starts = np.flatnonzero(change)
+        last = int(starts[-1]) if len(starts) else 0
+        if last:
+            yield frame.iloc[:last]
+        carry = frame.iloc[last:]
+        if len(carry) > limit_rows and not warned:
+            warned = True
+            print(f"[WARN] {name}: one group has more than {limit_rows:,} rows and is held whole "
+                  f"(memory goes over the budget for it)", file=sys.stderr)
+    if carry is not None and len(carry):
+        yield carry
+
+def load_script(path: Path, name: str):
+    """Import a reference stage script as a module (its main() is not run)."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+def _require(header: list, cols: list, what: str = ""):
+    missing = [c for c in cols if c not in header]
+    if missing:
+        raise ValueError(f"Missing required columns{what}: {missing}")
+
+def _header(src: Path) -> list:
+    import pandas as pd
+    return list(pd.read_csv(src, nrows=0).columns)
+
+# ---------------------------------------------------------------- stages
+
+def _after_key(f, key: str, read_chars: int, path: Path) -> str:
+    """Text that follows "key": in an open JSON file (the rest of the file is read lazily)."""
+    tail = ""
+    while True:
+        block = f.read(read_chars)
+        if not block:
+            raise ValueError(f"{path.name}: no {key} in rawDataBody")
+        text = tail + block
+        at = text.find(f'"{key}"')
+        if at >= 0:
+            buf = text[at + len(key) + 2:]
+            break
+        tail = text[-len(key) - 2:]
+    while ":" not in buf:
+        more = f.read(read_chars)
+        if not more:
+            raise ValueError(f"{path.name}: {key} has no value")
+        buf += more
+    return buf[buf.index(":") + 1:]
+
+def _decode_rows(buf: str, dec: json.JSONDecoder) -> tuple:
+    """Complete rows at the start of buf -> (rows, rest of buf, end of dataBlock reached)."""
+    buf = buf.lstrip(" \t\r\n,")
+    if buf.startswith("]"):
+        return [], "", True
+    # Fast path: everything up to the last "]," is a run of complete rows
+    cut = buf.rfind("],")
+    if cut > 0:
+        try:
+            return json.loads("[" + buf[:cut + 1] + "]"), buf[cut + 2:], False
+        except ValueError:
+            pass
+    rows, pos = [], 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos < len(buf) and buf[pos] == "]":
+            return rows, "", True
+        try:
+            row, pos = dec.raw_decode(buf, pos)
+        except ValueError:
+            return rows, buf[pos:], False
+        rows.append(row)
+
+def raw_rows(path: Path, read_chars: int):
+    """Yield (columns, rows) batches from a DevKit JSON .txt export without loading it whole."""
+    dec = json.JSONDecoder()
+    with open(path, "r") as f:
+        buf = _after_key(f, "dataColumns", read_chars, path)
+        while True:
+            try:
+                columns = [c["key"] for c in dec.raw_decode(buf.lstrip())[0]]
+                break
+            except ValueError:
+                more = f.read(read_chars)
+                if not more:
+                    raise
+                buf += more
+    with open(path, "r") as f:
+        buf = _after_key(f, "dataBlock", read_chars, path).lstrip()
+        while not buf:
+            buf = f.read(read_chars).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path.name}: dataBlock is not a list")
+        buf, done = buf[1:], False
+        while not done:
+            more = f.read(read_chars)
+            rows, buf, done = _decode_rows(buf + more, dec)
+            if rows:
+                yield columns, rows
+            if not more and not done:
+                # Nothing new to read: decode what is left once more, then give up
+                rows, buf, done = _decode_rows(buf, dec)
+                if rows:
+                    yield columns, rows
+                if not done:
+                    raise ValueError(f"{path.name}: dataBlock is truncated")
+
+def raw_to_csv(src: Path, out_path: Path, budget: Budget, spill: Path) -> Path:
+    import pandas as pd
+    # Parsed JSON rows cost several times their text; batches are spilled, then written with settled dtypes
+    kinds = Kinds()
+    blocks, n = [], 0
+    spill.mkdir(parents=True, exist_ok=True)
+    columns = []
+    for columns, rows in raw_rows(src, max(1 << 16, budget.nbytes // RAW_TEXT_FACTOR)):
+        frame = pd.DataFrame(rows, columns=columns)
+        kinds.see(frame)
+        path = spill / f"raw{len(blocks):06d}.pkl"
+        frame.to_pickle(path)
+        blocks.append(path)
+        n += len(frame)
+    out = CsvOut(out_path)
+    for path in blocks:
+        out.write(kinds.settle(pd.read_pickle(path)))
+        path.unlink()
+    if not blocks:
+        out.write(pd.DataFrame(columns=columns))
+    print(f"Wrote {n} rows and {len(columns)} columns to '{out_path}'")
+    return out.close()
+
+def segment(src: Path, out_path: Path, budget: Budget, spill: Path) -> Path:
+    import pandas as pd
+    cols = ["scanning_cycle_index", "heater_profile_step_index", "sensor_index"]
+    _require(_header(src), cols + ["timestamp_since_poweron"])
+    rows = budget.csv_rows(src, plain_csv)
+
+    # Pass 1: loop dimensions (sorted unique values) and row count
+    values = [set(), set(), set()]
+    n = 0
+    for chunk in pd.read_csv(src, usecols=cols, chunksize=rows):
+        for v, c in zip(values, cols):
+            v.update(pd.unique(chunk[c]))
+        n += len(chunk)
+    cycles, heaters, sensors = (np.array(sorted(v)) for v in values)
+    C, H, S = len(cycles), len(heaters), len(sensors)
+    if C == 0 or H == 0 or S == 0:
+        raise ValueError("One of the loop dimensions has zero unique values; cannot proceed.")
+
+    # Pass 2: the k-th row of triple (c, h, s) goes to the k-th position of that triple in the
+    # expected cycle -> heater -> sensor sequence if that lies inside the file, else to the end
+    counts = np.zeros(C * H * S, dtype=np.int64)
+    sorter = ExternalSorter([KEY], spill, rows)
+    kinds = Kinds()
+    offset = good = 0
+    first_mismatch = None
+    for chunk in pd.read_csv(src, chunksize=rows):
+        kinds.see(chunk)
+        ci = np.searchsorted(cycles, chunk[cols[0]].to_numpy())
+        hi = np.searchsorted(heaters, chunk[cols[1]].to_numpy())
+        si = np.searchsorted(sensors, chunk[cols[2]].to_numpy())
+        q = (ci * H + hi) * S + si
+        order = np.argsort(q, kind="stable")
+        qs = q[order]
+        starts = np.r_[0, np.flatnonzero(qs[1:] != qs[:-1]) + 1]
+        rank = np.arange(len(q)) - np.repeat(starts, np.diff(np.r_[starts, len(q)]))
+        occ = np.empty_like(q)
+        occ[order] = rank + counts[qs]
+        counts += np.bincount(q, minlength=len(counts))
+        pos = ((occ * C + ci) * H + hi) * S + si
+        rowid = offset + np.arange(len(q))
+        good += int((pos < n).sum())
+        if first_mismatch is None:
+            bad = (ci != (rowid // (H * S)) % C) | (hi != (rowid % (H * S)) // S) | (si != rowid % S)
+            if bad.any():
+                first_mismatch = int(rowid[np.argmax(bad)])
+        chunk[KEY] = np.where(pos < n, pos, n + rowid)
+        sorter.add(chunk)
+        offset += len(q)
+
+    out = CsvOut(out_path)
+    written, last_ts, nonmono = 0, None, False
+    for block in sorter.sorted():
+        block = kinds.settle(block.drop(columns=[KEY]))
+        ts = block["timestamp_since_poweron"].to_numpy()[:max(0, good - written)]
+        if len(ts):
+            seq = ts if last_ts is None else np.r_[last_ts, ts]
+            nonmono |= bool((seq[1:] < seq[:-1]).any())
+            last_ts = ts[-1]
+        out.write(block)
+        written += len(block)
+    if written == 0:
+        out.write(pd.read_csv(src, nrows=0))
+    out.close()
+
+    print("=== Loop Reconstruction Report ===")
+    print(f"Input rows: {n}")
+    print(f"Unique sensors: {S} | heater steps: {H} | scan cycles: {C}")
+    print(f"In-pattern rows placed first: {good}")
+    print(f"Out-of-pattern rows moved to end: {n - good}")
+    if first_mismatch is None:
+        print("The original file was already in the expected nested order for its length.")
+    else:
+        print(f"First deviation from the pattern starts at original row: {first_mismatch + 1}")
+    if nonmono:
+        print("WARNING: Within the in-pattern block, timestamp_since_poweron is not strictly nondecreasing.")
+    print(f"[INFO] External sort: {sorter.files} blocks, {sorter.passes} extra merge pass(es)")
+    print(f"\nWrote reordered file to: {out_path}")
+    return out_path
+
+def trim(src: Path, out_path: Path, budget: Budget, spice: str) -> Path:
+    import pandas as pd
+    script = CSV_ROOT / "Trimming_Messy_Scanning_Cycles" / spice / SPICE_FILES[spice][3]
+    is_perfect_chunk = load_script(script, f"trim_{spice.lower()}").is_perfect_chunk
+    rows = max(TRIM_CHUNK, budget.csv_rows(src, plain_csv) // TRIM_CHUNK * TRIM_CHUNK)
+    kinds, n = scan_kinds(pd.read_csv(src, chunksize=rows))
+
+    # Walk forward window by window until the first imperfect one (windows never straddle chunks)
+    out = CsvOut(out_path)
+    perfect = 0
+    for chunk in pd.read_csv(src, chunksize=rows):
+        ok = 0
+        while ok + TRIM_CHUNK <= len(chunk) and is_perfect_chunk(chunk.iloc[ok:ok + TRIM_CHUNK]):
+            ok += TRIM_CHUNK
+        out.write(kinds.settle(chunk.iloc[:ok]))
+        perfect += ok
+        if ok < len(chunk):
+            break
+    out.close()
+    if n - perfect > 0:
+        print(f"Imperfect data begins at original CSV row: {perfect + 2} (header is row 1).")
+        print(f"Total imperfect rows dropped: {n - perfect}.")
+    else:
+        print("No imperfect data detected. Entire file consists of perfect chunks.")
+    print(f"Created new file without imperfect chunks: {out_path}")
+    return out_path
+
+def label(src: Path, out_dir: Path, budget: Budget, spice: str) -> Path:
+    rows = budget.csv_rows(src, dtype_schema.read_csv)
+    kinds, _ = scan_kinds(dtype_schema.read_csv(src, chunksize=rows))
+    out = CsvOut(out_dir / csv_name(f"{csv_stem(src)}_labeled.csv"))
+    for chunk in dtype_schema.read_csv(src, chunksize=rows):
+        chunk = kinds.settle(chunk)
+        chunk["spice"] = spice
+        chunk["target"] = LABEL_MAP[spice]
+        if "scanning_cycle_index" in chunk.columns:
+            chunk["group_id"] = f"{spice}_cycle_" + chunk["scanning_cycle_index"].astype(int).astype(str)
+        else:
+            chunk["group_id"] = f"{spice}_file"
+        out.write(chunk)
+    (out_dir / "label_mapping.json").write_text(json.dumps(LABEL_MAP, indent=2))
+    print(f"[OK] Labeled file: {out.path}")
+    return out.close()
+
+def merge(src_dir: Path, out_path: Path, budget: Budget) -> Path:
+    import pandas as pd
+    files = list(src_dir.glob("*_labeled.csv*"))     # same file order as merge_training_labeled.py
+    if not files:
+        raise FileNotFoundError(f"No labeled CSV files found in {src_dir}")
+    columns = []
+    for f in files:
+        columns += [c for c in _header(f) if c not in columns]
+    rows = min(budget.csv_rows(f, dtype_schema.read_csv) for f in files)
+
+    def chunks():
+        for f in files:
+            for chunk in dtype_schema.read_csv(f, chunksize=rows):
+                yield chunk.reindex(columns=columns)
+
+    kinds, n = scan_kinds(chunks())
+    out = CsvOut(out_path)
+    for chunk in chunks():
+        out.write(kinds.settle(chunk))
+    print(f"[OK] Merged {len(files)} files into: {out_path}")
+    print(f"[INFO] Shape: {n} rows x {len(columns)} columns")
+    return out.close()
+
+def step1(src: Path, out_dir: Path, budget: Budget, spill: Path) -> Path:
+    step = load_script(PRE_ROOT / "Step_1_Log_Transformation" / "Train" / "fe_step1_log_transform.py", "fe_step1")
+    _require(_header(src), step.REQ_COLS)
+    rows = budget.csv_rows(src, dtype_schema.read_csv)
+    groups = unique_sorted(src, "group_id", rows)
+    keys = ["_g", "sensor_index", "heater_profile_step_index", "timestamp_since_poweron", ROW]
+    sorter = ExternalSorter(keys, spill, rows)
+    kinds = Kinds()
+    offset = 0
+    for chunk in dtype_schema.read_csv(src, chunksize=rows):
+        kinds.see(chunk)
+        chunk["log_resistance"] = np.log1p(chunk["resistance_gassensor"].astype(float))
+        chunk["_g"] = group_codes(chunk["group_id"], groups)
+        chunk[ROW] = np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        sorter.add(chunk)
+
+    out = CsvOut(out_dir / csv_name(f"{csv_stem(src)}_step1_log.csv"))
+    for block in sorter.sorted():
+        out.write(kinds.settle(block.drop(columns=["_g", ROW])))
+    print(f"[OK] Wrote: {out.path}  (rows={out.rows})")
+    print(f"[INFO] External sort: {len(groups)} groups, {sorter.files} blocks, {sorter.passes} extra merge pass(es)")
+    return out.close()
+
+
+class FirstSeen:
+    """Rank of each group key in order of first appearance (groupby(sort=False) order)."""
+
+    def __init__(self, keys: list, dropna: bool = True):
+        self.keys = keys
+        self.dropna = dropna
+        self.table = {}
+
+    def __call__(self, chunk) -> np.ndarray:
+        local = chunk.groupby(self.keys, sort=False, observed=True, dropna=self.dropna).ngroup().to_numpy()
+        labels, first = np.unique(local, return_index=True)
+        lookup = np.full(len(labels), -1, dtype=np.int64)
+        firsts = chunk[self.keys].iloc[first].astype(object)
+        for i, (label, row) in enumerate(zip(labels, firsts.itertuples(index=False))):
+            if label >= 0:
+                key = tuple(None if v != v else v for v in row)      # one key for every NaN
+                lookup[i] = self.table.setdefault(key, len(self.table))
+        return np.where(local >= 0, lookup[np.searchsorted(labels, local)], -1)
+
+def ordered_groups(src: Path, rows: int, spill: Path, rank_of, order_cols: list, name: str):
+    """Batches of whole groups of src in (rank, *order_cols, input row) order, where rank_of(chunk)
+    gives each row's group rank (-1 drops the row). The file is streamed as-is when it is already
+    in that order, else external-sorted. Returns (batches, kinds, external sorter or None)."""
+    kinds, prev, breaks = Kinds(), None, 0
+    for chunk in dtype_schema.read_csv(src, chunksize=rows):
+        kinds.see(chunk)
+        r = rank_of(chunk)
+        keep = r >= 0
+        b, prev = key_order_breaks(prev, [r[keep]] + [chunk[c].to_numpy()[keep] for c in order_cols])
+        breaks += b
+
+    def tagged():
+        offset = 0
+        for chunk in dtype_schema.read_csv(src, chunksize=rows):
+            chunk = kinds.settle(chunk)
+            r = rank_of(chunk)
+            chunk["_rank"] = r
+            chunk[ROW] = np.arange(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk[r >= 0]
+
+    if breaks == 0:
+        return group_batches(tagged(), ["_rank"], rows, name), kinds, None
+    print(f"[INFO] {src.name}: groups are not contiguous ({breaks} order breaks); external sort first")
+    sorter = ExternalSorter(["_rank"] + order_cols + [ROW], spill, rows)
+    for chunk in tagged():
+        sorter.add(chunk)
+    return group_batches(sorter.sorted(), ["_rank"], rows, name), kinds, sorter
+
+def step2(src: Path, out_dir: Path, budget: Budget, spill: Path) -> Path:
+    step = load_script(PRE_ROOT / "Step_2_Stepwise_Summaries" / "Train" / "fe_step2_stepwise_summaries_training.py",
+                       "fe_step2")
+    _require(_header(src), step.REQ_COLS)
+    keys = ["group_id", "spice", "target", "sensor_index", "heater_profile_step_index"]
+    rows = budget.csv_rows(src, dtype_schema.read_csv)
+    batches, _, sorter = ordered_groups(src, rows, spill, FirstSeen(keys), [], "step2")
+    out = CsvOut(out_dir / csv_name(f"{csv_stem(src)}_step2_stepwise.csv"))
+    for batch in batches:
+        batch = batch.drop(columns=["_rank", ROW])
+        out.write(batch.groupby(keys, sort=False, observed=True).apply(step.per_group_stats).reset_index())
+    print(f"[OK] Wrote: {out.path}  (rows={out.rows})")
+    return out.close()
+
+def step3(src: Path, out_dir: Path, budget: Budget, spill: Path) -> Path:
+    step = load_script(PRE_ROOT / "Step_3_Normalization" / "Train" / "fe_step3_within_cycle_norm_training.py",
+                       "fe_step3")
+    _require(_header(src), step.REQ_COLS, " in Step-2 file")
+    base_cols = step.REL_BASE_COLS
+    rel_cols = [f"{c}_rel" for c in base_cols]
+    rows = budget.csv_rows(src, dtype_schema.read_csv)
+    batches, _, sorter = ordered_groups(src, rows, spill / "in", FirstSeen(["group_id"], dropna=False), [], "step3")
+
+    # Every (group_id, sensor) pair and its step-0 baseline live in the same group, so the join is
+    # done batch by batch exactly as the reference does it on the whole table
+    out = CsvOut(out_dir / csv_name(f"{csv_stem(src)}_step3_norm.csv"))
+    back = ExternalSorter([ROW, "_sub"], spill / "out", rows) if sorter is not None else None
+    expected_pairs = have_base_pairs = na_rel = 0
+    for batch in batches:
+        df = batch.drop(columns=["_rank"])
+        df["sensor_index"] = df["sensor_index"].astype(int)
+        df["heater_profile_step_index"] = df["heater_profile_step_index"].astype(int)
+        base = (
+            df.loc[df["heater_profile_step_index"] == 0, ["group_id", "sensor_index"] + base_cols]
+            .rename(columns={c: f"base_{c}" for c in base_cols})
+        )
+        expected_pairs += df.groupby(["group_id", "sensor_index"], observed=True).size().shape[0]
+        have_base_pairs += base.groupby(["group_id", "sensor_index"], observed=True).size().shape[0]
+        merged = df.merge(base, on=["group_id", "sensor_index"], how="left")
+        for c in base_cols:
+            merged[f"{c}_rel"] = merged[c] - merged[f"base_{c}"]
+        na_rel += int(merged[rel_cols].isna().any(axis=1).sum())
+        if back is None:
+            out.write(merged.drop(columns=[ROW]))
+        else:
+            merged["_sub"] = merged.groupby(ROW).cumcount().to_numpy()
+            back.add(merged)
+    if back is not None:
+        # Put the rows back in input order (the reference merge keeps the left table's order)
+        for block in back.sorted():
+            out.write(block.drop(columns=[ROW, "_sub"]))
+    if have_base_pairs < expected_pairs:
+        print(f"[WARN] {expected_pairs - have_base_pairs} (group_id,sensor) pairs lack step-0 baseline. "
+              f"Relative features will be NaN for those pairs.", file=sys.stderr)
+    print(f"[OK] Wrote: {out.path}")
+    print(f"[INFO] Rows: {out.rows}, rows with any *_rel = NaN (likely missing step-0): {na_rel}")
+    return out.close()
+
+def step4(src: Path, out_dir: Path, budget: Budget) -> Path:
+    import pandas as pd
+    step = load_script(PRE_ROOT / "Step_4_Environmental_Context_Features" / "Train" /
+                       "fe_step4_context_features_training.py", "fe_step4")
+    _require(_header(src), step.REQ_COLS, " in master labeled file")
+    keys = ["group_id", "spice", "target"]
+    means = {"temp_mean": "temperature", "rh_mean": "relative_humidity", "pressure_mean": "pressure"}
+    rows = budget.csv_rows(src, dtype_schema.read_csv)
+
+    # Per-cycle running sums and counts; the means agree with the whole-table groupby to float rounding
+    total = None
+    for chunk in dtype_schema.read_csv(src, usecols=keys + list(means.values()), chunksize=rows):
+        g = chunk.groupby(keys, observed=True)[list(means.values())]
+        part = pd.concat([g.sum(), g.count().add_suffix("_n")], axis=1)
+        part.index = part.index.set_levels([lv.astype(object) for lv in part.index.levels])
+        total = part if total is None else total.add(part, fill_value=0)
+    ctx = pd.DataFrame(index=total.index)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for name, col in means.items():
+            ctx[name] = (total[col] / total[f"{col}_n"].where(total[f"{col}_n"] > 0)).to_numpy()
+    ctx = ctx.reset_index().sort_values(keys, kind="mergesort", ignore_index=True)
+
+    out = CsvOut(out_dir / csv_name(f"{csv_stem(src)}_step4_context.csv"))
+    out.write(ctx)
+    print(f"[OK] Wrote: {out.path}")
+    print(f"[INFO] Rows (cycles): {len(ctx)}")
+    return out.close()
+
+def wide_frame(batch, step):
+    """Step 5 wide rows (one per cycle) for a batch of whole cycles sorted by KEY_COLS, built
+    like the reference loop: per row the abs and rel stats, then S<s>_H<h>_n."""
+    import pandas as pd
+    ids, stats, count = step.ID_COLS, step.STAT_COLS_ABS + step.STAT_COLS_REL, step.COUNT_COL
+    batch = batch.reset_index(drop=True)
+    s_idx = batch["sensor_index"].astype(int).to_numpy()
+    h_idx = batch["heater_profile_step_index"].astype(int).to_numpy()
+    values = {c: batch[c].to_numpy() for c in stats + [count]}
+    entries = []
+    for (gid, sp, tgt), g in batch.groupby(ids, sort=False, observed=True):
+        entry = {"group_id": gid, "spice": sp, "target": tgt}
+        for i in g.index:
+            for stat in stats:
+                entry[step.make_colname(s_idx[i], h_idx[i], stat)] = values[stat][i]
+            entry[step.make_colname(s_idx[i], h_idx[i], "n")] = int(values[count][i])
+        entries.append(entry)
+    return pd.DataFrame(entries)
+
+class WideColumns:
+    """Column union of wide frames built piece by piece, in order of first appearance as
+    pd.DataFrame(all rows) would give it. *_n counts stay integers only if no cycle lacks them."""
+
+    def __init__(self):
+        self.columns = {}
+        self.n_missing = set()
+        self.rows = 0
+
+    def add(self, wide):
+        n_cols = [c for c in wide.columns if c.endswith("_n")]
+        self.n_missing.update(c for c in self.columns if c.endswith("_n") and c not in wide.columns)
+        self.n_missing.update(c for c in n_cols if c not in self.columns and self.rows)
+        self.n_missing.update(c for c in n_cols if wide[c].isna().any())
+        self.columns.update((c, None) for c in wide.columns if c not in self.columns)
+        self.rows += len(wide)
+
+    def settle(self, wide):
+        wide = wide.reindex(columns=list(self.columns))
+        return wide.astype({c: np.float64 for c in self.n_missing})
+
+def step5(summary: Path, context: Path, out_dir: Path, budget: Budget, spill: Path) -> Path:
+    import pandas as pd
+    step = load_script(PRE_ROOT / "Step_5_Wide_Merge" / "Train" / "fe_step5_make_wide_table_training.py", "fe_step5")
+    ids, stats, count = step.ID_COLS, step.STAT_COLS_ABS + step.STAT_COLS_REL, step.COUNT_COL
+    ctx_cols = ["temp_mean", "rh_mean", "pressure_mean"]
+    _require(_header(summary), step.KEY_COLS + stats + [count], " in Step-3 file")
+    ctx = dtype_schema.read_csv(context)                  # one row per cycle
+    _require(list(ctx.columns), ids + ctx_cols, " in Step-4 context file")
+    ctx = ctx[ids + ctx_cols]
+    rows = budget.csv_rows(summary, dtype_schema.read_csv)
+
+    # Cycles in the order sort_values(KEY_COLS) puts them (categoricals sort lexically)
+    seen = set()
+    for chunk in dtype_schema.read_csv(summary, usecols=ids, chunksize=rows):
+        seen.update(tuple(r) for r in chunk.dropna().astype(object).itertuples(index=False))
+    order = {k: i for i, k in enumerate(sorted(seen, key=lambda k: (str(k[0]), str(k[1]), k[2])))}
+
+    def rank_of(chunk):
+        keys = chunk[ids].astype(object).itertuples(index=False)
+        return np.array([order.get(tuple(k), -1) for k in keys], dtype=np.int64)
+
+    batches, _, sorter = ordered_groups(summary, rows, spill / "in", rank_of,
+                                        ["sensor_index", "heater_profile_step_index"], "step5")
+
+    # Wide rows per batch are spilled; the final column set is the union in order of appearance
+    wide_dir = spill / "wide"
+    wide_dir.mkdir(parents=True, exist_ok=True)
+    parts, union = [], WideColumns()
+    for batch in batches:
+        wide = wide_frame(batch, step)
+        union.add(wide)
+        path = wide_dir / f"w{len(parts):06d}.pkl"
+        wide.to_pickle(path)
+        parts.append(path)
+
+    stem = csv_stem(summary)
+    if stem.endswith("_step3_norm"):
+        stem = stem[:-len("_step3_norm")]
+    out = CsvOut(out_dir / csv_name(f"{stem}_features.csv"))
+    columns = list(union.columns)
+    n_cols = [c for c in columns + ctx_cols if c.endswith("_n")]
+    bad = 0
+    for path in parts:
+        wide = union.settle(pd.read_pickle(path))
+        final = wide.merge(ctx, on=ids, how="left")
+        if n_cols:
+            bad += int((final[n_cols].isna().sum(axis=1) > 0).sum())
+        out.write(final)
+        path.unlink()
+    if not parts:
+        out.write(pd.DataFrame(columns=ids).merge(ctx, on=ids, how="left"))
+
+    print(f"[INFO] Cycles (rows): {out.rows}")
+    print(f"[INFO] Feature columns (including context): {len(columns) + len(ctx_cols) - len(ids)}")
+    if not n_cols:
+        print("[WARN] No *_n columns found. Cannot verify cell counts.", file=sys.stderr)
+    elif bad > 0:
+        print(f"[WARN] {bad} cycle rows have missing sensor/step cells (NaN in *_n).", file=sys.stderr)
+    print(f"[OK] Wrote features: {out.path}")
+    print(f"[INFO] Columns total: {len(columns) + len(ctx_cols)}")
+    return out.close()
+
+def run_all(raw: dict, out_dir: Path, budget: Budget, spill: Path) -> Path:
+    """Whole chain: per spice RawToCSV -> segmentation -> trimming -> labeling, then merge and Steps 1-5."""
+    labeled = out_dir / "labeled"
+    for sub in ("labeled", "master", "step1", "step2", "step3", "step4", "step5"):
+        (out_dir / sub).mkdir(parents=True, exist_ok=True)
+    for spice, src in raw.items():
+        work = out_dir / spice
+        work.mkdir(parents=True, exist_ok=True)
+        csv = _timed(f"raw_to_csv {spice}", raw_to_csv, src, work / csv_name(f"{csv_stem(src)}.csv"), budget, spill / "raw")
+        csv = _timed(f"segment {spice}", segment, csv, work / csv_name(f"{csv_stem(csv)}_reordered.csv"), budget, spill / "segment")
+        csv = _timed(f"trim {spice}", trim, csv, work / csv_name(f"{csv_stem(csv)}_perfect_only.csv"), budget, spice)
+        _timed(f"label {spice}", label, csv, labeled, budget, spice)
+    master = _timed("merge", merge, labeled, out_dir / "master" / csv_name("master_training_labeled.csv"), budget)
+    s1 = _timed("step1", step1, master, out_dir / "step1", budget, spill / "step1")
+    s2 = _timed("step2", step2, s1, out_dir / "step2", budget, spill / "step2")
+    s3 = _timed("step3", step3, s2, out_dir / "step3", budget, spill / "step3")
+    s4 = _timed("step4", step4, master, out_dir / "step4", budget)
+    return _timed("step5", step5, s3, s4, out_dir / "step5", budget, spill / "step5")
+
+_SECONDS = {}
+
+def _timed(name: str, fn, *args):
+    start = time.time()
+    result = fn(*args)
+    _SECONDS[name] = round(time.time() - start, 2)
+    return result
+
+def main(stage: str, out_dir: Path, memory_budget: str, src: Path = None, summary: Path = None,
+         context: Path = None, src_dir: Path = None, spice: str = None, raw: dict = None, spill_dir: Path = None,
+         compression: str = None):
+    configure(compression)
+    import pandas                          # loaded up front so it counts as interpreter memory
+    start_mb = peak_mb()
+    budget = Budget(parse_size(memory_budget))
+    out_dir.mkdir(parents=True, exist_ok=True)
+    spill = spill_dir if spill_dir is not None else out_dir / "_spill"
+    if stage in ("trim", "label") and spice is None:
+        raise ValueError(f"--stage {stage} needs --spice")
+    needs = {"step5": (summary, context), "merge": (src_dir,), "all": (raw,)}.get(stage, (src,))
+    if any(v is None or v == {} for v in needs):
+        raise ValueError(f"--stage {stage} needs " + {"step5": "--summary and --context", "merge": "--src_dir",
+                                                       "all": "--raw Spice=path"}.get(stage, "--src"))
+    print(f"[INFO] Memory budget {budget.nbytes / 2**20:.0f} MB, spill folder {spill}")
+
+    try:
+        if stage == "all":
+            out = run_all(raw, out_dir, budget, spill)
+        elif stage == "raw_to_csv":
+            out = _timed(stage, raw_to_csv, src, out_dir / csv_name(f"{csv_stem(src)}.csv"), budget, spill)
+        elif stage == "segment":
+            out = _timed(stage, segment, src, out_dir / csv_name(f"{csv_stem(src)}_reordered.csv"), budget, spill)
+        elif stage == "trim":
+            out = _timed(stage, trim, src, out_dir / csv_name(f"{csv_stem(src)}_perfect_only.csv"), budget, spice)
+        elif stage == "label":
+            out = _timed(stage, label, src, out_dir, budget, spice)
+        elif stage == "merge":
+            out = _timed(stage, merge, src_dir, out_dir / csv_name("master_training_labeled.csv"), budget)
+        elif stage == "step4":
+            out = _timed(stage, step4, src, out_dir, budget)
+        elif stage == "step5":
+            out = _timed(stage, step5, summary, context, out_dir, budget, spill)
+        else:
+            out = _timed(stage, {"step1": step1, "step2": step2, "step3": step3}[stage], src, out_dir, budget, spill)
+    finally:
+        shutil.rmtree(spill, ignore_errors=True)
+
+    print(f"[INFO] Stage seconds: {_SECONDS}")
+    print(f"[OK] Peak RSS {peak_mb():.0f} MB ({start_mb:.0f} MB interpreter + budget {budget.nbytes / 2**20:.0f} MB)")
+    return out
+
+def _raw_arg(text: str) -> tuple:
+    spice, _, path = text.partition("=")
+    if spice not in SPICE_FILES or not path:
+        raise argparse.ArgumentTypeError(f"expected Spice=path with Spice in {sorted(SPICE_FILES)}, got {text!r}")
+    return spice, Path(path)
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Run pipeline stages out of core within a memory budget")
+    p.add_argument("--stage", required=True, choices=STAGES + ["all"], help="Stage to run (all = whole chain)")
+    p.add_argument("--src", type=str, default=None, help="Input file of the stage (raw .txt, CSV of the previous stage)")
+    p.add_argument("--summary", type=str, default=None, help="Step 5: Step-3 CSV")
+    p.add_argument("--context", type=str, default=None, help="Step 5: Step-4 context CSV")
+    p.add_argument("--src_dir", type=str, default=None, help="Merge: folder of *_labeled.csv files")
+    p.add_argument("--spice", type=str, default=None, choices=sorted(SPICE_FILES), help="Trimming/labeling: spice of the session")
+    p.add_argument("--raw", type=_raw_arg, action="append", default=[],
+                   help="--stage all: raw session as Spice=path (repeat per spice)")
+    p.add_argument("--out_dir", required=True, type=str, help="Output directory")
+    p.add_argument("--memory_budget", "--memory-budget", type=str, default="512MB",
+                   help="Memory for data (e.g. 256MB, 2GB); chunk sizes follow from it")
+    p.add_argument("--spill_dir", type=str, default=None, help="Folder for sorted runs (default <out_dir>/_spill, removed at the end)")
+    p.add_argument("--compression", type=str, default=None,
+                   help="Output codec <method>[:<level>] (none, zstd, gzip, bz2, xz; default $ENOSE_COMPRESSION)")
+    args = p.parse_args()
+    main(args.stage, Path(args.out_dir), args.memory_budget,
+         Path(args.src) if args.src else None,
+         Path(args.summary) if args.summary else None,
+         Path(args.context) if args.context else None,
+         Path(args.src_dir) if args.src_dir else None,
+         args.spice, dict(args.raw), Path(args.spill_dir) if args.spill_dir else None,
+         args.compression)
@@ -0,0 +1,390 @@
+# partitioned_store.py
+# Purpose: Hive-style partitioned layout for labeled (or any per-row) pipeline data:
+#   <root>/spice=<Spice>/day=<YYYY-MM-DD>/session=<session>/part-00000.csv
+# In place of one master_training_labeled.csv, each partition holds one recording session's
+# rows for one UTC day (from real_time_clock). Each partition has a _stats.json: row count,
+# bytes, cycles (group ids), and min/max/null counts per numeric column. <root>/_manifest.json
+# indexes them all. Readers prune partitions by key (--partitions "spice=Anise;day=2023-11-*")
+# and by those statistics (--where "temperature>30"), then read or process only what is left.
+# They can do that in parallel with --workers.
+# Sessions come from a `session` column, from ingest_daemon.py's session-qualified group ids
+# (<Spice>_<session>_cycle_<c>), or else from timestamp_since_poweron resets (drift_monitor.SessionTracker).
+# Shuffled tables (Train_All.csv) have no recoverable sessions: write them with --session all.
+# Writing replaces only the partitions present in the input, so rebuilding one spice
+# (--spice) or one session leaves every other partition untouched; --append adds files instead.
+# --run_steps runs the reference Steps 1-5 on each selected partition in a process pool. Group
+# ids that span partitions (a session crossing midnight) are summarised per partition and reported.
+# --compression (csv_codec.py) compresses the part files; stores may mix compressed and plain parts.
+#
+# Example:
+#   python partitioned_store.py --write master_training_labeled.csv --root labeled_parts
+#   python partitioned_store.py --list --root labeled_parts --partitions "spice=Anise,Nutmeg"
+#   python partitioned_store.py --read --root labeled_parts --partitions "day=2023-11-14" --where "temperature>25" --out day.csv
+#   python partitioned_store.py --run_steps steps_out --root labeled_parts --partitions "spice=Chilli" --workers 4
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import fnmatch
+import json
+import operator
+import os
+import re
+import shutil
+import sys
+import time
+import numpy as np
+
+import dtype_schema
+from csv_codec import configure, csv_name, open_text, write_csv
+from dataset_cache import _write_json_atomic
+from drift_monitor import SessionTracker
+
+KEYS = ["spice", "day", "session"]
+STATS_NAME = "_stats.json"
+MANIFEST_NAME = "_manifest.json"
+UNKNOWN = "unknown"
+CHUNK_ROWS = 200000
+MAX_PARTITIONS = 2000    # more than this from one file means it is not in recording order
+FLOAT_PRECISION = "round_trip"   # partition files hold exactly the values of the source CSV
+OPS = {"<=": operator.le, ">=": operator.ge, "==": operator.eq, "!=": operator.ne,
+       "<": operator.lt, ">": operator.gt, "=": operator.eq}
+
+def safe_value(text) -> str:
+    """Partition value usable as a folder name."""
+    return re.sub(r"[^A-Za-z0-9._-]+", "-", str(text)).strip("-") or UNKNOWN
+
+def partition_dir(root: Path, spice: str, day: str, session: str) -> Path:
+    return root / f"spice={spice}" / f"day={day}" / f"session={session}"
+
+def day_of(chunk) -> np.ndarray:
+    """UTC recording day of each row from real_time_clock (seconds); 'unknown' when missing."""
+    if "real_time_clock" not in chunk.columns:
+        return np.full(len(chunk), UNKNOWN, dtype=object)
+    rtc = chunk["real_time_clock"].to_numpy(dtype=np.float64)
+    ok = np.isfinite(rtc) & (rtc > 0)
+    days = np.full(len(chunk), UNKNOWN, dtype=object)
+    days[ok] = np.floor(rtc[ok]).astype("int64").astype("datetime64[s]").astype("datetime64[D]").astype(str)
+    return days
+
+def session_of(chunk, tracker: SessionTracker) -> np.ndarray:
+    """Session of each row: `session` column, ingest_daemon's qualified group ids, else power-on runs."""
+    if "session" in chunk.columns:
+        return chunk["session"].astype(str).to_numpy(dtype=object)
+    if "timestamp_since_poweron" in chunk.columns:
+        sessions = tracker.assign(chunk)
+    else:
+        sessions = np.full(len(chunk), "all", dtype=object)
+    if "group_id" in chunk.columns and "spice" in chunk.columns:
+        gid = chunk["group_id"].astype(str)
+        spice = chunk["spice"].astype(str)
+        parts = gid.str.extract(r"^([^_]+)_(.+)_cycle_-?\d+$")
+        qualified = (parts[1].notna() & (parts[0] == spice)).to_numpy()
+        sessions = np.where(qualified, parts[1].to_numpy(dtype=object), sessions)
+    return sessions
+
+class PartitionStats:
+    """Running statistics of one partition, saved as its _stats.json."""
+
+    def __init__(self, spice: str, day: str, session: str, prior: dict = None):
+        self.info = prior or {"spice": spice, "day": day, "session": session, "rows": 0, "bytes": 0,
+                              "files": [], "groups": [], "columns": {}}
+        self.groups = set(self.info["groups"])
+
+    def update(self, frame):
+        self.info["rows"] += len(frame)
+        if "group_id" in frame.columns:
+            self.groups.update(frame["group_id"].dropna().astype(str).unique())
+        cols = self.info["columns"]
+        for c in frame.columns:
+            s = frame[c]
+            if s.dtype.kind not in "iuf":
+                continue
+            st = cols.setdefault(c, {"min": None, "max": None, "nulls": 0})
+            nulls = int(s.isna().sum())
+            st["nulls"] += nulls
+            if nulls < len(s):
+                lo, hi = s.min(), s.max()
+                lo, hi = (int(lo), int(hi)) if s.dtype.kind in "iu" else (float(lo), float(hi))
+                st["min"] = lo if st["min"] is None else min(st["min"], lo)
+                st["max"] = hi if st["max"] is None else max(st["max"], hi)
+
+    def save(self, folder: Path):
+        files = sorted(p for p in folder.glob("part-*.csv*"))
+        self.info["files"] = [p.name for p in files]
+        self.info["bytes"] = sum(p.stat().st_size for p in files)
+        self.info["groups"] = sorted(self.groups)
+        self.info["written"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        _write_json_atomic(folder / STATS_NAME, self.info)
+
+def write(src: Path, root: Path, spice: str = None, append: bool = False, session: str = None,
+          chunk_rows: int = CHUNK_ROWS) -> list:
+    """Split src into partitions under root. Partitions present in src are replaced (or, with
+    append, get an extra part file); all others are left as they are. session= names the session
+    of every row. Returns the partitions written."""
+    import pandas as pd
+    stage = root / f"_staging_{os.getpid()}"
+    shutil.rmtree(stage, ignore_errors=True)
+    tracker = SessionTracker()
+    first = csv_name("part-00000.csv")
+    files, stats = {}, {}
+    try:
+        for chunk in dtype_schema.read_csv(src, chunksize=chunk_rows, float_precision=FLOAT_PRECISION):
+            if "spice" not in chunk.columns:
+                raise ValueError("Missing required columns: ['spice']")
+            sessions = np.full(len(chunk), session, dtype=object) if session else session_of(chunk, tracker)
+            keys = np.stack([chunk["spice"].astype(str).to_numpy(dtype=object), day_of(chunk), sessions], axis=1)
+            if spice is not None:
+                keep = keys[:, 0] == spice
+                chunk, keys = chunk[keep], keys[keep]
+            if len(chunk) == 0:
+                continue
+            keys = np.vectorize(safe_value, otypes=[object])(keys)
+            # One write per partition and chunk; rows keep their order inside each partition
+            codes, uniques = pd.factorize(pd.Series(["\x1f".join(k) for k in keys]))
+            order = np.argsort(codes, kind="stable")
+            bounds = np.r_[0, np.cumsum(np.bincount(codes))]
+            for i, joined in enumerate(uniques):
+                key = tuple(joined.split("\x1f"))
+                part = chunk.iloc[order[bounds[i]:bounds[i + 1]]]
+                if key not in files:
+                    if len(files) == MAX_PARTITIONS:
+                        raise ValueError(f"{src.name} gives more than {MAX_PARTITIONS} partitions; it is probably "
+                                         f"not in recording order (pass --session to name one session)")
+                    folder = partition_dir(stage, *key)
+                    folder.mkdir(parents=True, exist_ok=True)
+                    files[key] = open_text(folder / first, "w")
+                    part.to_csv(files[key], index=False)
+                    stats[key] = PartitionStats(*key)
+                else:
+                    part.to_csv(files[key], header=False, index=False)
+                stats[key].update(part)
+        for f in files.values():
+            f.close()
+
+        # Move the staged partitions into place, one partition at a time
+        for key, st in stats.items():
+            staged, final = partition_dir(stage, *key), partition_dir(root, *key)
+            if append and (final / STATS_NAME).exists():
+                prior = json.loads((final / STATS_NAME).read_text())
+                name = csv_name(f"part-{len(list(final.glob('part-*.csv*'))):05d}.csv")
+                (staged / first).replace(final / name)
+                merged = PartitionStats(*key, prior=prior)
+                merged.groups |= st.groups
+                merged.info["rows"] += st.info["rows"]
+                for c, s in st.info["columns"].items():
+                    m = merged.info["columns"].get(c)
+                    if m is None:
+                        # Column new in this batch: its stats are the batch's own
+                        merged.info["columns"][c] = dict(s)
+                        continue
+                    m["nulls"] += s["nulls"]
+                    for k, fn in (("min", min), ("max", max)):
+                        vals = [v for v in (m[k], s[k]) if v is not None]
+                        m[k] = fn(vals) if vals else None
+                merged.save(final)
+            else:
+                st.save(staged)
+                if final.exists():
+                    shutil.rmtree(final)
+                final.parent.mkdir(parents=True, exist_ok=True)
+                staged.replace(final)
+    finally:
+        for f in files.values():
+            f.close()
+        shutil.rmtree(stage, ignore_errors=True)
+    rebuild_manifest(root)
+    return sorted(stats)
+
+def rebuild_manifest(root: Path) -> dict:
+    """Index every partition's _stats.json in <root>/_manifest.json."""
+    parts = []
+    for path in sorted(root.glob(f"spice=*/day=*/session=*/{STATS_NAME}")):
+        info = json.loads(path.read_text())
+        parts.append({"path": str(path.parent.relative_to(root)), **{k: info[k] for k in KEYS},
+                      "rows": info["rows"], "bytes": info["bytes"]})
+    manifest = {"keys": KEYS, "partitions": parts, "rows": sum(p["rows"] for p in parts)}
+    _write_json_atomic(root / MANIFEST_NAME, manifest)
+    return manifest
+
+def parse_filters(text: str) -> dict:
+    """'spice=Anise,Chilli;day=2023-11-*' -> {key: [patterns]} (fnmatch patterns, any may match)."""
+    filters = {}
+    for part in filter(None, (t.strip() for t in (text or "").split(";"))):
+        key, _, values = part.partition("=")
+        if key.strip() not in KEYS or not values:
+            raise ValueError(f"Bad partition filter {part!r}; use key=value[,value] with key in {KEYS}")
+        filters[key.strip()] = [v.strip() for v in values.split(",")]
+    return filters
+
+def parse_where(text: str) -> list:
+    """'temperature>30;pressure<=1013' -> [(column, op, value)]."""
+    preds = []
+    for part in filter(None, (t.strip() for t in (text or "").split(";"))):
+        m = re.fullmatch(r"(\w+)\s*(<=|>=|==|!=|<|>|=)\s*(\S+)", part)
+        if not m:
+            raise ValueError(f"Bad predicate {part!r}; use column<op>number with op in {list(OPS)}")
+        preds.append((m.group(1), m.group(2), float(m.group(3))))
+    return preds
+
+def might_match(info: dict, col: str, op: str, value: float) -> bool:
+    """False only when the partition's min/max prove that no row satisfies col <op> value."""
+    st = info["columns"].get(col)
+    if st is None or st["min"] is None:
+        return st is None          # unknown column: keep; all-null column: nothing matches
+    lo, hi = st["min"], st["max"]
+    if op in ("<", "<="):
+        return OPS[op](lo, value)
+    if op in (">", ">="):
+        return OPS[op](hi, value)
+    if op in ("=", "=="):
+        return lo <= value <= hi
+    return not (lo == hi == value)
+
+def select(root: Path, filters: dict = None, where: list = None) -> list:
+    """Stats of the partitions that pass the key filters and may hold rows matching `where`."""
+    manifest_path = root / MANIFEST_NAME
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"No {MANIFEST_NAME} in {root}; write the store first")
+    chosen = []
+    for p in json.loads(manifest_path.read_text())["partitions"]:
+        if any(not any(fnmatch.fnmatchcase(p[k], pat) for pat in pats) for k, pats in (filters or {}).items()):
+            continue
+        info = json.loads((root / p["path"] / STATS_NAME).read_text())
+        if all(might_match(info, *pred) for pred in where or []):
+            chosen.append({**info, "path": str(root / p["path"])})
+    return chosen
+
+def read_partition(part: dict, usecols=None, where: list = None, with_keys: bool = False):
+    """One partition's rows (its part files in order), rows filtered by `where`."""
+    import pandas as pd
+    frames = [dtype_schema.read_csv(Path(part["path"]) / f, usecols=usecols, float_precision=FLOAT_PRECISION)
+              for f in part["files"]]
+    df = pd.concat(frames, ignore_index=True) if len(frames) != 1 else frames[0]
+    for col, op, value in where or []:
+        if col in df.columns:
+            df = df[OPS[op](df[col], value)]
+    if with_keys:
+        df = df.assign(day=part["day"], session=part["session"])
+    return df.reset_index(drop=True)
+
+def map_partitions(fn, parts: list, workers: int = 1, **kwargs) -> list:
+    """fn(part, **kwargs) for every partition, in a process pool; results keep partition order."""
+    if workers <= 1 or len(parts) <= 1:
+        return [fn(p, **kwargs) for p in parts]
+    with ProcessPoolExecutor(max_workers=min(workers, len(parts))) as ex:
+        futs = [ex.submit(fn, p, **kwargs) for p in parts]
+        return [f.result() for f in futs]
+
+def read(root: Path, filters: dict = None, where: list = None, usecols=None, workers: int = 1,
+         with_keys: bool = False):
+    """Rows of the selected partitions, concatenated in partition order (spice, day, session)."""
+    import pandas as pd
+    parts = select(root, filters, where)
+    if not parts:
+        raise ValueError(f"No partition of {root} matches {filters or {}} {where or ''}".rstrip())
+    frames = map_partitions(read_partition, parts, workers, usecols=usecols, where=where, with_keys=with_keys)
+    return pd.concat(frames, ignore_index=True)
+
+def shared_groups(parts: list) -> dict:
+    """group_id -> partition paths, for group ids found in more than one partition."""
+    seen = {}
+    for p in parts:
+        for g in p["groups"]:
+            seen.setdefault(g, []).append(p["path"])
+    return {g: paths for g, paths in seen.items() if len(paths) > 1}
+
+def run_steps_partition(part: dict, out_root: Path, root: Path) -> dict:
+    """Reference Steps 1-5 on one partition; outputs go to the same partition path under out_root."""
+    from conformance_harness import run_reference
+    out = out_root / Path(part["path"]).relative_to(root)
+    src = Path(part["path"]) / part["files"][0]
+    if len(part["files"]) > 1:
+        out.mkdir(parents=True, exist_ok=True)
+        src = out / csv_name("labeled.csv")
+        write_csv(read_partition(part), src)
+    work = out / "_work"
+    secs = {}
+    s1, secs["step1"] = run_reference("step1", [src], work / "step1")
+    s2, secs["step2"] = run_reference("step2", [s1], work / "step2")
+    s3, secs["step3"] = run_reference("step3", [s2], work / "step3")
+    s4, secs["step4"] = run_reference("step4", [src], work / "step4")
+    s5, secs["step5"] = run_reference("step5", [s3, s4], work / "step5")
+    for stage, path in zip(("step1", "step2", "step3", "step4", "step5"), (s1, s2, s3, s4, s5)):
+        path.replace(out / csv_name(f"{stage}.csv"))
+    shutil.rmtree(work, ignore_errors=True)
+    if src.parent == out:
+        src.unlink()
+    return {"path": str(out), "rows": part["rows"], "seconds": {k: round(v, 2) for k, v in secs.items()}}
+
+def main(root: Path, write_src: Path = None, spice: str = None, append: bool = False, session: str = None,
+         list_only: bool = False,
+         read_out: Path = None, run_out: Path = None, partitions: str = None, where: str = None,
+         workers: int = 1, with_keys: bool = False, compression: str = None):
+    configure(compression)
+    filters, preds = parse_filters(partitions), parse_where(where)
+    if write_src is not None:
+        start = time.time()
+        written = write(write_src, root, spice, append, session)
+        print(f"[OK] {'Appended to' if append else 'Wrote'} {len(written)} partition(s) under {root} "
+              f"in {time.time() - start:.1f}s")
+        for key in written:
+            print(f"  spice={key[0]}/day={key[1]}/session={key[2]}")
+        return written
+
+    manifest = json.loads((root / MANIFEST_NAME).read_text()) if (root / MANIFEST_NAME).exists() else None
+    parts = select(root, filters, preds)
+    total = len(manifest["partitions"]) if manifest else 0
+    print(f"[INFO] {len(parts)} of {total} partitions selected "
+          f"({sum(p['rows'] for p in parts):,} of {manifest['rows'] if manifest else 0:,} rows)")
+    shared = shared_groups(parts)
+    if shared:
+        print(f"[WARN] {len(shared)} group id(s) span several selected partitions (e.g. {next(iter(shared))}); "
+              f"per-partition Steps 2-5 summarise them per partition", file=sys.stderr)
+
+    if list_only or (read_out is None and run_out is None):
+        print(f"{'spice':<10}{'day':<12}{'session':<28}{'rows':>10}{'MB':>8}{'cycles':>8}")
+        for p in parts:
+            print(f"{p['spice']:<10}{p['day']:<12}{p['session']:<28}{p['rows']:>10,}{p['bytes'] / 1e6:>8.1f}"
+                  f"{len(p['groups']):>8}")
+        return parts
+
+    if read_out is not None:
+        start = time.time()
+        df = read(root, filters, preds, workers=workers, with_keys=with_keys)
+        read_out.parent.mkdir(parents=True, exist_ok=True)
+        write_csv(df, read_out)
+        print(f"[OK] Wrote: {read_out}  (rows={len(df)}, read in {time.time() - start:.1f}s)")
+        return read_out
+
+    start = time.time()
+    results = map_partitions(run_steps_partition, parts, workers, out_root=run_out, root=root)
+    for r in results:
+        print(f"[OK] {r['path']}: {r['rows']:,} rows | {r['seconds']}")
+    print(f"[INFO] Steps 1-5 on {len(results)} partition(s) with {workers} worker(s) in {time.time() - start:.1f}s")
+    return results
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Hive-style partitioned store (spice/day/session) with per-partition stats")
+    p.add_argument("--root", required=True, type=str, help="Store folder")
+    p.add_argument("--write", type=str, default=None, help="CSV to split into partitions (labeled master or a session)")
+    p.add_argument("--spice", type=str, default=None, help="With --write: only (re)write this spice's partitions")
+    p.add_argument("--append", action="store_true", help="With --write: add part files instead of replacing partitions")
+    p.add_argument("--session", type=str, default=None,
+                   help="With --write: session name for every row (for shuffled tables such as Train_All.csv)")
+    p.add_argument("--list", action="store_true", help="List the selected partitions and their stats")
+    p.add_argument("--read", action="store_true", help="Concatenate the selected partitions into --out")
+    p.add_argument("--out", type=str, default=None, help="Output CSV for --read")
+    p.add_argument("--with_keys", action="store_true", help="With --read: add day and session columns")
+    p.add_argument("--run_steps", type=str, default=None, help="Run Steps 1-5 per selected partition into this folder")
+    p.add_argument("--partitions", type=str, default=None, help='Key filter, e.g. "spice=Anise,Chilli;day=2023-11-*"')
+    p.add_argument("--where", type=str, default=None, help='Row predicates used for pruning and filtering, e.g. "temperature>30"')
+    p.add_argument("--workers", type=int, default=1, help="Processes for reading / running partitions")
+    p.add_argument("--compression", type=str, default=None,
+                   help="Codec of written part files and Step outputs <method>[:<level>] (default $ENOSE_COMPRESSION)")
+    args = p.parse_args()
+    if args.read and not args.out:
+        p.error("--read needs --out")
+    main(Path(args.root), Path(args.write) if args.write else None, args.spice, args.append, args.session, args.list,
+         Path(args.out) if args.read else None, Path(args.run_steps) if args.run_steps else None,
+         args.partitions, args.where, args.workers, args.with_keys, args.compression)
@@ -0,0 +1,211 @@
+# pca_density.py
+# Purpose: Density images instead of scatter plots for very large PCA projections.
+# Scatter plots that draw every projected row (PCA_Raw_Data.ipynb) get slow and unreadable at
+# millions of points. This script streams a PC score file (stream_pca.py output) in chunks. It bins
+# every PC pair into one fixed-size 2D histogram per class with a single vectorized bincount per
+# chunk. The counts are saved to pca_density.npz and rendered as one image per pair, with each
+# class in its colour and log-scaled intensity. Rendering cost depends on --bins, not on the row
+# count. Memory is one chunk plus classes x bins^2 counters per pair.
+# The image has axes and a legend when matplotlib is installed. Without matplotlib a plain PNG of
+# the same image is written.
+#
+# Example:
+#   python pca_density.py --src pca_outputs/master_training_labeled_pca_scores.csv --out_dir pca_outputs
+#   python pca_density.py --src pca_wide/train_features_pca_scores.csv --pcs 4 --bins 256 --out_dir pca_wide
+
+from pathlib import Path
+import argparse
+import itertools
+import struct
+import sys
+import time
+import zlib
+import numpy as np
+
+import dtype_schema
+from stream_pca import LABEL_COL, LABEL_NAMES
+
+# matplotlib "tab10" colours, so classes keep the colours of the notebook's scatter plots
+CLASS_COLOURS = np.array([[31, 119, 180], [255, 127, 14], [44, 160, 44], [214, 39, 40], [148, 103, 189],
+                          [140, 86, 75], [227, 119, 194], [127, 127, 127], [188, 189, 34], [23, 190, 207]]) / 255.0
+
+def read_chunks(src: Path, columns: list, chunk_rows: int):
+    import pandas as pd
+    # Scores are only binned, so float32 is plenty
+    yield from dtype_schema.read_csv(src, float32=True, usecols=columns, chunksize=chunk_rows)
+
+def score_columns(src: Path, n_pcs: int) -> tuple:
+    import pandas as pd
+    header = list(pd.read_csv(src, nrows=0).columns)
+    pcs = [c for c in header if c.startswith("PC") and c[2:].isdigit()]
+    if len(pcs) < 2:
+        raise ValueError(f"{src.name} needs at least two PC columns (found: {pcs})")
+    return pcs[:n_pcs], LABEL_COL in header
+
+def score_range(src: Path, pcs: list, chunk_rows: int, clip: float) -> np.ndarray:
+    """(n_pcs, 2) plotting range per PC from one streaming pass: mean +/- clip standard deviations,
+    limited to the observed min/max. A few far outliers therefore do not squeeze the plot."""
+    n, s, ss = 0, np.zeros(len(pcs)), np.zeros(len(pcs))
+    lo, hi = np.full(len(pcs), np.inf), np.full(len(pcs), -np.inf)
+    for chunk in read_chunks(src, pcs, chunk_rows):
+        X = chunk[pcs].to_numpy(dtype=np.float64)
+        X = X[np.isfinite(X).all(axis=1)]
+        n += len(X)
+        s += X.sum(axis=0)
+        ss += (X * X).sum(axis=0)
+        lo, hi = np.minimum(lo, X.min(axis=0, initial=np.inf)), np.maximum(hi, X.max(axis=0, initial=-np.inf))
+    if n == 0:
+        raise ValueError(f"No finite PC scores in {src.name}")
+    mean = s / n
+    std = np.sqrt(np.maximum(ss / n - mean * mean, 0.0))
+    out = np.stack([np.maximum(lo, mean - clip * std), np.minimum(hi, mean + clip * std)], axis=1)
+    flat = out[:, 1] <= out[:, 0]
+    out[flat] += [-0.5, 0.5]
+    return out
+
+class DensityGrid:
+    """Per-class 2D histograms for every PC pair, filled chunk by chunk."""
+
+    def __init__(self, ranges: np.ndarray, pairs: list, n_classes: int, bins: int):
+        self.ranges = ranges
+        self.pairs = pairs
+        self.bins = bins
+        self.n_classes = n_classes
+        self.counts = np.zeros((len(pairs), n_classes, bins, bins), dtype=np.int64)
+        self.outside = 0
+
+    def update(self, X: np.ndarray, y: np.ndarray):
+        # Bin index per PC, once per chunk; rows outside the range land in the edge bins
+        lo, hi = self.ranges[:, 0], self.ranges[:, 1]
+        idx = np.floor((X - lo) / (hi - lo) * self.bins)
+        self.outside += int(((idx < 0) | (idx >= self.bins)).any(axis=1).sum())
+        idx = np.clip(idx, 0, self.bins - 1).astype(np.int64)
+        size = self.bins * self.bins
+        for p, (i, j) in enumerate(self.pairs):
+            flat = y * size + idx[:, i] * self.bins + idx[:, j]
+            self.counts[p] += np.bincount(flat, minlength=self.n_classes * size) \
+                .reshape(self.n_classes, self.bins, self.bins)
+
+    def edges(self, pc: int) -> np.ndarray:
+        return np.linspace(self.ranges[pc, 0], self.ranges[pc, 1], self.bins + 1)
+
+def composite(counts: np.ndarray) -> np.ndarray:
+    """RGB image (bins, bins, 3) in [0, 1] from per-class counts (classes, bins, bins).
+    Each pixel blends the class colours by log density and fades to white where there is no data.
+    Rows of the image are the second PC from top (high) to bottom (low)."""
+    w = np.log1p(counts.astype(np.float64))
+    peak = w.max()
+    if peak > 0:
+        w /= peak
+    colours = CLASS_COLOURS[np.arange(len(counts)) % len(CLASS_COLOURS)]
+    total = w.sum(axis=0)
+    mix = np.einsum("kxy,kc->xyc", w, colours) / np.where(total > 0, total, 1.0)[..., None]
+    alpha = w.max(axis=0)[..., None]
+    img = alpha * mix + (1.0 - alpha)
+    # counts are [x bin, y bin]; images are [row, col] with the y axis pointing up
+    return np.transpose(img, (1, 0, 2))[::-1]
+
+def write_png(path: Path, img: np.ndarray, scale: int = 1):
+    """Minimal RGB PNG writer (no matplotlib or Pillow needed)."""
+    px = np.clip(np.round(img * 255), 0, 255).astype(np.uint8)
+    if scale > 1:
+        px = px.repeat(scale, axis=0).repeat(scale, axis=1)
+    h, w, _ = px.shape
+    raw = np.concatenate([np.zeros((h, 1), dtype=np.uint8), px.reshape(h, w * 3)], axis=1).tobytes()
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
+
+def render(grid: DensityGrid, p: int, pcs: list, names: list, path: Path, plt=None):
+    i, j = grid.pairs[p]
+    img = composite(grid.counts[p])
+    if plt is None:
+        write_png(path, img, scale=max(1, 512 // grid.bins))
+        return
+    x, y = grid.edges(i), grid.edges(j)
+    fig, ax = plt.subplots(figsize=(6, 5))
+    ax.imshow(img, extent=(x[0], x[-1], y[0], y[-1]), aspect="auto", interpolation="nearest")
+    for k, name in enumerate(names):
+        n = int(grid.counts[p, k].sum())
+        if n:
+            ax.scatter([], [], color=CLASS_COLOURS[k % len(CLASS_COLOURS)], label=f"{name} ({n:,})")
+    ax.set_xlabel(pcs[i])
+    ax.set_ylabel(pcs[j])
+    ax.set_title(f"PCA density {pcs[i]} vs {pcs[j]}")
+    ax.legend(title="Class", bbox_to_anchor=(1.02, 1), loc="upper left")
+    ax.grid(True, linestyle=":", linewidth=0.5)
+    fig.tight_layout()
+    fig.savefig(path, dpi=200)
+    plt.close(fig)
+
+def main(src: Path, out_dir: Path, n_pcs: int = 2, bins: int = 200, chunk_rows: int = 500000,
+         clip: float = 4.0, ranges: np.ndarray = None, images: bool = True):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    pcs, labeled = score_columns(src, n_pcs)
+    pairs = list(itertools.combinations(range(len(pcs)), 2))
+    start = time.time()
+    if ranges is None:
+        ranges = score_range(src, pcs, chunk_rows, clip)
+    names = [LABEL_NAMES[k] for k in sorted(LABEL_NAMES)] if labeled else ["all"]
+    grid = DensityGrid(np.asarray(ranges, dtype=np.float64), pairs, len(names), bins)
+
+    n_rows = skipped = 0
+    for chunk in read_chunks(src, pcs + ([LABEL_COL] if labeled else []), chunk_rows):
+        X = chunk[pcs].to_numpy(dtype=np.float64)
+        y = chunk[LABEL_COL].to_numpy(dtype=np.float64) if labeled else np.zeros(len(chunk))
+        ok = np.isfinite(X).all(axis=1) & (y >= 0) & (y < len(names))
+        skipped += int((~ok).sum())
+        grid.update(X[ok], y[ok].astype(np.int64))
+        n_rows += int(ok.sum())
+    binned = time.time() - start
+
+    np.savez(out_dir / "pca_density.npz", counts=grid.counts, ranges=grid.ranges, pairs=np.array(pairs),
+             pcs=np.array(pcs), classes=np.array(names))
+    print(f"[OK] Binned {n_rows:,} rows into {len(pairs)} PC pair(s) x {len(names)} classes x {bins}x{bins} "
+          f"in {binned:.2f}s")
+    if skipped:
+        print(f"[INFO] Skipped {skipped} rows with non-finite scores or unknown labels")
+    if grid.outside:
+        print(f"[INFO] {grid.outside:,} rows fell outside the plotting range and were drawn on the edge bins")
+    print(f"[OK] Counts: {out_dir / 'pca_density.npz'}")
+
+    if images:
+        try:
+            import matplotlib
+            matplotlib.use("Agg")
+            import matplotlib.pyplot as plt
+        except ImportError:
+            plt = None
+            print("[WARN] matplotlib not installed; writing plain PNG density images without axes",
+                  file=sys.stderr)
+        start = time.time()
+        for p, (i, j) in enumerate(pairs):
+            path = out_dir / f"pca_density_{pcs[i].lower()}_{pcs[j].lower()}.png"
+            render(grid, p, pcs, names, path, plt)
+            print(f"[OK] Wrote: {path}")
+        print(f"[INFO] Rendered {len(pairs)} image(s) in {time.time() - start:.2f}s")
+    return grid
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Per-class 2D density images of PC scores (scatter replacement)")
+    p.add_argument("--src", required=True, type=str, help="PC score CSV from stream_pca.py (PC1, PC2, ..., target)")
+    p.add_argument("--out_dir", required=True, type=str, help="Output folder")
+    p.add_argument("--pcs", type=int, default=2, help="Use the first N PCs; every pair among them is drawn")
+    p.add_argument("--bins", type=int, default=200, help="Bins per axis")
+    p.add_argument("--chunk_rows", type=int, default=500000, help="Rows read per chunk")
+    p.add_argument("--clip", type=float, default=4.0,
+                   help="Plotting range is mean +/- clip standard deviations per PC (within the observed min/max)")
+    p.add_argument("--range", type=str, default=None,
+                   help="Fixed range 'lo:hi' per PC, comma separated (e.g. -5:5,-3:3); skips the range pass")
+    p.add_argument("--no_images", action="store_true", help="Only write the counts")
+    args = p.parse_args()
+    ranges = None
+    if args.range:
+        ranges = np.array([[float(v) for v in r.split(":")] for r in args.range.split(",")])
+        args.pcs = len(ranges)
+    main(Path(args.src), Path(args.out_dir), args.pcs, args.bins, args.chunk_rows, args.clip, ranges,
+         not args.no_images)
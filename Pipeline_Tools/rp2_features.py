@@ -0,0 +1,119 @@
+# rp2_features.py
+# Purpose: Build the ReducedPlus2 (RP2) feature set from the Step-5 wide feature table.
+# Same features as build_rp2 in the Approach_3 notebook, computed for all cycles at once
+# from the S*_H*_log_mean_rel block reshaped to (cycles, sensors, steps).
+
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import re
+import numpy as np
+
+import dtype_schema
+
+ID_COLS = ["group_id","spice","target"]
+CTX_COLS = ["temp_mean","rh_mean","pressure_mean"]
+SENSOR_PAIRS = [(0,1), (2,3), (4,5), (6,7)]
+NUM_STEPS = 10  # heater steps 0..9; step 0 is the baseline
+EPS = 1e-6
+
+REL_PAT = re.compile(r"^S(\d+)_H(\d+)_log_mean_rel$")
+
+def collect_rel_cols(columns) -> dict:
+    # returns: {sensor_idx: [(step, colname), ...]} sorted by step, sensors in column order
+    per_sensor = {}
+    for c in columns:
+        m = REL_PAT.match(c)
+        if m:
+            s = int(m.group(1)); h = int(m.group(2))
+            per_sensor.setdefault(s, []).append((h, c))
+    for s in per_sensor:
+        per_sensor[s] = sorted(per_sensor[s], key=lambda x: x[0])
+    return per_sensor
+
+def source_columns(columns) -> list:
+    """Columns of the wide table that RP2 reads (IDs, context, log_mean_rel block)."""
+    return [c for c in columns if c in ID_COLS or c in CTX_COLS or REL_PAT.match(c)]
+
+def rel_block(df: pd.DataFrame, per_sensor: dict) -> np.ndarray:
+    """Return log_mean_rel values as (cycles, sensors, steps); missing steps are 0.0."""
+    sensors = list(per_sensor)
+    block = np.zeros((len(df), len(sensors), NUM_STEPS), dtype=float)
+    for j, s in enumerate(sensors):
+        for h, c in per_sensor[s]:
+            if h < NUM_STEPS:
+                block[:, j, h] = df[c].to_numpy(dtype=float)
+    return block
+
+def rp2_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Compute the RP2 feature frame (ID columns first) for every row of a wide table."""
+    import pandas as pd
+    per_sensor = collect_rel_cols(df.columns)
+    sensors = list(per_sensor)
+    v = rel_block(df, per_sensor)
+
+    # Segment summaries over heater steps, excluding the step-0 baseline
+    early = (v[:, :, 1] + v[:, :, 2] + v[:, :, 3]) / 3.0
+    mid   = (v[:, :, 4] + v[:, :, 5] + v[:, :, 6]) / 3.0
+    tail  = (v[:, :, 7] + v[:, :, 8] + v[:, :, 9]) / 3.0
+    early_max = np.max(v[:, :, 1:4], axis=2)
+    peak_step = (np.argmax(v[:, :, 1:10], axis=2) + 1).astype(float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        decay_ratio = mid / (early + EPS)
+        tail_ratio  = tail / (early + EPS)
+    early_slope = (v[:, :, 3] - v[:, :, 1]) / 2.0
+    mid_slope   = (v[:, :, 6] - v[:, :, 4]) / 2.0
+    tail_slope  = (v[:, :, 9] - v[:, :, 7]) / 2.0
+
+    feats = {}
+    for c in CTX_COLS:
+        if c in df.columns:
+            feats[c] = df[c].to_numpy()
+    for j, s in enumerate(sensors):
+        feats[f"S{s}_early_mean_rel"] = early[:, j]
+        feats[f"S{s}_mid_mean_rel"]   = mid[:, j]
+        feats[f"S{s}_tail_mean_rel"]  = tail[:, j]
+        feats[f"S{s}_early_max_rel"]  = early_max[:, j]
+        feats[f"S{s}_peak_step"]      = peak_step[:, j]
+        feats[f"S{s}_decay_ratio"]    = decay_ratio[:, j]
+        feats[f"S{s}_tail_ratio"]     = tail_ratio[:, j]
+        feats[f"S{s}_early_slope"]    = early_slope[:, j]
+        feats[f"S{s}_mid_slope"]      = mid_slope[:, j]
+        feats[f"S{s}_tail_slope"]     = tail_slope[:, j]
+
+    # sensor-pair early ratios (if both sensors exist)
+    pos = {s: j for j, s in enumerate(sensors)}
+    for a, b in SENSOR_PAIRS:
+        if a in pos and b in pos:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                feats[f"S{a}S{b}_early_ratio"] = early[:, pos[a]] / (early[:, pos[b]] + EPS)
+
+    out = pd.DataFrame(feats, index=df.index)
+    out = pd.concat([df[ID_COLS], out], axis=1).reset_index(drop=True)
+
+    # enforce numeric on features
+    for c in out.columns:
+        if c in ID_COLS:
+            continue
+        out[c] = pd.to_numeric(out[c], errors="coerce")
+    return out
+
+def build_rp2(src_csv, dst_csv):
+    import pandas as pd
+    # Read only the columns RP2 needs instead of the full wide table
+    header = pd.read_csv(src_csv, nrows=0).columns
+    df = dtype_schema.read_csv(src_csv, usecols=source_columns(header))
+    df = df[source_columns(header)]
+    out = rp2_frame(df)
+    out.to_csv(dst_csv, index=False)
+    print(f"[OK] Wrote RP2: {dst_csv} | feature cols = {out.shape[1]-len(ID_COLS)}")
+    return out
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Build ReducedPlus2 (RP2) features from a Step-5 wide feature table")
+    p.add_argument("--src", required=True, type=str, help="Path to Step-5 features CSV (train or test)")
+    p.add_argument("--dst", required=True, type=str, help="Output CSV path, e.g. train_reduced_plus2.csv")
+    args = p.parse_args()
+    Path(args.dst).parent.mkdir(parents=True, exist_ok=True)
+    build_rp2(Path(args.src), Path(args.dst))
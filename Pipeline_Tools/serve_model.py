@@ -0,0 +1,308 @@
+# serve_model.py
+# Purpose: Long-running classification service for live BME688 rows (e.g. forwarded by the ESP32).
+# The persisted model is loaded and warmed up once. Concurrent requests are queued and scored
+# together in micro-batches (one predict_proba call per batch), and the answer is the spice
+# prediction with class probabilities per row. Serves JSON over HTTP (POST /predict,
+# GET /health) or newline-delimited JSON over a Unix socket.
+#
+# Example:
+#   python serve_model.py --model outputs/GradientBoosting/gb_model.joblib --port 8765
+#   python serve_model.py --model outputs/RandomForest/rf_model.joblib --unix /tmp/enose.sock
+#   python serve_model.py --model rf_model.mmodel --workers 4      # array artifact, shared by all workers
+#   curl -s localhost:8765/predict -d '{"rows": [{"sensor_index": 0, "heater_profile_step_index": 3,
+#        "resistance_gassensor": 41234.5, "temperature": 24.1, "pressure": 1012.3, "humidity": 45.2}]}'
+
+from pathlib import Path
+import argparse
+import json
+import os
+import queue
+import signal
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+LABEL_MAP = {"Anise": 0, "Chilli": 1, "Cinnamon": 2, "Nutmeg": 3}
+FEATURES = ["resistance_gassensor", "pressure", "temperature", "relative_humidity"]
+ROW_KEYS = ["sensor_index", "heater_profile_step_index"]
+ALIASES = {"humidity": "relative_humidity", "resistance": "resistance_gassensor"}
+
+def load_model(path: Path):
+    """Return an object with predict (and ideally predict_proba) taking an (n, features) array."""
+    path = Path(path)
+    if path.is_dir():
+        # Array artifact (model_artifact.py): memory-mapped, so forked workers share the pages
+        import model_artifact
+        return model_artifact.load(path)
+    if path.suffix == ".keras":
+        from tensorflow import keras
+        net = keras.models.load_model(path)
+        n_features = net.input_shape[1]
+
+        class _Keras:
+            def predict_proba(self, X):
+                return net.predict(np.asarray(X, dtype=np.float32).reshape(-1, n_features, 1), verbose=0)
+
+            def predict(self, X):
+                return np.argmax(self.predict_proba(X), axis=1)
+        return _Keras()
+
+    if path.suffix == ".npz":
+        # Flat tree export (tree_export.py): NumPy-only, no per-call thread start-up
+        from tree_export import FlatForest
+        return FlatForest.load(path)
+
+    import joblib
+    model = joblib.load(path)
+    # Single-threaded scoring: joblib/OpenMP start-up per call costs more than it saves on small batches
+    inner = getattr(model, "model", model)
+    if hasattr(inner, "n_jobs"):
+        inner.n_jobs = 1
+    return model
+
+def features_for(model_path: Path, override: list = None) -> list:
+    """Feature order the model was trained on: --features, else the notebook metrics JSON, else all four.
+    Exported models (.npz, artifact folders) carry their own order in model.meta["features"]."""
+    if override:
+        return override
+    metrics = Path(str(model_path).rsplit("_model", 1)[0] + "_metrics.json")
+    if metrics.exists():
+        feature = json.loads(metrics.read_text()).get("feature")
+        if feature:
+            return feature.split(",")
+    return FEATURES
+
+class MicroBatcher:
+    """Collects rows from concurrent callers and scores them in one call per batch."""
+
+    def __init__(self, model, features: list, max_batch: int = 1024, max_wait_ms: float = 1.0):
+        self.model = model
+        self.features = features
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.inbox = queue.Queue()
+        self.batch_ms = deque(maxlen=2000)
+        self.n_rows = 0
+        self.names = {v: k for k, v in LABEL_MAP.items()}
+        self.has_proba = hasattr(model, "predict_proba")
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def to_matrix(self, rows: list) -> np.ndarray:
+        """Feature matrix of one request; malformed rows are rejected here (HTTP 400), so they
+        never reach a batch shared with other callers."""
+        if not isinstance(rows, list) or not rows:
+            raise ValueError("Expected a non-empty list of rows")
+        X = np.empty((len(rows), len(self.features)), dtype=np.float64)
+        for i, r in enumerate(rows):
+            if not isinstance(r, dict):
+                raise ValueError(f"Row {i} is not an object")
+            r = {ALIASES.get(k, k): v for k, v in r.items()}
+            try:
+                X[i] = [float(r[c]) for c in self.features]
+            except KeyError as e:
+                raise ValueError(f"Row {i} is missing field {e.args[0]}")
+            except (TypeError, ValueError):
+                raise ValueError(f"Row {i} has a non-numeric feature value")
+            if not np.isfinite(X[i]).all():
+                raise ValueError(f"Row {i} has a non-finite feature value")
+        return X
+
+    def submit(self, rows: list) -> Future:
+        fut = Future()
+        self.inbox.put((self.to_matrix(rows), rows, fut))
+        return fut
+
+    def _loop(self):
+        while True:
+            pending = [self.inbox.get()]
+            size = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                left = deadline - time.perf_counter()
+                if left <= 0:
+                    break
+                try:
+                    item = self.inbox.get(timeout=left)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            self._score(pending)
+
+    def _predict(self, X: np.ndarray) -> tuple:
+        """(pred, proba, classes) for a matrix; proba and classes are None without predict_proba."""
+        if self.has_proba:
+            proba = np.asarray(self.model.predict_proba(X))
+            classes = np.asarray(getattr(self.model, "classes_", np.arange(proba.shape[1])))
+            return classes[np.argmax(proba, axis=1)], proba, classes
+        return np.asarray(self.model.predict(X)), None, None
+
+    def _score(self, pending: list):
+        start = time.perf_counter()
+        X = np.vstack([p[0] for p in pending])
+        try:
+            pred, proba, classes = self._predict(X)
+        except Exception as e:
+            if len(pending) == 1:
+                pending[0][2].set_exception(e)
+                return
+            # One request's rows broke the batch: score each request alone so the others still get answers
+            for item in pending:
+                self._score([item])
+            return
+        self.batch_ms.append(1000.0 * (time.perf_counter() - start))
+        self.n_rows += len(X)
+
+        offset = 0
+        for Xp, rows, fut in pending:
+            out = []
+            for j, r in enumerate(rows):
+                i = offset + j
+                item = {k: r[k] for k in ROW_KEYS if k in r}
+                item.update({"target": int(pred[i]), "spice": self.names.get(int(pred[i]), str(pred[i]))})
+                if proba is not None:
+                    item["probabilities"] = {self.names.get(int(c), str(c)): round(float(p), 6)
+                                             for c, p in zip(classes, proba[i])}
+                out.append(item)
+            offset += len(Xp)
+            fut.set_result(out)
+
+    def stats(self) -> dict:
+        lat = np.asarray(self.batch_ms) if self.batch_ms else np.zeros(1)
+        return {"rows_scored": self.n_rows, "batches": len(self.batch_ms),
+                "batch_ms_p50": round(float(np.percentile(lat, 50)), 3),
+                "batch_ms_p99": round(float(np.percentile(lat, 99)), 3)}
+
+def handle_payload(batcher: MicroBatcher, payload) -> dict:
+    """A single row object, {"rows": [...]}, or a bare list of row objects."""
+    rows = payload.get("rows", [payload]) if isinstance(payload, dict) else payload
+    start = time.perf_counter()
+    preds = batcher.submit(rows).result()
+    return {"predictions": preds, "latency_ms": round(1000.0 * (time.perf_counter() - start), 3)}
+
+def make_http_handler(batcher: MicroBatcher, info: dict):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, code: int, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, dict(info, **batcher.stats()))
+            else:
+                self._send(404, {"error": "use POST /predict or GET /health"})
+
+        def do_POST(self):
+            if self.path != "/predict":
+                self._send(404, {"error": "use POST /predict"})
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                self._send(200, handle_payload(batcher, payload))
+            except (ValueError, TypeError) as e:
+                self._send(400, {"error": str(e)})
+            except Exception as e:
+                self._send(500, {"error": str(e)})
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def make_unix_handler(batcher: MicroBatcher):
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            # One JSON request per line, one JSON answer per line
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    out = handle_payload(batcher, json.loads(line))
+                except Exception as e:
+                    out = {"error": str(e)}
+                self.wfile.write((json.dumps(out) + "\n").encode())
+                self.wfile.flush()
+    return Handler
+
+def start_worker(model_path: Path, features: list, max_batch: int, max_wait_ms: float):
+    """Load and warm up the model in this process. Returns (batcher, info)."""
+    start = time.time()
+    model = load_model(model_path)
+    features = features or getattr(model, "meta", {}).get("features") or features_for(model_path)
+    batcher = MicroBatcher(model, features, max_batch, max_wait_ms)
+    # Warm-up so the first live request does not pay for lazy initialisation
+    batcher.submit([{c: 0.0 for c in features}] * 8).result()
+    info = {"model": str(model_path), "features": features, "load_sec": round(time.time() - start, 3),
+            "pid": os.getpid()}
+    print(f"[OK] Loaded {model_path.name} in {info['load_sec']}s (pid {info['pid']}) | features: {features}")
+    return batcher, info
+
+def _raise_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+def main(model_path: Path, features: list = None, host: str = "127.0.0.1", port: int = 8765,
+         unix: str = None, max_batch: int = 1024, max_wait_ms: float = 1.0, workers: int = 1):
+    # Bind first, then fork: every worker accepts on the same socket and loads the model itself.
+    # With an array artifact the loads are memory maps, so the workers share one copy.
+    if unix:
+        if os.path.exists(unix):
+            os.unlink(unix)
+        server = socketserver.ThreadingUnixStreamServer(unix, None)
+        where = f"unix:{unix}"
+    else:
+        server = ThreadingHTTPServer((host, port), None)
+        where = f"http://{host}:{port}  (POST /predict, GET /health)"
+    server.daemon_threads = True
+
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = []
+            break
+        children.append(pid)
+
+    if children:
+        # A service manager stops the parent with SIGTERM; shut down (and reap workers) as on Ctrl-C
+        signal.signal(signal.SIGTERM, _raise_interrupt)
+    batcher, info = start_worker(model_path, features, max_batch, max_wait_ms)
+    server.RequestHandlerClass = make_unix_handler(batcher) if unix else make_http_handler(batcher, info)
+    if children or workers == 1:
+        print(f"[OK] Listening on {where} with {workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n[INFO] Stopped pid {os.getpid()} | {batcher.stats()}")
+    finally:
+        server.server_close()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Serve a trained model for live BME688 rows with micro-batching")
+    p.add_argument("--model", required=True, type=str, help="Persisted model (.joblib, .keras, a tree_export.py .npz or a model_artifact.py folder)")
+    p.add_argument("--features", type=str, default=None,
+                   help="Comma list of feature columns (default: from <prefix>_metrics.json, else all four)")
+    p.add_argument("--host", type=str, default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--unix", type=str, default=None, help="Serve newline-delimited JSON on this Unix socket instead")
+    p.add_argument("--max_batch", type=int, default=1024, help="Most rows scored in one call")
+    p.add_argument("--max_wait_ms", type=float, default=1.0, help="How long a batch waits for more requests")
+    p.add_argument("--workers", type=int, default=1,
+                   help="Forked processes accepting on the same socket (share pages with an array artifact)")
+    args = p.parse_args()
+    main(Path(args.model), args.features.split(",") if args.features else None, args.host, args.port,
+         args.unix, args.max_batch, args.max_wait_ms, args.workers)
@@ -0,0 +1,114 @@
+# startup_bench.py
+# Purpose: Measure the cold-start cost of every command-line entry point in the repo.
+# Each script runs with --help (or a custom argument list) in a fresh interpreter, several
+# times, and the fastest wall time is reported. `-X importtime` shows which heavy libraries
+# (pandas, NumPy, scikit-learn, XGBoost, TensorFlow, ...) were imported before the script did any
+# work. Pass an earlier report as --baseline to print the speed-up per script.
+#
+# Example:
+#   python startup_bench.py --out startup_report.csv
+#   python startup_bench.py --scripts serve_model.py,train_models.py --repeat 5 --baseline startup_before.csv
+
+from pathlib import Path
+import argparse
+import csv
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+HEAVY = ["pandas", "numpy", "scipy", "sklearn", "xgboost", "tensorflow", "keras", "joblib", "threadpoolctl"]
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+def entry_points(root: Path) -> list:
+    """Every .py file under root that parses command-line arguments when run as a script."""
+    found = []
+    for path in sorted(root.rglob("*.py")):
+        if any(part.startswith(".") or part == "__pycache__" for part in path.parts):
+            continue
+        text = path.read_text(errors="ignore")
+        if "__main__" in text and "argparse" in text:
+            found.append(path)
+    return found
+
+def heavy_imports(stderr: str) -> dict:
+    """Heavy packages imported by the run (directly or through other modules) -> cumulative ms."""
+    out = {}
+    for line in stderr.splitlines():
+        m = IMPORT_LINE.match(line)
+        if m and m.group(3) in HEAVY:
+            out[m.group(3)] = int(m.group(2)) / 1000.0
+    return out
+
+def time_script(path: Path, args: list, repeat: int) -> dict:
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, path.name] + args, cwd=path.parent,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        walls.append(time.perf_counter() - start)
+    traced = subprocess.run([sys.executable, "-X", "importtime", path.name] + args, cwd=path.parent,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    heavy = heavy_imports(traced.stderr)
+    return {
+        "script": str(path.relative_to(REPO_ROOT)),
+        "min_sec": round(min(walls), 4),
+        "median_sec": round(statistics.median(walls), 4),
+        "heavy_imports": " ".join(f"{k}:{v:.0f}ms" for k, v in sorted(heavy.items(), key=lambda kv: -kv[1])),
+        "exit_code": traced.returncode,
+    }
+
+def main(scripts: list, args: list, repeat: int, out_path: Path = None, baseline: Path = None):
+    # Reference point: the bare interpreter start-up every entry point pays anyway
+    bare = min(_bare_start() for _ in range(repeat))
+    print(f"[INFO] Bare interpreter: {bare:.3f}s | {len(scripts)} entry points x {repeat} runs")
+
+    before = {}
+    if baseline is not None:
+        with open(baseline, newline="") as f:
+            before = {r["script"]: float(r["min_sec"]) for r in csv.DictReader(f)}
+
+    rows = []
+    for path in scripts:
+        r = time_script(path, args, repeat)
+        if r["script"] in before:
+            r["baseline_sec"] = before[r["script"]]
+            r["speedup"] = round(before[r["script"]] / max(r["min_sec"], 1e-9), 2)
+        rows.append(r)
+        extra = f" | was {r['baseline_sec']:.3f}s ({r['speedup']}x)" if "speedup" in r else ""
+        print(f"[OK] {r['min_sec']:.3f}s  {r['script']}{extra}  [{r['heavy_imports'] or 'no heavy imports'}]")
+        if r["exit_code"] != 0:
+            print(f"[WARN] {r['script']} exited with code {r['exit_code']}", file=sys.stderr)
+
+    if out_path is not None:
+        cols = ["script", "min_sec", "median_sec", "baseline_sec", "speedup", "heavy_imports", "exit_code"]
+        with open(out_path, "w", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=cols)
+            w.writeheader()
+            w.writerows(rows)
+        print(f"[OK] Report: {out_path}")
+    return rows
+
+def _bare_start() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Cold-start time of each command-line entry point")
+    p.add_argument("--scripts", type=str, default=None,
+                   help="Comma list of scripts (paths relative to the repo root or this folder; default: all)")
+    p.add_argument("--args", type=str, default="--help", help="Arguments passed to every script")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per script; the fastest is reported")
+    p.add_argument("--out", type=str, default=None, help="Write the CSV report here")
+    p.add_argument("--baseline", type=str, default=None, help="Earlier report to compare against")
+    args = p.parse_args()
+    if args.scripts:
+        here = Path(__file__).resolve().parent
+        scripts = [(here / s if (here / s).exists() else REPO_ROOT / s).resolve() for s in args.scripts.split(",")]
+    else:
+        scripts = entry_points(REPO_ROOT)
+    main(scripts, args.args.split(), args.repeat, Path(args.out) if args.out else None,
+         Path(args.baseline) if args.baseline else None)
@@ -0,0 +1,267 @@
+# stream_pca.py
+# Purpose: Out-of-core PCA for the raw-data projection (PCA_Raw_Data.ipynb) and the per-cycle wide tables.
+# The labeled CSV is streamed in chunks. The first pass accumulates means and the co-moment
+# matrix (merged per chunk), which gives the StandardScaler and an exact PCA of the standardised
+# data in one pass. For very wide inputs it instead fits an IncrementalPCA chunk by chunk. The fitted
+# transform is saved as pca_transform.npz and reused with --transform. A final pass writes the
+# PC scores per row. Memory depends on the chunk size and the column count, not on the row count.
+# Outputs follow the notebook: per_class_stats.csv, pca_loadings.csv and pca_explained_variance.csv.
+#
+# Example:
+#   python stream_pca.py --src master_training_labeled.csv --out_dir pca_outputs
+#   python stream_pca.py --src train_features.csv --wide --n_components 10 --nan zero --out_dir pca_wide
+#   python stream_pca.py --src new_sessions.csv --transform pca_outputs/pca_transform.npz --out_dir pca_new
+
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+FEATURES = ["temperature", "pressure", "relative_humidity", "resistance_gassensor"]
+LABEL_COL = "target"
+LABEL_NAMES = {0: "Anise", 1: "Chilli", 2: "Cinnamon", 3: "Nutmeg"}
+ID_COLS = ["group_id", "spice", "target"]
+KEEP_COLS = ["group_id", "spice", "target", "sensor_index", "heater_profile_step_index", "scanning_cycle_index"]
+COVARIANCE_MAX_FEATURES = 4096   # above this the F x F co-moment matrix gets too large; use IncrementalPCA
+
+class Moments:
+    """Streaming mean and co-moment (full matrix, or diagonal only), merged chunk by chunk."""
+
+    def __init__(self, n_features: int, full: bool = True):
+        self.n = 0
+        self.mean = np.zeros(n_features)
+        self.m2 = np.zeros((n_features, n_features) if full else n_features)
+        self.full = full
+
+    def update(self, X: np.ndarray):
+        nb = len(X)
+        if nb == 0:
+            return
+        mb = X.mean(axis=0)
+        Xc = X - mb
+        cb = Xc.T @ Xc if self.full else (Xc * Xc).sum(axis=0)
+        delta = mb - self.mean
+        n_new = self.n + nb
+        corr = np.outer(delta, delta) if self.full else delta * delta
+        self.m2 += cb + corr * (self.n * nb / n_new)
+        self.mean += delta * (nb / n_new)
+        self.n = n_new
+
+    def var(self, ddof: int = 0) -> np.ndarray:
+        m2 = np.diag(self.m2) if self.full else self.m2
+        return m2 / max(self.n - ddof, 1)
+
+class PCATransform:
+    """Standardise with the stored scaler, then project on the stored components."""
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.mean = arrays["mean"]
+        self.scale = arrays["scale"]
+        self.components = arrays["components"]
+        self.explained_variance = arrays["explained_variance"]
+        self.explained_variance_ratio = arrays["explained_variance_ratio"]
+        self.meta = meta
+        self.features = meta["features"]
+
+    def transform(self, X) -> np.ndarray:
+        return ((np.asarray(X, dtype=np.float64) - self.mean) / self.scale) @ self.components.T
+
+    def save(self, path: Path):
+        np.savez(path, meta=np.frombuffer(json.dumps(self.meta).encode(), dtype=np.uint8),
+                 mean=self.mean, scale=self.scale, components=self.components,
+                 explained_variance=self.explained_variance, explained_variance_ratio=self.explained_variance_ratio)
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as z:
+            meta = json.loads(bytes(z["meta"]).decode())
+            arrays = {k: z[k] for k in z.files if k != "meta"}
+        return cls(arrays, meta)
+
+def _scale_from_var(var: np.ndarray) -> np.ndarray:
+    # Same rule as StandardScaler: constant columns keep scale 1
+    scale = np.sqrt(var)
+    scale[scale < 10 * np.finfo(np.float64).eps] = 1.0
+    return scale
+
+def _flip_signs(components: np.ndarray) -> np.ndarray:
+    # Same sign convention as sklearn's PCA: the largest-magnitude loading of each component is positive
+    idx = np.argmax(np.abs(components), axis=1)
+    signs = np.sign(components[np.arange(len(components)), idx])
+    signs[signs == 0] = 1.0
+    return components * signs[:, None]
+
+def read_chunks(src: Path, columns: list, chunk_rows: int):
+    import pandas as pd
+    yield from pd.read_csv(src, usecols=columns, chunksize=chunk_rows)
+
+def clean(chunk, features: list, nan: str):
+    """(X, kept chunk rows): non-finite feature values are dropped (notebook rule) or set to zero."""
+    X = chunk[features].to_numpy(dtype=np.float64)
+    finite = np.isfinite(X)
+    if nan == "zero":
+        X[~finite] = 0.0
+        return X, chunk
+    ok = finite.all(axis=1)
+    if LABEL_COL in chunk.columns:
+        ok &= chunk[LABEL_COL].notna().to_numpy()
+    if ok.all():
+        return X, chunk
+    return X[ok], chunk[ok]
+
+def fit(src: Path, features: list, n_components: int, chunk_rows: int, method: str, nan: str):
+    """Streaming fit. Returns (PCATransform, per-class Moments dict, rows dropped)."""
+    label = [LABEL_COL] if LABEL_COL in _header(src) else []
+    full = Moments(len(features), full=(method == "covariance"))
+    per_class, dropped = {}, 0
+    for chunk in read_chunks(src, features + label, chunk_rows):
+        X, kept = clean(chunk, features, nan)
+        dropped += len(chunk) - len(X)
+        full.update(X)
+        if label:
+            y = kept[LABEL_COL].to_numpy(dtype=np.int64)
+            for lab in np.unique(y):
+                per_class.setdefault(int(lab), Moments(len(features), full=False)).update(X[y == lab])
+    if full.n < 2:
+        raise ValueError(f"Only {full.n} usable rows in {src.name}")
+    mean, scale = full.mean.copy(), _scale_from_var(full.var(ddof=0))
+
+    if method == "covariance":
+        cov = full.m2 / (full.n - 1) / np.outer(scale, scale)
+        eigval, eigvec = np.linalg.eigh(cov)
+        order = np.argsort(eigval)[::-1]
+        eigval, eigvec = np.clip(eigval[order], 0.0, None), eigvec[:, order]
+        components = _flip_signs(eigvec[:, :n_components].T)
+        explained = eigval[:n_components]
+        ratio = explained / eigval.sum()
+    else:
+        from sklearn.decomposition import IncrementalPCA
+        ipca = IncrementalPCA(n_components=n_components)
+        carry = np.empty((0, len(features)))
+        for chunk in read_chunks(src, features + label, chunk_rows):
+            X, _ = clean(chunk, features, nan)
+            # IncrementalPCA needs at least n_components rows per batch; short chunks wait for the next
+            carry = np.vstack([carry, (X - mean) / scale])
+            if len(carry) >= max(n_components, 1):
+                ipca.partial_fit(carry)
+                carry = carry[:0]
+        if len(carry):
+            if len(carry) >= n_components:
+                ipca.partial_fit(carry)
+            else:
+                print(f"[WARN] Last {len(carry)} rows skipped by IncrementalPCA (fewer than n_components)",
+                      file=sys.stderr)
+        components = _flip_signs(ipca.components_)
+        explained = ipca.explained_variance_
+        ratio = ipca.explained_variance_ratio_
+
+    meta = {"features": features, "n_samples": int(full.n), "n_components": int(n_components),
+            "method": method, "source": str(src), "nan": nan}
+    arrays = {"mean": mean, "scale": scale, "components": components,
+              "explained_variance": np.asarray(explained, dtype=np.float64),
+              "explained_variance_ratio": np.asarray(ratio, dtype=np.float64)}
+    return PCATransform(arrays, meta), per_class, dropped
+
+def _header(src: Path) -> list:
+    import pandas as pd
+    return list(pd.read_csv(src, nrows=0).columns)
+
+def wide_features(src: Path) -> list:
+    """Every numeric column except the IDs (for the Step-5 per-cycle tables)."""
+    import pandas as pd
+    sample = pd.read_csv(src, nrows=200)
+    return [c for c in sample.columns if c not in ID_COLS and pd.api.types.is_numeric_dtype(sample[c])]
+
+def write_scores(src: Path, tf: PCATransform, out_path: Path, chunk_rows: int, nan: str) -> int:
+    """Project every row and append PC scores (with the ID columns) to out_path. Returns rows written."""
+    header = _header(src)
+    keep = [c for c in KEEP_COLS if c in header and c not in tf.features]
+    pcs = [f"PC{i + 1}" for i in range(len(tf.components))]
+    n = 0
+    with open(out_path, "w", newline="") as f:
+        for chunk in read_chunks(src, tf.features + keep, chunk_rows):
+            X, kept = clean(chunk, tf.features, nan)
+            out = kept[keep].reset_index(drop=True)
+            scores = tf.transform(X)
+            for i, c in enumerate(pcs):
+                out[c] = scores[:, i]
+            out.to_csv(f, header=(n == 0), index=False, float_format="%.8g")
+            n += len(out)
+    return n
+
+def main(src: Path, out_dir: Path, features: list = None, wide: bool = False, n_components: int = 3,
+         chunk_rows: int = 100000, method: str = "auto", nan: str = "drop", transform: Path = None,
+         scores: bool = True):
+    import pandas as pd
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    start = time.time()
+    header = _header(src)
+    if transform is not None:
+        tf = PCATransform.load(transform)
+        nan = tf.meta.get("nan", nan)
+        missing = [c for c in tf.features if c not in header]
+        if missing:
+            raise ValueError(f"{src.name} is missing columns used by the transform: {missing[:10]}")
+        print(f"[INFO] Using saved transform {transform} ({len(tf.features)} features, {len(tf.components)} PCs)")
+    else:
+        features = features or (wide_features(src) if wide else FEATURES)
+        missing = [c for c in features if c not in header]
+        if missing:
+            raise ValueError(f"Missing required columns: {missing[:10]}")
+        n_components = min(n_components, len(features))
+        if method == "auto":
+            method = "covariance" if len(features) <= COVARIANCE_MAX_FEATURES else "incremental"
+        tf, per_class, dropped = fit(src, features, n_components, chunk_rows, method, nan)
+        if dropped:
+            print(f"Dropped {dropped} rows due to missing or non-finite values.")
+            if dropped > tf.meta["n_samples"]:
+                print("[WARN] Most rows were dropped; wide tables usually need --nan zero", file=sys.stderr)
+        tf.save(out_dir / "pca_transform.npz")
+
+        if per_class:
+            stats = pd.DataFrame(
+                [np.r_[m.mean, np.sqrt(m.var(ddof=0))] for _, m in sorted(per_class.items())],
+                index=pd.Index(sorted(per_class), name=LABEL_COL),
+                columns=[f"mean_{c}" for c in features] + [f"std_{c}" for c in features])
+            stats.to_csv(out_dir / "per_class_stats.csv", index=True)
+        pcs = [f"PC{i + 1}" for i in range(len(tf.components))]
+        pd.DataFrame(tf.components.T, index=features, columns=pcs).to_csv(out_dir / "pca_loadings.csv")
+        pd.DataFrame({"component": pcs, "explained_variance": tf.explained_variance,
+                      "explained_variance_ratio": tf.explained_variance_ratio,
+                      "cumulative_ratio": np.cumsum(tf.explained_variance_ratio)}) \
+            .to_csv(out_dir / "pca_explained_variance.csv", index=False)
+
+        print(f"[OK] Fitted {method} PCA on {tf.meta['n_samples']} rows x {len(features)} features "
+              f"in {time.time() - start:.2f}s")
+        print("Explained variance ratio:")
+        for i, r in enumerate(tf.explained_variance_ratio, start=1):
+            print(f"PC{i}: {r:.4f}")
+        print(f"[OK] Transform: {out_dir / 'pca_transform.npz'}")
+
+    if scores:
+        out_path = out_dir / f"{src.stem}_pca_scores.csv"
+        n = write_scores(src, tf, out_path, chunk_rows, nan)
+        print(f"[OK] Wrote: {out_path}  (rows={n})")
+    return tf
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Streaming StandardScaler + PCA for raw rows or wide per-cycle tables")
+    p.add_argument("--src", required=True, type=str, help="Labeled CSV (master_training_labeled.csv or a Step-5 table)")
+    p.add_argument("--out_dir", required=True, type=str, help="Output folder")
+    p.add_argument("--features", type=str, default=None, help=f"Comma list of columns (default: {','.join(FEATURES)})")
+    p.add_argument("--wide", action="store_true", help="Use every numeric non-ID column (Step-5 wide tables)")
+    p.add_argument("--n_components", type=int, default=3)
+    p.add_argument("--chunk_rows", type=int, default=100000, help="Rows read per chunk")
+    p.add_argument("--method", choices=["auto", "covariance", "incremental"], default="auto",
+                   help="covariance: exact, one pass; incremental: IncrementalPCA for very wide inputs")
+    p.add_argument("--nan", choices=["drop", "zero"], default="drop",
+                   help="Rows with missing/non-finite features are dropped (notebook) or the values set to 0")
+    p.add_argument("--transform", type=str, default=None, help="Project with a saved pca_transform.npz instead of fitting")
+    p.add_argument("--no_scores", action="store_true", help="Only fit and save the transform")
+    args = p.parse_args()
+    main(Path(args.src), Path(args.out_dir), args.features.split(",") if args.features else None, args.wide,
+         args.n_components, args.chunk_rows, args.method, args.nan,
+         Path(args.transform) if args.transform else None, not args.no_scores)
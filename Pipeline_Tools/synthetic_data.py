@@ -0,0 +1,128 @@
+# synthetic_data.py
+# Purpose: Generate BME688-shaped recordings for testing and benchmarking the pipeline.
+# Sessions follow the nested loop used by the DevKit (cycle -> heater step -> sensor),
+# optionally followed by an out-of-pattern tail like the ones left by power-off events.
+
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import numpy as np
+
+LABEL_MAP = {"Anise": 0, "Chilli": 1, "Cinnamon": 2, "Nutmeg": 3}
+
+RAW_COLS = [
+    "sensor_index", "heater_profile_step_index", "scanning_cycle_index",
+    "timestamp_since_poweron", "real_time_clock",
+    "temperature", "pressure", "relative_humidity", "resistance_gassensor",
+    "label_tag", "error_code"
+]
+
+NUM_SENSORS = 8
+NUM_HEATERS = 10
+CYCLES = [1, 2, 3, 4, 5]
+ROWS_PER_BLOCK = NUM_SENSORS * NUM_HEATERS * len(CYCLES)  # 400
+
+def make_session(spice: str, n_blocks: int = 20, seed: int = 0,
+                 messy_tail: int = 0, swaps: int = 0) -> pd.DataFrame:
+    """Build one raw recording session as a DataFrame with the raw DevKit columns."""
+    import pandas as pd
+    rng = np.random.default_rng(seed + 1000 * LABEL_MAP.get(spice, 0))
+    n = n_blocks * ROWS_PER_BLOCK
+
+    # Canonical nested order: cycle (outer) -> heater step -> sensor (inner)
+    pos = np.arange(n)
+    sensor = pos % NUM_SENSORS
+    heater = (pos // NUM_SENSORS) % NUM_HEATERS
+    cycle = np.array(CYCLES)[(pos // (NUM_SENSORS * NUM_HEATERS)) % len(CYCLES)]
+
+    # Spice-specific response per (sensor, heater step) with slow drift over the session
+    label = LABEL_MAP.get(spice, 0)
+    base = 10.0 + 0.15 * sensor + 0.35 * heater + 0.2 * label + 0.05 * np.sin(sensor * (label + 1))
+    drift = np.linspace(0.0, 0.1, n)
+    log_r = base + drift + rng.normal(0.0, 0.05, n)
+
+    ts = np.cumsum(rng.integers(15, 25, n)).astype(np.int64)
+    df = pd.DataFrame({
+        "sensor_index": sensor,
+        "heater_profile_step_index": heater,
+        "scanning_cycle_index": cycle,
+        "timestamp_since_poweron": ts,
+        "real_time_clock": 1_700_000_000 + ts // 1000,
+        "temperature": 24.0 + 0.5 * label + rng.normal(0.0, 0.2, n),
+        "pressure": 1012.0 + 0.3 * label + rng.normal(0.0, 0.1, n),
+        "relative_humidity": 45.0 + 2.0 * label + rng.normal(0.0, 0.5, n),
+        "resistance_gassensor": np.expm1(log_r),
+        "label_tag": label + 1,
+        "error_code": 0,
+    })
+
+    # Out-of-order rows inside the recording (what segmentation repairs)
+    if swaps > 0:
+        order = np.arange(n)
+        for _ in range(swaps):
+            i, j = rng.integers(0, n, 2)
+            order[[i, j]] = order[[j, i]]
+        df = df.iloc[order].reset_index(drop=True)
+
+    # Partial, shuffled tail after the last full cycle (what trimming removes)
+    if messy_tail > 0:
+        tail = df.iloc[:messy_tail].sample(frac=1.0, random_state=seed).copy()
+        tail["timestamp_since_poweron"] = ts[-1] + np.cumsum(rng.integers(15, 25, len(tail)))
+        df = pd.concat([df, tail], ignore_index=True)
+
+    return df[RAW_COLS]
+
+def write_raw_txt(df: pd.DataFrame, path: Path):
+    """Write a session in the JSON layout read by the RawToCSV scripts."""
+    payload = {
+        "rawDataBody": {
+            "dataColumns": [{"key": c} for c in df.columns],
+            "dataBlock": df.to_dict("split")["data"],
+        }
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(payload))
+
+def label_session(df: pd.DataFrame, spice: str) -> pd.DataFrame:
+    """Label a session the same way the Data_Labelling scripts do."""
+    df = df.copy()
+    df["spice"] = spice
+    df["target"] = LABEL_MAP[spice]
+    df["group_id"] = spice + "_cycle_" + df["scanning_cycle_index"].astype(int).astype(str)
+    return df
+
+def make_master(spices=tuple(LABEL_MAP), n_blocks: int = 20, seed: int = 0) -> pd.DataFrame:
+    """Build a clean master labeled table (all spices concatenated)."""
+    import pandas as pd
+    parts = [label_session(make_session(s, n_blocks, seed), s) for s in spices]
+    return pd.concat(parts, ignore_index=True)
+
+def main(out_dir: Path, n_blocks: int, seed: int, messy_tail: int, swaps: int, kind: str):
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if kind == "master":
+        out_path = out_dir / "master_training_labeled.csv"
+        master = make_master(n_blocks=n_blocks, seed=seed)
+        master.to_csv(out_path, index=False)
+        print(f"[OK] Wrote: {out_path}  (rows={len(master)})")
+        return
+    for spice in LABEL_MAP:
+        df = make_session(spice, n_blocks, seed, messy_tail, swaps)
+        out_path = out_dir / f"{spice}_Synthetic.{'txt' if kind == 'raw' else 'csv'}"
+        if kind == "raw":
+            write_raw_txt(df, out_path)
+        else:
+            df.to_csv(out_path, index=False)
+        print(f"[OK] Wrote: {out_path}  (rows={len(df)})")
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Generate synthetic BME688 sessions")
+    p.add_argument("--out_dir", required=True, type=str, help="Output directory")
+    p.add_argument("--kind", choices=["raw", "csv", "master"], default="raw",
+                   help="raw JSON .txt per spice, raw CSV per spice, or one master labeled CSV")
+    p.add_argument("--blocks", type=int, default=20, help="Number of 400-row scanning blocks per spice")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--messy_tail", type=int, default=0, help="Rows of out-of-pattern tail per session")
+    p.add_argument("--swaps", type=int, default=0, help="Number of out-of-order row swaps per session")
+    args = p.parse_args()
+    main(Path(args.out_dir), args.blocks, args.seed, args.messy_tail, args.swaps, args.kind)
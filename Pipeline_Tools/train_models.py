@@ -0,0 +1,419 @@
+# train_models.py
+# Purpose: Train the ten raw-data classifiers from the ML Models_Raw_Data notebooks concurrently.
+# The train/test arrays are written once as .npy files and memory-mapped read-only by every
+# worker process, so no worker gets a private copy. Each model writes the same artifacts,
+# file names and metrics JSON as its notebook cell (BASE_OUT/<Model>/<prefix>_*).
+#
+# Example:
+#   python train_models.py --train Train_All.csv --test Test_All.csv --out_dir all_feature/outputs
+#   python train_models.py --train Train_All.csv --test Test_All.csv --out_dir humidity/outputs \
+#       --features relative_humidity --tag humidity --models rf,gb,xgb
+#   python train_models.py --train train_parts --test test_parts --test_partitions "day=2023-11-14" --out_dir day1
+# --train/--test may also be partitioned_store.py folders; only partitions passing the filters are read.
+
+from pathlib import Path
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+import binned_cache
+import dtype_schema
+import partitioned_store
+
+FEATURES = ["resistance_gassensor", "pressure", "temperature", "relative_humidity"]
+LABEL_COL = "target"
+RANDOM_STATE = 42
+
+# key -> (output folder, file prefix, console name); same folders and prefixes as the notebooks
+MODELS = {
+    "rf":  ("RandomForest",       "rf",   "Random Forest"),
+    "lr":  ("LogisticRegression", "lr",   "Logistic Regression"),
+    "mlp": ("MLP",                "mlp",  "MLP"),
+    "svm": ("SVM",                "svm",  "SVM (LinearSVC)"),
+    "sgd": ("SGD",                "sgd",  "SGD"),
+    "gb":  ("GradientBoosting",   "gb",   "Gradient Boosting"),
+    "ada": ("AdaBoost",           "ada",  "AdaBoost"),
+    "knn": ("KNN",                "knn",  "KNN"),
+    "cnn": ("CNN",                "cnn",  "CNN"),
+    "xgb": ("XGBoost",            "xgb",  "XGBoost"),
+}
+
+# Submission order: slowest models first so the pool drains on the longest job
+SCHEDULE_ORDER = ["cnn", "rf", "xgb", "gb", "mlp", "ada", "knn", "svm", "sgd", "lr"]
+
+class KerasCNN:
+    """Compact 1D CNN from the notebooks behind a fit/predict interface."""
+
+    def __init__(self, n_features: int, num_classes: int):
+        self.n_features = n_features
+        self.num_classes = num_classes
+        # Single-feature notebooks use a narrower net with kernel_size=1
+        small = n_features < 3
+        self.filters, self.kernel_size, self.dense = (16, 1, 32) if small else (32, 2, 64)
+        self.model = None
+
+    def fit(self, X, y):
+        import tensorflow as tf
+        from tensorflow import keras
+        from tensorflow.keras import layers
+
+        np.random.seed(RANDOM_STATE)
+        tf.random.set_seed(RANDOM_STATE)
+        inputs = keras.Input(shape=(self.n_features, 1))
+        x = layers.Conv1D(filters=self.filters, kernel_size=self.kernel_size, activation="relu")(inputs)
+        x = layers.Conv1D(filters=self.filters, kernel_size=self.kernel_size, activation="relu")(x)
+        x = layers.GlobalAveragePooling1D()(x)
+        x = layers.Dense(self.dense, activation="relu")(x)
+        outputs = layers.Dense(self.num_classes, activation="softmax")(x)
+        self.model = keras.Model(inputs=inputs, outputs=outputs, name="cnn_tabular_1d")
+        self.model.compile(
+            optimizer=keras.optimizers.Adam(learning_rate=1e-3),
+            loss="sparse_categorical_crossentropy",
+            metrics=["accuracy"]
+        )
+        self.model.fit(self._reshape(X), np.asarray(y), epochs=25, batch_size=1024, verbose=0)
+        return self
+
+    def _reshape(self, X):
+        return np.asarray(X, dtype=np.float32).reshape(-1, self.n_features, 1)
+
+    def predict_proba(self, X):
+        return self.model.predict(self._reshape(X), batch_size=4096, verbose=0)
+
+    def predict(self, X):
+        return np.argmax(self.predict_proba(X), axis=1)
+
+    def save(self, path: Path):
+        self.model.save(path)
+
+def build_model(key: str, n_features: int, num_classes: int, n_jobs: int):
+    """Return (estimator, metrics params) with the notebook settings. Heavy imports happen here."""
+    if key == "rf":
+        from sklearn.ensemble import RandomForestClassifier
+        clf = RandomForestClassifier(n_estimators=300, max_depth=None, n_jobs=n_jobs, random_state=RANDOM_STATE)
+        return clf, {"model": "RandomForestClassifier", "n_estimators": 300, "random_state": RANDOM_STATE}
+    if key == "lr":
+        from sklearn.linear_model import LogisticRegression
+        clf = LogisticRegression(multi_class="multinomial", solver="lbfgs", max_iter=2000) \
+            if "multi_class" in LogisticRegression().get_params() else LogisticRegression(solver="lbfgs", max_iter=2000)
+        return clf, {"model": "LogisticRegression", "multi_class": "multinomial", "solver": "lbfgs", "max_iter": 2000}
+    if key == "mlp":
+        from sklearn.neural_network import MLPClassifier
+        clf = MLPClassifier(hidden_layer_sizes=(256, 128), activation="relu", solver="adam",
+                            max_iter=600, random_state=42, early_stopping=False)
+        return clf, {"model": "MLPClassifier", "hidden_layer_sizes": [256, 128], "activation": "relu",
+                     "solver": "adam", "max_iter": 600, "early_stopping": False}
+    if key == "svm":
+        from sklearn.svm import LinearSVC
+        clf = LinearSVC(C=1.0, random_state=42, dual=False, max_iter=5000)
+        return clf, {"model": "LinearSVC", "C": 1.0, "dual": False, "max_iter": 5000}
+    if key == "sgd":
+        from sklearn.linear_model import SGDClassifier
+        clf = SGDClassifier(loss="log_loss", penalty="l2", alpha=1e-4, max_iter=5000, tol=1e-4, random_state=42)
+        return clf, {"model": "SGDClassifier", "loss": "log_loss", "penalty": "l2", "alpha": 1e-4,
+                     "max_iter": 5000, "tol": 1e-4}
+    if key == "gb":
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        clf = HistGradientBoostingClassifier(loss="log_loss", learning_rate=0.1, max_iter=200, max_depth=None,
+                                             early_stopping=False, random_state=42)
+        return clf, {"model": "HistGradientBoostingClassifier", "loss": "log_loss", "learning_rate": 0.1,
+                     "max_iter": 200, "max_depth": None, "early_stopping": False}
+    if key == "ada":
+        from sklearn.ensemble import AdaBoostClassifier
+        from sklearn.tree import DecisionTreeClassifier
+        clf = AdaBoostClassifier(estimator=DecisionTreeClassifier(max_depth=1, random_state=42),
+                                 n_estimators=300, learning_rate=0.5, algorithm="SAMME", random_state=42) \
+            if "algorithm" in AdaBoostClassifier().get_params() else \
+            AdaBoostClassifier(estimator=DecisionTreeClassifier(max_depth=1, random_state=42),
+                               n_estimators=300, learning_rate=0.5, random_state=42)
+        return clf, {"model": "AdaBoostClassifier", "base_estimator": "DecisionTree(max_depth=1)",
+                     "n_estimators": 300, "learning_rate": 0.5, "algorithm": "SAMME"}
+    if key == "knn":
+        from sklearn.neighbors import KNeighborsClassifier
+        clf = KNeighborsClassifier(n_neighbors=7, weights="distance", algorithm="kd_tree", leaf_size=30,
+                                   p=2, n_jobs=n_jobs)
+        return clf, {"model": "KNeighborsClassifier", "n_neighbors": 7, "weights": "distance",
+                     "algorithm": "kd_tree", "leaf_size": 30, "p": 2}
+    if key == "cnn":
+        clf = KerasCNN(n_features, num_classes)
+        return clf, {"model": "Keras 1D CNN", "input_shape": [n_features, 1], "epochs": 25, "batch_size": 1024,
+                     "optimizer": "adam", "loss": "sparse_categorical_crossentropy"}
+    if key == "xgb":
+        from xgboost import XGBClassifier
+        clf = XGBClassifier(objective="multi:softmax", num_class=num_classes, n_estimators=400, max_depth=6,
+                            learning_rate=0.1, subsample=0.8, colsample_bytree=0.8, reg_lambda=1.0,
+                            tree_method="hist", eval_metric="mlogloss", random_state=42, n_jobs=n_jobs,
+                            verbosity=0)
+        return clf, {"model": "XGBClassifier", "objective": "multi:softmax", "num_class": num_classes,
+                     "n_estimators": 400, "max_depth": 6, "learning_rate": 0.1, "subsample": 0.8,
+                     "colsample_bytree": 0.8, "reg_lambda": 1.0, "tree_method": "hist", "eval_metric": "mlogloss"}
+    raise ValueError(f"Unknown model key: {key}")
+
+def label_names_for(classes, spice_map: dict) -> list:
+    # Ordered class labels for headings, e.g. "Anise (0)"
+    names = []
+    for c in classes:
+        if spice_map:
+            names.append(f"{spice_map.get(int(c), '')} ({int(c)})".strip())
+        else:
+            names.append(str(int(c)))
+    return names
+
+def write_outputs(out_dir: Path, prefix: str, params: dict, clf, y_test, y_pred,
+                  spice_map: dict, train_time: float, feature: str = None) -> dict:
+    """Write the per-model artifacts exactly as the notebook cells do. Returns the metrics dict."""
+    import pandas as pd
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+
+    acc = accuracy_score(y_test, y_pred)
+    acc_percent = round(100.0 * acc, 2)
+    report_dict = classification_report(y_test, y_pred, digits=4, output_dict=True)
+    cm = confusion_matrix(y_test, y_pred)
+    unique_classes = np.sort(np.unique(y_test))
+    label_names = label_names_for(unique_classes, spice_map)
+
+    report_csv = out_dir / f"{prefix}_classification_report.csv"
+    pd.DataFrame(report_dict).transpose().to_csv(report_csv, index=True)
+
+    cm_df = pd.DataFrame(
+        cm,
+        index=[f"true_{n}" for n in label_names],
+        columns=[f"pred_{n}" for n in label_names]
+    )
+    cm_df.index.name = "true_label"
+    cm_df.columns.name = "pred_label"
+    cm_csv = out_dir / f"{prefix}_confusion_matrix.csv"
+    cm_df.to_csv(cm_csv, index=True)
+
+    # Persist the trained model; avoid overwriting by timestamping if needed
+    suffix = ".keras" if isinstance(clf, KerasCNN) else ".joblib"
+    model_base = out_dir / f"{prefix}_model{suffix}"
+    model_path = model_base if not model_base.exists() else out_dir / f"{prefix}_model_{time.strftime('%Y%m%d_%H%M%S')}{suffix}"
+    if isinstance(clf, KerasCNN):
+        clf.save(model_path)
+    else:
+        import joblib
+        joblib.dump(clf, model_path)
+
+    metrics = dict(params)
+    if feature is not None:
+        metrics = {"model": params["model"], "feature": feature,
+                   **{k: v for k, v in params.items() if k not in ("model", "random_state")}}
+    metrics.update({
+        "test_accuracy": acc,
+        "test_accuracy_percent": acc_percent,
+        "train_time_sec": round(train_time, 4),
+        "report_csv": str(report_csv),
+        "confusion_matrix_csv": str(cm_csv),
+        "model_path": str(model_path)
+    })
+    with (out_dir / f"{prefix}_metrics.json").open("w") as f:
+        json.dump(metrics, f, indent=2)
+
+    summary = []
+    for c in unique_classes:
+        mask = (y_test == c)
+        total = int(mask.sum())
+        correct = int((y_pred[mask] == y_test[mask]).sum())
+        summary.append({
+            "target": int(c),
+            "spice": spice_map.get(int(c), "") if spice_map else "",
+            "total_rows": total,
+            "correct_rows": correct,
+            "incorrect_rows": int(total - correct),
+            "class_accuracy_percent": round(100.0 * correct / total, 2) if total > 0 else 0.0
+        })
+    pd.DataFrame(summary).sort_values(by="target").to_csv(out_dir / f"{prefix}_per_class_outcomes.csv", index=False)
+    return metrics
+
+def share_arrays(arrays: dict, shared_dir: Path) -> dict:
+    """Write arrays once as .npy files; workers open them with mmap_mode='r'."""
+    paths = {}
+    for name, arr in arrays.items():
+        paths[name] = str(shared_dir / f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(arr))
+    return paths
+
+def load_shared(paths: dict) -> dict:
+    return {name: np.load(p, mmap_mode="r") for name, p in paths.items()}
+
+def train_one(key: str, shared: dict, out_base: str, tag: str, feature: str, spice_map: dict, n_jobs: int,
+              encoder=None, columns: list = None, knn_index: str = None) -> dict:
+    """Worker: fit one model on the memory-mapped arrays and write its artifacts.
+    With an encoder, boosting models train on the cached pre-binned codes instead of raw X.
+    `columns` selects a feature subset (column positions) of the shared arrays.
+    With knn_index, KNN opens that persisted search tree instead of fitting (see knn_index.py)."""
+    from threadpoolctl import threadpool_limits
+
+    folder, prefix, console = MODELS[key]
+    out_dir = Path(out_base) / folder
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if tag:
+        prefix = f"{prefix}_{tag}"
+
+    data = load_shared(shared)
+    X_train, y_train, X_test, y_test = data["X_train"], data["y_train"], data["X_test"], data["y_test"]
+    prebinned = encoder is not None and key in binned_cache.PREBIN_MODELS
+    if prebinned:
+        X_train, X_test = data["Xb_train"], data["Xb_test"]
+    if columns is not None:
+        X_train, X_test = X_train[:, columns], X_test[:, columns]
+    if prebinned:
+        X_train, X_test = binned_cache.model_input(X_train), binned_cache.model_input(X_test)
+    num_classes = int(np.unique(y_train).size)
+
+    with threadpool_limits(limits=n_jobs):
+        clf, params = build_model(key, X_train.shape[1], num_classes, n_jobs)
+        start = time.time()
+        if key == "knn" and knn_index and columns is None:
+            import model_artifact
+            clf = model_artifact.load(knn_index, search_tree=True)
+            clf.n_jobs = n_jobs
+        else:
+            clf.fit(X_train, y_train)
+        train_time = time.time() - start
+        start = time.time()
+        y_pred = np.asarray(clf.predict(X_test))
+        predict_time = time.time() - start
+    if prebinned:
+        clf = binned_cache.BinnedModel(encoder, clf)
+
+    metrics = write_outputs(out_dir, prefix, params, clf, np.asarray(y_test), y_pred, spice_map, train_time, feature)
+    return {"model": key, "name": console, "tag": tag, "test_accuracy_percent": metrics["test_accuracy_percent"],
+            "train_time_sec": round(train_time, 4), "predict_time_sec": round(predict_time, 4),
+            "out_dir": str(out_dir)}
+
+def read_table(src: Path, usecols, partitions: str = None):
+    """A CSV file, or the partitions of a partitioned_store.py folder that pass the filter."""
+    if Path(src).is_dir():
+        return partitioned_store.read(Path(src), partitioned_store.parse_filters(partitions), usecols=usecols,
+                                      workers=os.cpu_count() or 1)
+    return dtype_schema.read_csv(src, usecols=usecols)
+
+def load_xy(train_csv: Path, test_csv: Path, features: list, train_partitions: str = None,
+            test_partitions: str = None):
+    import pandas as pd
+    train_df = read_table(train_csv, lambda c: c in features + [LABEL_COL, "spice"], train_partitions)
+    test_df  = read_table(test_csv, lambda c: c in features + [LABEL_COL, "spice"], test_partitions)
+
+    missing_train = [c for c in features + [LABEL_COL] if c not in train_df.columns]
+    missing_test  = [c for c in features + [LABEL_COL] if c not in test_df.columns]
+    if missing_train:
+        raise ValueError(f"Train is missing columns: {missing_train}")
+    if missing_test:
+        raise ValueError(f"Test is missing columns: {missing_test}")
+
+    spice_map = {}
+    if "spice" in test_df.columns:
+        spice_map = test_df.groupby(LABEL_COL)["spice"].agg(lambda s: s.mode().iat[0]).to_dict()
+        spice_map = {int(k): v for k, v in spice_map.items()}
+    arrays = {
+        "X_train": train_df[features].to_numpy(),
+        "y_train": train_df[LABEL_COL].to_numpy(),
+        "X_test":  test_df[features].to_numpy(),
+        "y_test":  test_df[LABEL_COL].to_numpy(),
+    }
+    return arrays, spice_map
+
+def run_pool(jobs: list, workers: int) -> list:
+    """Run (callable, kwargs) jobs on a process pool; returns results in completion order."""
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futs = {ex.submit(fn, **kw): kw for fn, kw in jobs}
+        for fut in as_completed(futs):
+            try:
+                results.append(fut.result())
+            except Exception as e:
+                kw = futs[fut]
+                print(f"[WARN] {kw.get('key', '?')} failed: {e}", file=sys.stderr)
+                results.append({"model": kw.get("key"), "tag": kw.get("tag"), "error": str(e)})
+    return results
+
+def main(train_csv: Path, test_csv: Path, out_base: Path, models: list, features: list,
+         tag: str = None, workers: int = None, force: bool = False, prebin: bool = False,
+         knn_index: bool = False, train_partitions: str = None, test_partitions: str = None):
+    import pandas as pd
+    if (prebin or knn_index) and (train_csv.is_dir() or test_csv.is_dir()):
+        raise ValueError("--prebin and --knn_index cache per CSV file; pass CSV files, not partition folders")
+    # Safety guard: stop if a model folder exists and is not empty to protect prior runs
+    busy = [MODELS[k][0] for k in models if (out_base / MODELS[k][0]).exists()
+            and any((out_base / MODELS[k][0]).iterdir())]
+    if busy and not force:
+        print(f"Safety guard: output folders already exist and are not empty: {busy}")
+        print("Create a new output folder, archive/clear the existing ones, or pass --force.")
+        sys.exit(1)
+    out_base.mkdir(parents=True, exist_ok=True)
+
+    arrays, spice_map = load_xy(train_csv, test_csv, features, train_partitions, test_partitions)
+    print("Train shapes:", arrays["X_train"].shape, arrays["y_train"].shape)
+    print("Test shapes :", arrays["X_test"].shape, arrays["y_test"].shape)
+    encoder = None
+    if prebin and binned_cache.PREBIN_MODELS.intersection(models):
+        # Codes are built once per dataset fingerprint; test is coded with the train thresholds
+        arrays["Xb_train"], train_bins = binned_cache.binned_matrix(train_csv, features)
+        arrays["Xb_test"], _ = binned_cache.binned_matrix(test_csv, features, reference=train_bins)
+        encoder = train_bins.encoder(features)
+        print(f"[INFO] Pre-binned codes: {train_bins.dir}")
+    index_path = None
+    if knn_index and "knn" in models:
+        # The KD-tree is built once per training-file fingerprint and reused by later runs
+        import knn_index as knn_cache
+        index_path = str(knn_cache.build_index(train_csv, features))
+        print(f"[INFO] KNN index: {index_path}")
+
+    cpus = os.cpu_count() or 1
+    workers = workers or min(len(models), cpus)
+    n_jobs = max(1, cpus // workers)
+    feature = ",".join(features) if tag else None
+    ordered = [k for k in SCHEDULE_ORDER if k in models]
+
+    with tempfile.TemporaryDirectory(prefix="train_shared_") as tmp:
+        shared = share_arrays(arrays, Path(tmp))
+        del arrays
+        jobs = [(train_one, dict(key=k, shared=shared, out_base=str(out_base), tag=tag, feature=feature,
+                                 spice_map=spice_map, n_jobs=n_jobs, encoder=encoder, knn_index=index_path))
+                for k in ordered]
+        start = time.time()
+        results = run_pool(jobs, workers)
+        wall = time.time() - start
+
+    ok = [r for r in results if "error" not in r]
+    cols = ["model", "name", "test_accuracy_percent", "train_time_sec", "predict_time_sec", "out_dir", "error"]
+    summary = pd.DataFrame(results).reindex(columns=cols)
+    summary_csv = out_base / (f"training_summary_{tag}.csv" if tag else "training_summary.csv")
+    summary.to_csv(summary_csv, index=False)
+
+    for r in sorted(ok, key=lambda r: r["model"]):
+        print(f"[OK] {r['name']}: accuracy {r['test_accuracy_percent']}% | train {r['train_time_sec']:.2f}s")
+    print(f"[INFO] Workers: {workers} x {n_jobs} threads | wall {wall:.2f}s vs "
+          f"sum of train times {sum(r['train_time_sec'] for r in ok):.2f}s")
+    print(f"[OK] Summary: {summary_csv}")
+    return results
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Train the raw-data classifiers concurrently on shared memory-mapped arrays")
+    p.add_argument("--train", required=True, type=str, help="Training CSV (e.g. Train_All.csv) or partitioned store folder")
+    p.add_argument("--test", required=True, type=str, help="Testing CSV (e.g. Test_All.csv) or partitioned store folder")
+    p.add_argument("--out_dir", required=True, type=str, help="Base output folder (BASE_OUT in the notebooks)")
+    p.add_argument("--models", type=str, default=",".join(MODELS), help=f"Comma list from {list(MODELS)}")
+    p.add_argument("--features", type=str, default=",".join(FEATURES), help="Comma list of raw feature columns")
+    p.add_argument("--tag", type=str, default=None,
+                   help="File-name tag used by the single-feature notebooks, e.g. humidity -> rf_humidity_*")
+    p.add_argument("--workers", type=int, default=None, help="Process count (default: min(#models, #cpus))")
+    p.add_argument("--force", action="store_true", help="Write into non-empty model folders (models get timestamped names)")
+    p.add_argument("--prebin", action="store_true",
+                   help="Train gb/xgb on cached pre-binned codes (binned_cache.py) instead of re-binning raw X")
+    p.add_argument("--knn_index", action="store_true",
+                   help="KNN reuses a persisted KD-tree built once per training file (knn_index.py) instead of fitting")
+    p.add_argument("--train_partitions", type=str, default=None,
+                   help='Partition filter when --train is a store folder, e.g. "spice=Anise,Chilli;day=2023-11-*"')
+    p.add_argument("--test_partitions", type=str, default=None, help="Partition filter when --test is a store folder")
+    args = p.parse_args()
+    main(Path(args.train), Path(args.test), Path(args.out_dir), args.models.split(","),
+         args.features.split(","), args.tag, args.workers, args.force, args.prebin, args.knn_index,
+         args.train_partitions, args.test_partitions)
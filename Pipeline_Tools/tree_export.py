@@ -0,0 +1,343 @@
+# tree_export.py
+# Purpose: Export trained tree ensembles (RandomForest, AdaBoost, HistGradientBoosting, XGBoost)
+# as flat node arrays, plus a pure NumPy predictor. All trees are concatenated into contiguous
+# feature/threshold/left/right/value arrays. A batch descends every tree at once, one depth
+# level per vectorized step (rows that reached a leaf drop out; large batches go in row blocks).
+# Loading needs only NumPy, and predictions match the source model. Pre-binned HistGB/XGBoost
+# models (binned_cache.BinnedModel) are exported with their split thresholds mapped back to raw
+# values. --check also reruns the rows with NaN injected (for models that accept missing values)
+# and exits non-zero if any prediction differs.
+#
+# Example:
+#   python tree_export.py --model outputs/RandomForest/rf_model.joblib --out rf_flat.npz --check Test_All.csv
+
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+BLOCK_ROWS = 1024       # rows scored together by predict_proba
+
+class FlatForest:
+    """Tree ensemble stored as flat arrays.
+
+    kind "average": class probabilities are the mean of leaf distributions (RandomForest).
+    kind "boost":   class margins are base + sum of leaf values of each class's trees, then softmax.
+    kind "samme":   weighted votes of every tree for its leaf's class (AdaBoost), then softmax.
+    """
+
+    def __init__(self, arrays: dict, meta: dict):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.missing_left = arrays["missing_left"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.tree_class = arrays["tree_class"]
+        self.base = arrays["base"]
+        self.meta = meta
+        self.kind = meta["kind"]
+        self.classes_ = np.asarray(meta["classes"])
+        self.max_depth = int(meta["max_depth"])
+        self.strict = meta["compare"] == "<"     # XGBoost: x < split goes left
+        self.dtype = np.float32 if meta["float32"] else np.float64
+
+    def arrays(self) -> dict:
+        return {"feature": self.feature, "threshold": self.threshold, "left": self.left, "right": self.right,
+                "missing_left": self.missing_left, "value": self.value, "roots": self.roots,
+                "tree_class": self.tree_class, "base": self.base}
+
+    def save(self, path: Path):
+        np.savez(path, meta=np.frombuffer(json.dumps(self.meta).encode(), dtype=np.uint8), **self.arrays())
+
+    @classmethod
+    def load(cls, path: Path):
+        with np.load(path) as z:
+            meta = json.loads(bytes(z["meta"]).decode())
+            arrays = {k: z[k] for k in z.files if k != "meta"}
+        return cls(arrays, meta)
+
+    def leaves(self, X) -> np.ndarray:
+        """(rows, trees) leaf node ids."""
+        # Same input precision as the source model's comparisons (float32 for RF and XGBoost)
+        X = np.ascontiguousarray(np.asarray(X, dtype=self.dtype), dtype=np.float64)
+        n, n_features = X.shape
+        flat_x = X.ravel()
+        node = np.broadcast_to(self.roots, (n, self.roots.size)).ravel().copy()
+        row_off = np.repeat(np.arange(n) * n_features, self.roots.size)
+        # Leaves point to themselves; (row, tree) pairs that reached one drop out of the next step
+        active = np.flatnonzero(self.left[node] != node)
+        while active.size:
+            cur = node[active]
+            x = flat_x[row_off[active] + self.feature[cur]]
+            thr = self.threshold[cur]
+            go_left = x < thr if self.strict else x <= thr
+            if np.isnan(x.sum()):
+                go_left = np.where(np.isnan(x), self.missing_left[cur], go_left)
+            cur = np.where(go_left, self.left[cur], self.right[cur])
+            node[active] = cur
+            active = active[self.left[cur] != cur]
+        return node.reshape(n, -1)
+
+    def predict_proba(self, X) -> np.ndarray:
+        # Row blocks bound the rows x trees temporaries whatever the batch size
+        X = np.asarray(X)
+        return np.concatenate([self._proba(X[a:a + BLOCK_ROWS]) for a in range(0, max(len(X), 1), BLOCK_ROWS)])
+
+    def _proba(self, X) -> np.ndarray:
+        node = self.leaves(X)
+        if self.kind in ("average", "samme"):
+            # Add one tree at a time, in order, as the estimator accumulates
+            proba = np.zeros((node.shape[0], self.value.shape[1]))
+            for t in range(node.shape[1]):
+                proba += self.value[node[:, t]]
+            if self.kind == "average":
+                return proba / node.shape[1]
+            # base holds the sum of the estimator weights; votes are scaled by 1/(K-1) before softmax
+            raw = proba / self.base[0] / (self.classes_.size - 1)
+        else:
+            n, n_classes = node.shape[0], self.classes_.size
+            # Boosting rounds are (iteration, class) ordered; start from the baseline like the estimator
+            vals = self.value[node, 0].reshape(n, -1, n_classes)
+            raw = np.concatenate([np.broadcast_to(self.base, (n, 1, n_classes)), vals], axis=1).sum(axis=1)
+        raw -= raw.max(axis=1, keepdims=True)
+        e = np.exp(raw)
+        return e / e.sum(axis=1, keepdims=True)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def _finish(parts: list, tree_class: list, base, meta: dict) -> FlatForest:
+    """Concatenate per-tree node arrays into one forest with global child indices."""
+    offsets = np.cumsum([0] + [len(p["feature"]) for p in parts[:-1]])
+    cat = {k: np.concatenate([p[k] for p in parts]) for k in ["feature", "threshold", "missing_left", "value"]}
+    left, right = [], []
+    for off, p in zip(offsets, parts):
+        self_idx = np.arange(len(p["left"])) + off   # leaves loop back to themselves
+        left.append(np.where(p["left"] >= 0, p["left"] + off, self_idx))
+        right.append(np.where(p["right"] >= 0, p["right"] + off, self_idx))
+    arrays = {
+        "feature": np.where(cat["feature"] >= 0, cat["feature"], 0).astype(np.int32),
+        "threshold": cat["threshold"].astype(np.float64),
+        "left": np.concatenate(left).astype(np.int32),
+        "right": np.concatenate(right).astype(np.int32),
+        "missing_left": cat["missing_left"].astype(bool),
+        "value": cat["value"].astype(np.float64),
+        "roots": offsets.astype(np.int32),
+        "tree_class": np.asarray(tree_class, dtype=np.int32),
+        "base": np.asarray(base, dtype=np.float64),
+    }
+    meta["max_depth"] = int(max(p["depth"] for p in parts))
+    meta["n_nodes"] = int(arrays["feature"].size)
+    meta["n_trees"] = len(parts)
+    return FlatForest(arrays, meta)
+
+def _depth(left: np.ndarray, right: np.ndarray) -> int:
+    depth = np.zeros(left.size, dtype=np.int64)
+    for i in range(left.size):     # children always come after their parent
+        if left[i] >= 0:
+            depth[left[i]] = depth[right[i]] = depth[i] + 1
+    return int(depth.max())
+
+def from_random_forest(model) -> FlatForest:
+    parts = []
+    for est in model.estimators_:
+        t = est.tree_
+        v = t.value[:, 0, :].astype(np.float64)
+        norm = v.sum(axis=1, keepdims=True)
+        norm[norm == 0.0] = 1.0
+        parts.append({"feature": t.feature, "threshold": t.threshold, "left": t.children_left,
+                      "right": t.children_right, "missing_left": t.missing_go_to_left.astype(bool),
+                      "value": v / norm, "depth": t.max_depth})
+    meta = {"kind": "average", "source": "RandomForestClassifier", "classes": model.classes_.tolist(),
+            "n_features": int(model.n_features_in_), "compare": "<=", "float32": True}
+    return _finish(parts, [0] * len(parts), [], meta)
+
+def from_adaboost(model) -> FlatForest:
+    """SAMME AdaBoost over decision trees: each leaf stores its class's weighted vote
+    (w for the tree's predicted class, -w/(K-1) for the others), as decision_function adds them."""
+    n_classes = len(model.classes_)
+    if n_classes <= 2:
+        raise ValueError("Only multi-class AdaBoost models are supported")
+    if type(model.estimators_[0]).__name__ != "DecisionTreeClassifier":
+        raise ValueError(f"Only decision-tree AdaBoost is supported (got {type(model.estimators_[0]).__name__})")
+    parts = []
+    for est, w in zip(model.estimators_, model.estimator_weights_):
+        t = est.tree_
+        vote = np.eye(n_classes, dtype=bool)[np.argmax(t.value[:, 0, :], axis=1)]
+        parts.append({"feature": t.feature, "threshold": t.threshold, "left": t.children_left,
+                      "right": t.children_right, "missing_left": t.missing_go_to_left.astype(bool),
+                      "value": np.where(vote, w, -1 / (n_classes - 1) * w), "depth": t.max_depth})
+    meta = {"kind": "samme", "source": "AdaBoostClassifier", "classes": model.classes_.tolist(),
+            "n_features": int(model.n_features_in_), "compare": "<=", "float32": True}
+    return _finish(parts, [0] * len(parts), [float(model.estimator_weights_.sum())], meta)
+
+def from_hist_gradient_boosting(model, encoder=None) -> FlatForest:
+    """Uses the fitted predictor node records. With a BinEncoder (model fitted on pre-binned
+    codes), split thresholds on codes are mapped back to the raw-value bin edges."""
+    parts, tree_class = [], []
+    for predictors in model._predictors:
+        for k, pred in enumerate(predictors):
+            nodes = pred.nodes
+            if nodes["is_categorical"].any():
+                raise ValueError("Categorical splits are not supported")
+            leaf = nodes["is_leaf"].astype(bool)
+            feat = nodes["feature_idx"].astype(np.int64)
+            thr = nodes["num_threshold"].astype(np.float64)
+            miss = nodes["missing_go_to_left"].astype(bool)
+            if encoder is not None:
+                # code <= k.5 on codes  <=>  raw <= k-th bin edge; NaN reached the model as NaN
+                # (threshold inf is HistGB's "NaN vs all values" split and needs no mapping)
+                for i in np.flatnonzero(~leaf & np.isfinite(thr)):
+                    edges = encoder.thresholds[feat[i]]
+                    k_bin = int(np.floor(thr[i]))
+                    thr[i] = edges[k_bin] if k_bin < len(edges) else np.inf
+            parts.append({"feature": np.where(leaf, -1, feat), "threshold": thr,
+                          "left": np.where(leaf, -1, nodes["left"].astype(np.int64)),
+                          "right": np.where(leaf, -1, nodes["right"].astype(np.int64)),
+                          "missing_left": miss, "value": nodes["value"][:, None],
+                          "depth": int(nodes["depth"].max())})
+            tree_class.append(k)
+    base = np.asarray(model._baseline_prediction, dtype=np.float64).ravel()
+    meta = {"kind": "boost", "source": "HistGradientBoostingClassifier", "classes": model.classes_.tolist(),
+            "n_features": int(model.n_features_in_), "compare": "<=", "float32": False}
+    return _finish(parts, tree_class, base, meta)
+
+def from_xgboost(model, encoder=None) -> FlatForest:
+    """Reads the booster's tree dump. With a BinEncoder (model fitted on pre-binned codes), split
+    thresholds on codes are mapped back to the raw-value bin edges."""
+    booster = model.get_booster()
+    df = booster.trees_to_dataframe()
+    cfg = json.loads(booster.save_config())["learner"]["learner_model_param"]
+    n_classes = int(cfg.get("num_class", "0")) or 2
+    if n_classes == 2:
+        raise ValueError("Only multi-class XGBoost models are supported")
+    base = np.asarray(json.loads(cfg["base_score"].replace("E", "e")), dtype=np.float64)
+    base = np.broadcast_to(base, (n_classes,)).copy()
+    if getattr(booster, "feature_names", None):
+        fmap = {n: i for i, n in enumerate(booster.feature_names)}
+    else:
+        fmap = {}
+
+    n_trees = int(df["Tree"].max()) + 1
+    best = getattr(model, "best_iteration", None)
+    if best is not None:
+        n_trees = min(n_trees, (int(best) + 1) * n_classes)
+
+    parts, tree_class = [], []
+    for t, g in df[df["Tree"] < n_trees].groupby("Tree", sort=True):
+        g = g.sort_values("Node")
+        idx = {nid: i for i, nid in enumerate(g["ID"])}
+        leaf = (g["Feature"] == "Leaf").to_numpy()
+        feat = np.array([-1 if lf else fmap[f] if f in fmap else int(f[1:])
+                         for f, lf in zip(g["Feature"], leaf)])
+        left = np.array([-1 if lf else idx[y] for y, lf in zip(g["Yes"], leaf)])
+        right = np.array([-1 if lf else idx[n] for n, lf in zip(g["No"], leaf)])
+        miss = np.array([False if lf else m == y for m, y, lf in zip(g["Missing"], g["Yes"], leaf)])
+        # Splits are float32 in XGBoost; leaf values are stored in the Gain column
+        thr = g["Split"].to_numpy(dtype=np.float64).astype(np.float32).astype(np.float64)
+        value = np.where(leaf, g["Gain"].to_numpy(dtype=np.float64), 0.0)
+        if encoder is not None:
+            # Integer codes: code < split  <=>  code <= ceil(split) - 1  <=>  raw <= that bin's
+            # upper edge. NaN reached the booster as NaN, so its Missing branch applies as is.
+            for i in np.flatnonzero(~leaf):
+                edges = encoder.thresholds[feat[i]]
+                k_bin = int(np.ceil(thr[i])) - 1
+                thr[i] = -np.inf if k_bin < 0 else edges[k_bin] if k_bin < len(edges) else np.inf
+        parts.append({"feature": feat, "threshold": np.where(leaf, 0.0, thr), "left": left, "right": right,
+                      "missing_left": miss, "value": value[:, None], "depth": _depth(left, right)})
+        tree_class.append(int(t) % n_classes)
+    classes = getattr(model, "classes_", np.arange(n_classes))
+    meta = {"kind": "boost", "source": "XGBClassifier", "classes": np.asarray(classes).tolist(),
+            "n_features": int(cfg.get("num_feature", 0)), "compare": "<", "float32": True}
+    if encoder is not None:
+        # Raw edges compare as raw <= edge in float64, like BinEncoder.transform
+        meta.update({"n_features": len(encoder.thresholds), "compare": "<=", "float32": False})
+    return _finish(parts, tree_class, base, meta)
+
+def export(model) -> FlatForest:
+    """Dispatch on the estimator type (a BinnedModel wrapper is unwrapped)."""
+    encoder = getattr(model, "encoder", None)
+    inner = getattr(model, "model", model)
+    name = type(inner).__name__
+    if name in ("RandomForestClassifier", "ExtraTreesClassifier"):
+        return from_random_forest(inner)
+    if name == "AdaBoostClassifier":
+        return from_adaboost(inner)
+    if name == "HistGradientBoostingClassifier":
+        return from_hist_gradient_boosting(inner, encoder)
+    if name == "XGBClassifier":
+        return from_xgboost(inner, encoder)
+    raise ValueError(f"No flat export for {name}")
+
+def _time_calls(fn, X, repeat: int = 20) -> float:
+    fn(X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat
+
+def main(model_path: Path, out_path: Path, check_csv: Path = None, features: list = None):
+    import joblib
+
+    from serve_model import features_for
+
+    model = joblib.load(model_path)
+    flat = export(model)
+    # Keep the training feature order with the arrays so serve_model.py can load the .npz alone
+    features = features_for(model_path, features)
+    flat.meta["features"] = features
+    flat.save(out_path)
+    print(f"[OK] Wrote: {out_path}  (trees={flat.meta['n_trees']}, nodes={flat.meta['n_nodes']}, "
+          f"max_depth={flat.max_depth}, {out_path.stat().st_size / 1e6:.1f} MB)")
+
+    if check_csv is not None:
+        import pandas as pd
+        X = pd.read_csv(check_csv, usecols=features)[features].to_numpy()
+        start = time.perf_counter()
+        ref = np.asarray(model.predict(X))
+        t_ref = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = FlatForest.load(out_path)
+        t_load = time.perf_counter() - start
+        start = time.perf_counter()
+        got = loaded.predict(X)
+        t_flat = time.perf_counter() - start
+        mismatch = int((ref != got).sum())
+        print(f"[INFO] Load {1000 * t_load:.1f} ms | predict {len(X)} rows: model {t_ref:.3f}s, flat {t_flat:.3f}s")
+        # Live scoring sends a handful of rows at a time; that is where the flat arrays pay off
+        for size in (1, 8):
+            per_call = [min(_time_calls(fn, X[:size]) for _ in range(3)) for fn in (model.predict, loaded.predict)]
+            print(f"[INFO] {size}-row batch: model {1000 * per_call[0]:.2f} ms, flat {1000 * per_call[1]:.2f} ms")
+        # Same rows with a NaN in every 5th row (cycling through the features): missing-value routing
+        X_nan = X.astype(np.float64)
+        rows = np.arange(0, len(X), 5)
+        X_nan[rows, rows % X.shape[1]] = np.nan
+        try:
+            ref_nan = np.asarray(model.predict(X_nan))
+        except ValueError:
+            rows = rows[:0]
+            print("[INFO] NaN check skipped: the model does not accept missing values")
+        else:
+            nan_mismatch = int((ref_nan != loaded.predict(X_nan)).sum())
+            if nan_mismatch:
+                print(f"[WARN] {nan_mismatch} of {len(X)} predictions differ with missing values", file=sys.stderr)
+            mismatch += nan_mismatch
+        if mismatch:
+            print(f"[WARN] {mismatch} of {len(X)} predictions differ", file=sys.stderr)
+            return 1
+        print(f"[OK] Identical predictions on {len(X)} rows" + (f", and with NaN in {len(rows)} of them" if len(rows) else ""))
+    return 0
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Export a tree ensemble to flat arrays with a NumPy-only predictor")
+    p.add_argument("--model", required=True, type=str, help="joblib model (RandomForest, AdaBoost, HistGB or XGBoost)")
+    p.add_argument("--out", required=True, type=str, help="Output .npz")
+    p.add_argument("--check", type=str, default=None, help="CSV to compare predictions with the source model")
+    p.add_argument("--features", type=str, default=None, help="Comma list of feature columns for --check")
+    args = p.parse_args()
+    sys.exit(main(Path(args.model), Path(args.out), Path(args.check) if args.check else None,
+                  args.features.split(",") if args.features else None))